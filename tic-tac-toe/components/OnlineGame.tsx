@@ -13,6 +13,9 @@ import * as API from '@/utils/api';
 
 type GameState = 'waiting' | 'playing' | 'finished';
 
+const DEFAULT_POLL_MS = 2000; // si el servidor no sugiere intervalo
+const MAX_RETRY_AFTER_MS = 30000; // tope para el Retry-After de un 429
+
 /**
  * Componente del juego en modo online (conectado al backend)
  */
@@ -25,11 +28,13 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
   const [mySymbol, setMySymbol] = useState<'X' | 'O' | null>(null);
   const [currentTurn, setCurrentTurn] = useState<string | null>(null);
   const [winner, setWinner] = useState<string | null>(null);
+  const [draw, setDraw] = useState(false);
   const [loading, setLoading] = useState(false);
   const [searchingMatch, setSearchingMatch] = useState(false); // Nuevo estado para búsqueda
   const [error, setError] = useState<string | null>(null);
-  const [stats, setStats] = useState({ wins: 0, losses: 0 });
+  const [stats, setStats] = useState({ wins: 0, losses: 0, draws: 0 });
   
+  /* Los sondeos usan setTimeout encadenado con el intervalo que sugiere el servidor */
   const pollingInterval = useRef<NodeJS.Timeout | null>(null);
   const searchInterval = useRef<NodeJS.Timeout | null>(null); // Nuevo intervalo para búsqueda
 
@@ -40,10 +45,10 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
     registerDevice();
     return () => {
       if (pollingInterval.current) {
-        clearInterval(pollingInterval.current);
+        clearTimeout(pollingInterval.current);
       }
       if (searchInterval.current) {
-        clearInterval(searchInterval.current);
+        clearTimeout(searchInterval.current);
       }
     };
   }, []);
@@ -52,18 +57,24 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
    * Inicia el polling del estado de la partida cuando hay un matchId
    */
   useEffect(() => {
-    if (matchId && gameState === 'playing') {
-      pollingInterval.current = setInterval(() => {
-        syncMatchState();
-      }, 2000);
+    let active = matchId !== null && gameState === 'playing';
+    const poll = async () => {
+      const delay = await syncMatchState();
+      if (active) {
+        pollingInterval.current = setTimeout(poll, delay ?? DEFAULT_POLL_MS);
+      }
+    };
+    if (active) {
+      pollingInterval.current = setTimeout(poll, DEFAULT_POLL_MS);
     } else if (pollingInterval.current) {
-      clearInterval(pollingInterval.current);
+      clearTimeout(pollingInterval.current);
       pollingInterval.current = null;
     }
 
     return () => {
+      active = false;
       if (pollingInterval.current) {
-        clearInterval(pollingInterval.current);
+        clearTimeout(pollingInterval.current);
       }
     };
   }, [matchId, gameState]);
@@ -92,7 +103,7 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
     if (!deviceId) return;
     try {
       const deviceStats = await API.getDeviceInfo(deviceId);
-      setStats({ wins: deviceStats.wins, losses: deviceStats.losses });
+      setStats({ wins: deviceStats.wins, losses: deviceStats.losses, draws: deviceStats.draws });
     } catch (err) {
       console.error('Error cargando estadísticas:', err);
     }
@@ -131,16 +142,13 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
     setSearchingMatch(true);
     setError('Buscando oponente...');
     
-    /* Intentar crear/unirse a partida */
-    const tryMatch = async () => {
+    /* Intentar crear/unirse a partida. Devuelve true al terminar la búsqueda
+       o los milisegundos que sugiere el servidor antes de reintentar */
+    const tryMatch = async (): Promise<true | number> => {
       try {
         /* Primero verificar si ya hay una partida creada para mí */
         const hasMatch = await checkExistingMatch();
         if (hasMatch) {
-          if (searchInterval.current) {
-            clearInterval(searchInterval.current);
-            searchInterval.current = null;
-          }
           return true;
         }
         
@@ -159,42 +167,32 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
         setError(null);
         setSearchingMatch(false);
         
-        /* Detener búsqueda */
-        if (searchInterval.current) {
-          clearInterval(searchInterval.current);
-          searchInterval.current = null;
-        }
-        
         return true;
       } catch (err: any) {
         /* Si es error 202, significa que está en lobby esperando */
-        if (err.message && err.message.includes('202')) {
-          return false; // Seguir intentando
+        if (err.status === 202) {
+          return API.retryAfterMs(err, DEFAULT_POLL_MS); // Seguir intentando
+        }
+        /* 429: el servidor pide frenar (Retry-After en segundos) */
+        if (err.status === 429) {
+          return Math.min(API.retryAfterMs(err, DEFAULT_POLL_MS * 2), MAX_RETRY_AFTER_MS);
         }
         /* Otro error */
         setError(err.message || 'Error al crear la partida');
         setSearchingMatch(false);
-        if (searchInterval.current) {
-          clearInterval(searchInterval.current);
-          searchInterval.current = null;
-        }
         return true; // Detener búsqueda por error
       }
     };
     
-    /* Primer intento */
-    const matched = await tryMatch();
-    
-    if (!matched) {
-      /* No se emparejó, seguir intentando cada 2 segundos */
-      searchInterval.current = setInterval(async () => {
-        const result = await tryMatch();
-        if (result && searchInterval.current) {
-          clearInterval(searchInterval.current);
-          searchInterval.current = null;
-        }
-      }, 2000);
-    }
+    /* Reintentar con el intervalo sugerido hasta emparejar o fallar */
+    const search = async () => {
+      searchInterval.current = null;
+      const result = await tryMatch();
+      if (result !== true) {
+        searchInterval.current = setTimeout(search, result);
+      }
+    };
+    await search();
   };
   
   /**
@@ -202,7 +200,7 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
    */
   const cancelSearch = () => {
     if (searchInterval.current) {
-      clearInterval(searchInterval.current);
+      clearTimeout(searchInterval.current);
       searchInterval.current = null;
     }
     setSearchingMatch(false);
@@ -210,20 +208,22 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
   };
 
   /**
-   * Sincroniza el estado de la partida con el servidor
+   * Sincroniza el estado de la partida con el servidor.
+   * Devuelve el intervalo de sondeo sugerido por el servidor (ms).
    */
-  const syncMatchState = async (mId?: string) => {
+  const syncMatchState = async (mId?: string): Promise<number | undefined> => {
     const id = mId || matchId;
     if (!id) return;
     
     try {
-      const state = await API.getMatchState(id);
-      setBoard(state.board);
+      const state = await API.getMatchState(id, deviceId ?? undefined);
+      if (state.board) setBoard(state.board); // el cliente solo ofrece tableros de 3 a 7
       setBoardSize(state.size);
       setCurrentTurn(state.turn);
       setWinner(state.winner);
+      setDraw(state.draw);
       
-      if (state.winner) {
+      if (state.winner || state.draw) {
         setGameState('finished');
         await loadStats();
       }
@@ -235,7 +235,12 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
         setError('Tu oponente abandonó la partida. ¡Ganaste!');
         await loadStats();
       }
+      return state.retry_after_ms;
     } catch (err: any) {
+      /* 429: el servidor pide frenar (Retry-After en segundos) */
+      if (err.status === 429) {
+        return Math.min(API.retryAfterMs(err, DEFAULT_POLL_MS * 2), MAX_RETRY_AFTER_MS);
+      }
       /* Si la partida no existe o fue eliminada */
       if (err.message && (err.message.includes('404') || err.message.includes('no encontrada'))) {
         if (gameState === 'playing') {
@@ -271,11 +276,12 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
     try {
       setLoading(true);
       const result = await API.makeMove(matchId, deviceId, x, y);
-      setBoard(result.board);
+      if (result.board) setBoard(result.board);
       setCurrentTurn(result.next_turn);
       setWinner(result.winner);
+      setDraw(result.draw);
       
-      if (result.winner) {
+      if (result.winner || result.draw) {
         setGameState('finished');
         await loadStats();
       }
@@ -327,6 +333,7 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
     setMySymbol(null);
     setCurrentTurn(null);
     setWinner(null);
+    setDraw(false);
     setGameState('waiting');
     setError(null);
   };
@@ -339,7 +346,7 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
     try {
       setLoading(true);
       await API.resetDeviceStats(deviceId);
-      setStats({ wins: 0, losses: 0 });
+      setStats({ wins: 0, losses: 0, draws: 0 });
       setError(null);
     } catch (err: any) {
       setError(err.message || 'Error al reiniciar estadísticas');
@@ -363,7 +370,9 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
   const isMyTurn = currentTurn === deviceId;
   const status = winner
     ? `Ganador: ${winner}${winner === mySymbol ? ' (¡Tú!)' : ''}`
-    : gameState === 'playing'
+    : draw
+      ? 'Empate: ya nadie puede hacer línea'
+      : gameState === 'playing'
       ? isMyTurn
         ? `Tu turno (${mySymbol})`
         : `Turno del oponente (${mySymbol === 'X' ? 'O' : 'X'})`
@@ -503,6 +512,7 @@ export function OnlineGame({ onBackToMenu }: { onBackToMenu: () => void }) {
               <Text style={styles.controlsTitle}>Estadísticas Online</Text>
               <Text style={styles.statText}>Victorias: {stats.wins}</Text>
               <Text style={styles.statText}>Derrotas: {stats.losses}</Text>
+              <Text style={styles.statText}>Empates: {stats.draws}</Text>
               <Text style={styles.statText}>
                 Ratio: {stats.wins + stats.losses > 0
                   ? (stats.wins / (stats.wins + stats.losses)).toFixed(2)
@@ -0,0 +1,146 @@
+"""
+Registro de accesos en JSON sin escribir desde las peticiones.
+
+Cada petición deja una tupla en una cola acotada en memoria y sigue;
+un hilo la vacía por lotes, convierte cada registro en una línea JSON
+y la escribe con un solo write por lote. Si la cola está llena el
+registro se descarta y se cuenta en `dropped` (nunca se bloquea una
+petición por el disco). Cuando el fichero supera `max_bytes` se rota
+como logging.handlers.RotatingFileHandler: access.log -> access.log.1
+-> ... -> access.log.<backups>.
+
+El mismo escritor sirve para otros registros en líneas JSON (los spans
+de tracing.py) pasándole otra función `encode`.
+"""
+
+import json
+import os
+import queue
+import threading
+
+FIELDS = ("ts", "method", "path", "endpoint", "status", "device_id", "match_id", "duration_us")
+
+
+def encode_access(record):
+    """Línea JSON de un registro de acceso (tupla en el orden de FIELDS)."""
+    return json.dumps(dict(zip(FIELDS, record)), separators=(",", ":"))
+
+
+class AccessLog:
+    """Cola acotada de registros de acceso con un hilo escritor."""
+
+    def __init__(
+        self,
+        path,
+        max_queue=10000,
+        batch_size=512,
+        flush_interval=0.2,
+        max_bytes=10 * 1024 * 1024,
+        backups=3,
+        encode=encode_access,
+    ):
+        self.path = str(path)
+        self.encode = encode  # registro -> línea JSON, en el hilo escritor
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = False
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self._queue = queue.Queue(max_queue)
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- peticiones ----------
+    def log(self, record):
+        """Encola un registro (lo que espera `encode`). No bloquea nunca."""
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "rotations": self.rotations,
+        }
+
+    # ---------- escritura ----------
+    def _take_batch(self, timeout):
+        # Espera al primer registro y recoge sin esperar los que ya haya
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        data = "".join(self.encode(record) + "\n" for record in batch).encode()
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        if self._file.tell() and self._file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self.written += len(batch)
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab")
+        self.rotations += 1
+
+    def flush(self):
+        """Escribe todo lo encolado. Se llama con el hilo escritor detenido."""
+        while True:
+            batch = self._take_batch(timeout=0)
+            if not batch:
+                return
+            self._write(batch)
+
+    # ---------- ciclo de vida ----------
+    def start(self):
+        """Empieza a aceptar registros y arranca el hilo escritor."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.enabled = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._write_loop, name="access-log", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Detiene el hilo y escribe los registros pendientes."""
+        self.enabled = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            batch = self._take_batch(timeout=self.flush_interval)
+            if batch:
+                self._write(batch)
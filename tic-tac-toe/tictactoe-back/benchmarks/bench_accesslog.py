@@ -0,0 +1,93 @@
+"""
+Latencia de las peticiones con el registro de accesos.
+
+Mide GET /devices/<id>/info con el cliente de pruebas de Flask en tres
+modos:
+
+- sin registro
+- síncrono:  json.dumps + write + flush en la propia petición
+- cola:      AccessLog (tupla a una cola acotada, escribe un hilo)
+
+y muestra la mediana, el p99 y el máximo por petición.
+
+    uv run python benchmarks/bench_accesslog.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import create_app  # noqa: E402
+from accesslog import FIELDS  # noqa: E402
+
+REQUESTS = 20000
+
+
+def sync_logger(path):
+    """Versión síncrona: cada petición serializa y escribe su línea."""
+    log_file = open(path, "ab")
+
+    def write(record):
+        log_file.write((json.dumps(dict(zip(FIELDS, record))) + "\n").encode())
+        log_file.flush()
+
+    return log_file, write
+
+
+def run(mode, tmp):
+    app = create_app(
+        {
+            "DOCS": False,
+            "RATE_LIMIT_ENABLED": False,
+            "MOVE_JOURNAL_PATH": os.path.join(tmp, f"{mode}.journal"),
+            "STATE_DIR": os.path.join(tmp, f"state-{mode}"),
+            "ACCESS_LOG_PATH": os.path.join(tmp, f"{mode}.log"),
+        }
+    )
+    access_log = app.extensions["access_log"]
+    sync_file = None
+    if mode == "cola":
+        access_log.start()
+    elif mode == "síncrono":
+        sync_file, write = sync_logger(os.path.join(tmp, "sync.log"))
+        access_log.enabled = True
+        access_log.log = write
+    client = app.test_client()
+    device_id = client.post("/devices").get_json()["device_id"]
+    url = f"/devices/{device_id}/info"
+    samples = []
+    for _ in range(REQUESTS):
+        start = perf_counter()
+        client.get(url)
+        samples.append(perf_counter() - start)
+    if mode == "cola":
+        access_log.close()
+        dropped = access_log.dropped
+    else:
+        dropped = 0
+    if sync_file is not None:
+        sync_file.close()
+    app.extensions["tictactoe"].close()
+    samples.sort()
+    return samples, dropped
+
+
+def main():
+    print(f"{'modo':>10} {'p50 us':>8} {'p99 us':>8} {'máx us':>8} {'descartados':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("sin", "síncrono", "cola"):
+            samples, dropped = run(mode, tmp)
+            p50 = samples[len(samples) // 2]
+            p99 = samples[int(len(samples) * 0.99)]
+            print(
+                f"{mode:>10} {p50 * 1e6:8.0f} {p99 * 1e6:8.0f}"
+                f" {samples[-1] * 1e6:8.0f} {dropped:12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Creación de una ronda de torneo de 4096 jugadores.
+
+Compara POST /matches/bulk (una petición) con emparejar las mismas
+2048 partidas a través del lobby (dos peticiones por partida). Usa el
+cliente de pruebas de Flask, así que no incluye la red.
+
+    uv run python benchmarks/bench_bulk.py
+"""
+
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import create_app  # noqa: E402
+
+
+def register(tmp, n, label):
+    """Aplicación nueva (estado vacío) con n dispositivos registrados."""
+    app = create_app(
+        {
+            "DOCS": False,
+            "RATE_LIMIT_ENABLED": False,
+            "MOVE_JOURNAL_PATH": os.path.join(tmp, f"{label}.journal"),
+            "STATE_DIR": os.path.join(tmp, label),
+        }
+    )
+    client = app.test_client()
+    return client, [client.post("/devices").get_json()["device_id"] for _ in range(n)]
+
+
+def main(players=4096):
+    with tempfile.TemporaryDirectory() as tmp:
+        client, ids = register(tmp, players, "bulk")
+        pairs = [{"players": ids[i : i + 2]} for i in range(0, players, 2)]
+        start = perf_counter()
+        data = client.post("/matches/bulk", json={"matches": pairs}).get_json()
+        bulk = perf_counter() - start
+
+        client, ids = register(tmp, players, "lobby")
+        start = perf_counter()
+        for i in range(0, players, 2):
+            client.post("/matches", json={"device_id": ids[i], "size": 3})
+            client.post("/matches", json={"device_id": ids[i + 1], "size": 3})
+        lobby = perf_counter() - start
+
+    print(f"jugadores:           {players}")
+    print(f"partidas creadas:    {data['created']}")
+    print(f"POST /matches/bulk:  {bulk * 1000:.1f} ms")
+    print(f"lobby (2 por par):   {lobby * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Tableros grandes: coste por movimiento y memoria por partida.
+
+Juega las mismas fichas sin ganador (hasta 300) en tableros de 7, 15
+y 19 con tres representaciones:
+
+- lista:    cuadrícula de cadenas y comprobación de todo el tablero tras
+            cada movimiento (lo que hacía check_winner)
+- dict:     solo las casillas ocupadas ({casilla: símbolo}) y
+            comprobación de las líneas que pasan por la última ficha
+- bytes:    un byte por casilla y la misma comprobación incremental
+            (game.place y game.wins_from, lo que usa el servidor)
+
+Después mide la petición completa de movimiento en 19x19 con el
+cliente de pruebas de Flask.
+
+    uv run python benchmarks/bench_gomoku.py
+"""
+
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from game import in_line, place, wins_from  # noqa: E402
+from main import create_app  # noqa: E402
+
+MATCHES = 200  # partidas para medir la memoria
+
+
+def moves(size, limit=300):
+    """
+    Fichas alternas X/O sin ninguna línea ganadora: con el patrón
+    (x + 2y) % 4 no hay más de dos iguales seguidas en ninguna dirección.
+    """
+    xs, os_ = [], []
+    for x in range(size):
+        for y in range(size):
+            (xs if (x + 2 * y) % 4 < 2 else os_).append((x, y))
+    sequence = [cell for pair in zip(xs, os_) for cell in pair]
+    return sequence[:limit]
+
+
+def dense_winner(board, size):
+    """Comprobación completa del tablero (versión anterior)."""
+    n = in_line(size)
+    lines = []
+    for i in range(size):
+        for j in range(size - n + 1):
+            lines.append(board[i][j : j + n])
+            lines.append([board[j + k][i] for k in range(n)])
+    for i in range(size - n + 1):
+        for j in range(size - n + 1):
+            lines.append([board[i + k][j + k] for k in range(n)])
+            lines.append([board[i + k][j + n - 1 - k] for k in range(n)])
+    for line in lines:
+        if len(set(line)) == 1 and line[0] in ("X", "O"):
+            return line[0]
+    return None
+
+
+class SparseCells(dict):
+    """Casillas ocupadas en un dict, con la interfaz de bytearray que usa game.py."""
+
+    def __getitem__(self, index):
+        return self.get(index, 0)
+
+
+def new_match(size, mode):
+    cells = {"lista": None, "dict": SparseCells(), "bytes": bytearray(size * size)}[mode]
+    return {
+        "size": size,
+        "board": [[""] * size for _ in range(size)] if mode == "lista" else None,
+        "cells": cells,
+    }
+
+
+def play(size, mode, sequence):
+    match = new_match(size, mode)
+    start = perf_counter()
+    for turn, (x, y) in enumerate(sequence):
+        symbol = "XO"[turn % 2]
+        place(match, x, y, symbol)
+        if mode == "lista":
+            assert dense_winner(match["board"], size) is None
+        else:
+            assert not wins_from(match, x, y, symbol)
+    return (perf_counter() - start) / len(sequence)
+
+
+def bytes_per_match(size, mode, sequence):
+    gc.collect()
+    tracemalloc.start()
+    kept = []
+    for _ in range(MATCHES):
+        match = new_match(size, mode)
+        for turn, (x, y) in enumerate(sequence):
+            place(match, x, y, "XO"[turn % 2])
+        kept.append(match)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memory / MATCHES
+
+
+def http_moves(sequence):
+    """Movimientos a través de la API en 19x19 (la petición completa)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(
+            {
+                "DOCS": False,
+                "RATE_LIMIT_ENABLED": False,
+                "MOVE_JOURNAL_PATH": os.path.join(tmp, "moves.journal"),
+                "STATE_DIR": os.path.join(tmp, "state"),
+            }
+        )
+        client = app.test_client()
+        d1 = client.post("/devices").get_json()["device_id"]
+        d2 = client.post("/devices").get_json()["device_id"]
+        client.post("/matches", json={"device_id": d1, "size": 19})
+        match = client.post("/matches", json={"device_id": d2, "size": 19}).get_json()
+        turn = next(pid for pid, sym in match["players"].items() if sym == "X")
+        other = d2 if turn == d1 else d1
+        sizes = []
+        start = perf_counter()
+        for x, y in sequence:
+            res = client.post(
+                f"/matches/{match['match_id']}/moves", json={"device_id": turn, "x": x, "y": y}
+            )
+            assert res.status_code == 200, res.get_json()
+            sizes.append(len(res.data))
+            turn, other = other, turn
+        elapsed = perf_counter() - start
+        app.extensions["tictactoe"].close()
+    return elapsed / len(sequence), max(sizes)
+
+
+def main():
+    print(f"{'tamaño':>6} {'fichas':>6} {'modo':>9} {'us/mov':>8} {'bytes/partida':>14}")
+    for size in (7, 15, 19):
+        sequence = moves(size)
+        for mode in ("lista", "dict", "bytes"):
+            per_move = play(size, mode, sequence)
+            memory = bytes_per_match(size, mode, sequence)
+            print(
+                f"{size:6} {len(sequence):6} {mode:>9}"
+                f" {per_move * 1e6:8.1f} {memory:14.0f}"
+            )
+    per_request, largest = http_moves(moves(19))
+    print(f"API 19x19, 300 fichas: {per_request * 1e6:.0f} us/movimiento, respuesta máx. {largest} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Claves UUID frente a handles enteros internos con 500k dispositivos.
+
+Construye devices y matches con la misma forma que main.py usando tres
+esquemas de identificadores:
+
+- str:    los UUID tal cual (lo que hace el servidor)
+- intern: los UUID pasados por sys.intern en la frontera de la API
+- int:    handles enteros + mapa bidireccional UUID <-> handle
+
+Los IDs llegan como cadenas nuevas en cada petición (igual que al
+leerlas del JSON), así que los esquemas intern e int pagan la
+traducción en la frontera. Mide memoria por dispositivo y el coste de
+una petición tipo (buscar partida, comprobar jugador y turno, tocar el
+dispositivo y leer su rating).
+
+    uv run python benchmarks/bench_ids.py
+"""
+
+import gc
+import json
+import sys
+import tracemalloc
+from time import perf_counter
+from uuid import uuid4
+
+
+class IdScheme:
+    def __init__(self, mode):
+        self.mode = mode
+        self.handles = {}  # {uuid: handle}
+        self.external = {}  # {handle: uuid}
+
+    def key(self, external_id, create=False):
+        if self.mode == "int":
+            handle = self.handles.get(external_id)
+            if handle is None and create:
+                handle = len(self.external) + 1000  # fuera de la caché de enteros pequeños
+                self.external[handle] = external_id
+                self.handles[external_id] = handle
+            return handle
+        if self.mode == "intern":
+            return sys.intern(external_id)
+        return external_id
+
+
+def from_request(external_id):
+    """Copia nueva de la cadena, como la que produce el parser JSON."""
+    return json.loads(json.dumps(external_id))
+
+
+def build(scheme, device_ids, match_ids):
+    devices, matches = {}, {}
+    for device_id in device_ids:
+        devices[scheme.key(from_request(device_id), create=True)] = {
+            "last_active": 0.0,
+            "wins": 0,
+            "losses": 0,
+            "alias": device_id[:8],
+            "rating": 1200.0,
+            "active_match": None,
+        }
+    for i, match_id in enumerate(match_ids):
+        x = scheme.key(from_request(device_ids[2 * i]))
+        o = scheme.key(from_request(device_ids[2 * i + 1]))
+        matches[scheme.key(from_request(match_id), create=True)] = {
+            "players": {x: "X", o: "O"},
+            "turn": x,
+            "board": [[""] * 3 for _ in range(3)],
+            "ratings": {x: 1200.0, o: 1200.0},
+        }
+    return devices, matches
+
+
+def requests_per_second(scheme, devices, matches, sample):
+    best = float("inf")
+    for _ in range(5):
+        start = perf_counter()
+        for match_id, device_id in sample:
+            match = matches[scheme.key(match_id)]
+            device_id = scheme.key(device_id)
+            if device_id in match["players"] and match["turn"] == device_id:
+                devices[device_id]["last_active"] = 1.0
+            match["ratings"][device_id]
+        best = min(best, perf_counter() - start)
+    return best / len(sample)
+
+
+def main(n_devices=500_000, n_requests=200_000):
+    device_ids = [str(uuid4()) for _ in range(n_devices)]
+    match_ids = [str(uuid4()) for _ in range(n_devices // 2)]
+    sample = [
+        (from_request(match_ids[i // 2]), from_request(device_ids[i]))
+        for i in range(n_requests)
+    ]
+    print(f"dispositivos: {n_devices}, partidas: {len(match_ids)}")
+    for mode in ("str", "intern", "int"):
+        scheme = IdScheme(mode)
+        gc.collect()
+        tracemalloc.start()
+        devices, matches = build(scheme, device_ids, match_ids)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        per_request = requests_per_second(scheme, devices, matches, sample)
+        print(
+            f"{mode:7} {memory / n_devices:6.0f} bytes/dispositivo"
+            f" {per_request * 1e9:6.0f} ns/petición"
+        )
+        del devices, matches, scheme
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Sondeo del lobby frente a espera larga (POST /matches?wait=).
+
+Llegan jugadores de dos en dos con el mismo tamaño de tablero, separados
+por un tiempo aleatorio. El primero de cada pareja espera rival:
+
+- sondeo:  repite POST /matches cada retry_after_ms (lo que hace hoy el
+           cliente, 2 s con rivales en el lobby y 5 s sin ellos)
+- espera:  POST /matches?wait=20 y, si vence, vuelve a empezar
+
+Mide cuánto tarda el que espera en enterarse de su partida desde que
+llega su rival y cuántas peticiones hace. Todo va en el mismo proceso
+con el cliente de pruebas de Flask, un hilo por jugador.
+
+    uv run python benchmarks/bench_longpoll.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+from statistics import mean, median
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import create_app  # noqa: E402
+
+PAIRS = 14
+SIZES = (3, 4, 5, 6, 7, 15, 19)  # un tamaño por pareja en curso: no se cruzan
+GAP = (1.0, 4.0)  # segundos entre que llega el primero de la pareja y el segundo
+
+
+def waiter(app, device_id, size, long_poll, result):
+    client = app.test_client()
+    url = "/matches?wait=20" if long_poll else "/matches"
+    requests = 0
+    while True:
+        res = client.post(url, json={"device_id": device_id, "size": size})
+        requests += 1
+        if res.status_code == 201:
+            result.update(requests=requests, matched_at=perf_counter())
+            return
+        if not long_poll:
+            sleep(res.get_json()["retry_after_ms"] / 1000)
+
+
+def run(long_poll, seed=1):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(
+            {
+                "DOCS": False,
+                "RATE_LIMIT_ENABLED": False,
+                "MOVE_JOURNAL_PATH": os.path.join(tmp, "moves.journal"),
+                "STATE_DIR": os.path.join(tmp, "state"),
+                "ACCESS_LOG_PATH": "",
+            }
+        )
+        client = app.test_client()
+        delays, requests, threads = [], [], []
+
+        def pair(size, gap):
+            first = client.post("/devices").get_json()["device_id"]
+            second = client.post("/devices").get_json()["device_id"]
+            result = {}
+            thread = threading.Thread(target=waiter, args=(app, first, size, long_poll, result))
+            thread.start()
+            sleep(gap)
+            arrived = perf_counter()
+            app.test_client().post("/matches", json={"device_id": second, "size": size})
+            thread.join()
+            delays.append(result["matched_at"] - arrived)
+            requests.append(result["requests"])
+
+        for i in range(PAIRS):
+            thread = threading.Thread(
+                target=pair, args=(SIZES[i % len(SIZES)], rng.uniform(*GAP))
+            )
+            thread.start()
+            threads.append(thread)
+            sleep(1.0)
+        for thread in threads:
+            thread.join()
+        app.extensions["tictactoe"].close()
+    return delays, requests
+
+
+def main():
+    print(f"{'modo':>7} {'retraso mediana':>16} {'retraso máx':>12} {'peticiones/jugador':>19}")
+    for name, long_poll in (("sondeo", False), ("espera", True)):
+        delays, requests = run(long_poll)
+        print(
+            f"{name:>7} {median(delays) * 1000:13.1f} ms {max(delays) * 1000:9.1f} ms"
+            f" {mean(requests):19.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
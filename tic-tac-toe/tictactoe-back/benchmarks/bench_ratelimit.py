@@ -0,0 +1,47 @@
+"""
+Coste del control de admisión por petición.
+
+Mide TokenBucketLimiter.allow() con 100k cubos activos (dispositivos)
+y la memoria aproximada por cubo.
+
+    uv run python benchmarks/bench_ratelimit.py
+"""
+
+import os
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ratelimit import TokenBucketLimiter  # noqa: E402
+
+
+def main(n_keys=100_000, n_calls=1_000_000):
+    keys = [str(uuid4()) for _ in range(n_keys)]
+    limiter = TokenBucketLimiter(rate=2.0, burst=10)
+
+    tracemalloc.start()
+    for key in keys:
+        limiter.allow(key, 0.0)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sample = [random.choice(keys) for _ in range(n_calls)]
+    start = perf_counter()
+    now = 1.0
+    for key in sample:
+        limiter.allow(key, now)
+        now += 1e-6
+    elapsed = perf_counter() - start
+
+    print(f"cubos:               {n_keys}")
+    print(f"memoria por cubo:    {memory / n_keys:.0f} bytes")
+    print(f"allow():             {elapsed / n_calls * 1e6:.2f} us/llamada")
+    print(f"rechazadas:          {limiter.rejected}")
+
+
+if __name__ == "__main__":
+    main()
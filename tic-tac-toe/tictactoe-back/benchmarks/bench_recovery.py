@@ -0,0 +1,121 @@
+"""
+Benchmark de recuperación: snapshot + diario de cambios.
+
+Genera 100k dispositivos, 10k partidas y un lobby, toma un snapshot,
+aplica cambios posteriores y mide el arranque en frío completo:
+GameState(...).restore(), que además de leer el snapshot y el diario
+reconstruye los índices (dispositivos, clasificación, lobby). También
+muestra por separado lo que tarda solo StateStore.restore().
+
+    uv run python benchmarks/bench_recovery.py [n_dispositivos]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from statistics import median
+from time import perf_counter, time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from game import GameState, track_lines  # noqa: E402
+from persistence import StateStore  # noqa: E402
+
+RUNS = 5  # arranques medidos; se muestra la mediana
+
+
+def build_state(n_devices):
+    now = time()
+    devices = {
+        str(uuid4()): {
+            "last_active": now,
+            "wins": i % 7,
+            "losses": i % 5,
+            "draws": i % 3,
+            "alias": f"dev{i}",
+            "rating": 1200.0 + i % 400,
+            "active_match": None,
+        }
+        for i in range(n_devices)
+    }
+    ids = list(devices)
+    matches = {}
+    for i in range(0, min(len(ids), 20_000) - 1, 2):
+        size = 3 + i % 5
+        match_id = str(uuid4())
+        matches[match_id] = {
+            "index": i // 2,
+            "players": {ids[i]: "X", ids[i + 1]: "O"},
+            "turn": ids[i],
+            "board": [["" for _ in range(size)] for _ in range(size)],
+            "size": size,
+            "winner": None,
+            "draw": False,
+            "cells": None,
+            "moves": 0,
+            "version": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        track_lines(matches[match_id])  # como las partidas creadas por el servidor
+    lobby = {d: {"size": 3, "timestamp": now, "rating": 1200.0} for d in ids[-1000:]}
+    return {"devices": devices, "matches": matches, "waiting_lobby": lobby}
+
+
+def restore_game(directory):
+    """Arranque en frío como el del servidor; devuelve (segundos, estado)."""
+    start = perf_counter()
+    game = GameState(os.path.join(directory, "moves.journal"), directory)
+    game.restore()
+    elapsed = perf_counter() - start
+    game.store.close()  # sin volcar: el siguiente arranque lee lo mismo
+    game.move_journal.close()
+    return elapsed, game
+
+
+def main(n_devices):
+    with tempfile.TemporaryDirectory() as directory:
+        tables = build_state(n_devices)
+        tables.update(histories={}, stats={})  # el resto de tablas de GameState
+        store = StateStore(directory, tables, threading.RLock())
+        store.enabled = True
+
+        start = perf_counter()
+        store.snapshot()
+        snapshot_time = perf_counter() - start
+
+        # Cambios posteriores al snapshot (van al diario)
+        for i, device_id in enumerate(list(tables["devices"])[:10_000]):
+            tables["devices"][device_id]["wins"] += 1
+            store.mark_dirty("devices", device_id)
+            if i % 100 == 0:
+                store.flush()
+        store.close()
+
+        size = os.path.getsize(os.path.join(directory, "snapshot.bin"))
+        store_times = []
+        for _ in range(RUNS):
+            fresh = {name: {} for name in tables}
+            start = perf_counter()
+            applied = StateStore(directory, fresh, threading.RLock()).restore()
+            store_times.append(perf_counter() - start)
+        assert fresh["devices"].keys() == tables["devices"].keys()
+
+        game_times = []
+        for _ in range(RUNS):
+            elapsed, game = restore_game(directory)
+            game_times.append(elapsed)
+        assert len(game.leaderboard) == len(game.device_index) == n_devices
+
+        print(f"dispositivos:          {n_devices}")
+        print(f"partidas:              {len(tables['matches'])}")
+        print(f"snapshot:              {size / 1e6:.1f} MB en {snapshot_time * 1000:.0f} ms (fork)")
+        print(f"lotes del diario:      {applied}")
+        print(f"StateStore.restore():  {median(store_times) * 1000:.0f} ms (mediana de {RUNS})")
+        print(f"GameState.restore():   {median(game_times) * 1000:.0f} ms (mediana de {RUNS}, arranque completo)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
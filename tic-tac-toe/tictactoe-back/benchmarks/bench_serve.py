@@ -0,0 +1,162 @@
+"""
+Servidor de desarrollo frente a serve.py con la misma mezcla de peticiones.
+
+Arranca la API con `python main.py` (Werkzeug con el depurador, lo que
+se usaba hasta ahora) y con `python serve.py`, y lanza varios procesos
+de carga con conexiones keep-alive que juegan y sincronizan partidas de
+7x7 y consultan su dispositivo (la mezcla de bench_sharding.py). Mide
+peticiones por segundo y latencias.
+
+Después repite la carga contra serve.py enviando SIGHUP a la mitad y
+cuenta los errores y la latencia máxima durante la recarga.
+
+    uv run python benchmarks/bench_serve.py
+"""
+
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep, time
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PORT = 5450
+DURATION = 5.0
+
+SERVERS = {
+    "main.py (desarrollo)": [sys.executable, "main.py"],
+    "serve.py": [sys.executable, "serve.py", "--port", str(PORT), "--threads", "16"],
+}
+
+
+def request(conn, method, path, body=None):
+    payload = json.dumps(body).encode() if body is not None else None
+    headers = {"Content-Type": "application/json"} if payload else {}
+    conn.request(method, path, body=payload, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, json.loads(data) if data else None
+
+
+def wait_until_up():
+    for _ in range(100):
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=2)
+        try:
+            if request(conn, "GET", "/devices/count")[0] == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            conn.close()
+        sleep(0.2)
+    raise RuntimeError("el servidor no arrancó")
+
+
+def pair(conn):
+    d1 = request(conn, "POST", "/devices")[1]["device_id"]
+    d2 = request(conn, "POST", "/devices")[1]["device_id"]
+    request(conn, "POST", "/matches", {"device_id": d1, "size": 7})
+    _, match = request(conn, "POST", "/matches", {"device_id": d2, "size": 7})
+    return match
+
+
+def timed(conn, latencies, errors, method, path, body=None):
+    start = perf_counter()
+    try:
+        status, data = request(conn, method, path, body)
+    except (OSError, http.client.HTTPException):
+        conn.close()  # http.client reconecta en la siguiente petición
+        errors.append(path)
+        return None, None
+    latencies.append(perf_counter() - start)
+    return status, data
+
+
+def load(match, deadline, results):
+    conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=30)
+    match_id = match["match_id"]
+    turn = next(pid for pid, sym in match["players"].items() if sym == "X")
+    other = next(pid for pid in match["players"] if pid != turn)
+    cells = [(x, y) for x in range(7) for y in range(7)]
+    latencies, errors = [], []
+    while time() < deadline:
+        if cells:
+            x, y = cells.pop(0)
+            status, _ = timed(
+                conn, latencies, errors,
+                "POST", f"/matches/{match_id}/moves", {"device_id": turn, "x": x, "y": y},
+            )
+            if status == 200:
+                turn, other = other, turn
+            elif status is not None:
+                cells = []  # partida terminada
+        timed(conn, latencies, errors, "GET", f"/matches/{match_id}?device_id={other}")
+        timed(conn, latencies, errors, "GET", f"/devices/{turn}/info")
+    results.put((latencies, len(errors)))
+
+
+def run(command, workers, reload_at=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            PORT=str(PORT),
+            STATE_DIR=os.path.join(tmp, "state"),
+            MOVE_JOURNAL_PATH=os.path.join(tmp, "moves.journal"),
+            ACCESS_LOG_PATH=os.path.join(tmp, "access.log"),
+            RATE_LIMIT_ENABLED="0",
+            API_DOCS="0",
+        )
+        server = subprocess.Popen(
+            command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_until_up()
+            conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=10)
+            games = [pair(conn) for _ in range(workers)]
+            conn.close()
+            results = multiprocessing.Queue()
+            deadline = time() + DURATION
+            processes = [
+                multiprocessing.Process(target=load, args=(game, deadline, results))
+                for game in games
+            ]
+            for process in processes:
+                process.start()
+            if reload_at is not None:
+                sleep(reload_at)
+                server.send_signal(signal.SIGHUP)
+            outcome = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+    latencies = sorted(latency for sample, _ in outcome for latency in sample)
+    errors = sum(count for _, count in outcome)
+    return latencies, errors
+
+
+def summary(latencies, errors):
+    def ms(q):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+
+    return (
+        f"{len(latencies) / DURATION:7.0f} pet/s  p50 {ms(0.5):5.1f} ms"
+        f"  p99 {ms(0.99):6.1f} ms  máx {latencies[-1] * 1000:7.1f} ms  errores {errors}"
+    )
+
+
+def main(workers=8):
+    print(f"núcleos: {os.cpu_count()}, procesos de carga: {workers}, {DURATION:.0f} s")
+    for name, command in SERVERS.items():
+        print(f"{name:22} {summary(*run(command, workers))}")
+    latencies, errors = run(SERVERS["serve.py"], workers, reload_at=DURATION / 2)
+    print(f"{'serve.py + SIGHUP':22} {summary(latencies, errors)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Rendimiento de la API con 1, 2 y 4 shards detrás del router local.
+
+Para cada configuración arranca router.py, empareja una partida por
+proceso de carga y mide peticiones por segundo de una mezcla de
+movimientos, sincronizaciones y consultas de dispositivo. El reparto
+solo escala si la máquina tiene al menos tantos núcleos como shards.
+
+    uv run python benchmarks/bench_sharding.py
+"""
+
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+from time import sleep, time
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ROUTER_PORT = 5400
+BASE_PORT = 5410
+DURATION = 5.0
+
+
+def request(conn, method, path, body=None):
+    payload = json.dumps(body).encode() if body is not None else None
+    headers = {"Content-Type": "application/json"} if payload else {}
+    conn.request(method, path, body=payload, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, json.loads(data) if data else None
+
+
+def wait_until_up(shards):
+    conn = http.client.HTTPConnection("127.0.0.1", ROUTER_PORT, timeout=2)
+    for _ in range(100):
+        try:
+            if request(conn, "GET", "/devices")[0] == 200:
+                return
+        except OSError:
+            conn.close()
+        sleep(0.2)
+    raise RuntimeError(f"el clúster de {shards} shards no arrancó")
+
+
+def pair(conn):
+    """Empareja dos dispositivos nuevos (no hay nadie más en el lobby)."""
+    d1 = request(conn, "POST", "/devices")[1]["device_id"]
+    d2 = request(conn, "POST", "/devices")[1]["device_id"]
+    request(conn, "POST", "/matches", {"device_id": d1, "size": 7})
+    _, match = request(conn, "POST", "/matches", {"device_id": d2, "size": 7})
+    return match
+
+
+def load(match, deadline, results):
+    """Juega y sincroniza una partida hasta el final del tiempo."""
+    conn = http.client.HTTPConnection("127.0.0.1", ROUTER_PORT, timeout=10)
+    match_id = match["match_id"]
+    turn = next(pid for pid, sym in match["players"].items() if sym == "X")
+    other = next(pid for pid in match["players"] if pid != turn)
+    cells = [(x, y) for x in range(7) for y in range(7)]
+    done = 0
+    while time() < deadline:
+        if cells:
+            x, y = cells.pop(0)
+            status, _ = request(
+                conn, "POST", f"/matches/{match_id}/moves", {"device_id": turn, "x": x, "y": y}
+            )
+            if status == 200:
+                turn, other = other, turn
+            else:
+                cells = []  # partida terminada
+            done += 1
+        request(conn, "GET", f"/matches/{match_id}?device_id={other}")
+        request(conn, "GET", f"/devices/{turn}/info")
+        done += 2
+    results.put(done)
+
+
+def run(shards, workers):
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = dict(os.environ, STATE_DIR=state_dir, RATE_LIMIT_ENABLED="0")
+        cluster = subprocess.Popen(
+            [
+                sys.executable,
+                "router.py",
+                "--shards",
+                str(shards),
+                "--port",
+                str(ROUTER_PORT),
+                "--base-port",
+                str(BASE_PORT),
+            ],
+            cwd=HERE,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_up(shards)
+            conn = http.client.HTTPConnection("127.0.0.1", ROUTER_PORT, timeout=10)
+            games = [pair(conn) for _ in range(workers)]
+            results = multiprocessing.Queue()
+            deadline = time() + DURATION
+            processes = [
+                multiprocessing.Process(target=load, args=(game, deadline, results))
+                for game in games
+            ]
+            for process in processes:
+                process.start()
+            total = sum(results.get() for _ in processes)
+            for process in processes:
+                process.join()
+        finally:
+            cluster.terminate()
+            cluster.wait()
+    return total / DURATION
+
+
+def main(workers=8):
+    print(f"núcleos: {os.cpu_count()}, procesos de carga: {workers}")
+    for shards in (1, 2, 4):
+        print(f"{shards} shard(s): {run(shards, workers):8.0f} peticiones/s")
+
+
+if __name__ == "__main__":
+    main()
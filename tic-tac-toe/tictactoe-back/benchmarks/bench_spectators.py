@@ -0,0 +1,74 @@
+"""
+1000 espectadores sondeando una partida.
+
+Cada "ronda" es un movimiento seguido de un sondeo de cada espectador.
+Compara la respuesta cacheada por versión de partida con serializar la
+respuesta en cada sondeo (el comportamiento anterior), usando el
+cliente de pruebas de Flask.
+
+    uv run python benchmarks/bench_spectators.py
+"""
+
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import create_app, spectator_body  # noqa: E402
+
+
+def play(tmp, spectators, rounds, cached):
+    app = create_app(
+        {
+            "DOCS": False,
+            "RATE_LIMIT_ENABLED": False,
+            "MOVE_JOURNAL_PATH": os.path.join(tmp, f"moves-{cached}.journal"),
+            "STATE_DIR": os.path.join(tmp, f"state-{cached}"),
+        }
+    )
+    game = app.extensions["tictactoe"]
+    client = app.test_client()
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    client.post("/matches", json={"device_id": d1, "size": 7})
+    match_id = client.post("/matches", json={"device_id": d2, "size": 7}).get_json()["match_id"]
+    cells = [(x, y) for y in range(7) for x in range(7)]
+
+    start = perf_counter()
+    for x, y in cells[:rounds]:
+        turn = game.matches[match_id]["turn"]
+        client.post(f"/matches/{match_id}/moves", json={"device_id": turn, "x": x, "y": y})
+        for _ in range(spectators):
+            if not cached:
+                game.spectator_cache.clear()
+            client.get(f"/matches/{match_id}")
+    return perf_counter() - start, game
+
+
+def main(spectators=1000, rounds=5):
+    with tempfile.TemporaryDirectory() as tmp:
+        for cached in (False, True):
+            elapsed, game = play(tmp, spectators, rounds, cached)
+            stats = game.poll_stats
+            reads = stats["spectator_reads"]
+            print(f"{'cacheado' if cached else 'sin caché'}:")
+            print(f"  sondeos:           {reads}")
+            print(f"  serializaciones:   {stats['spectator_serializations']}")
+            print(f"  por sondeo:        {elapsed / reads * 1e6:.0f} us")
+
+        # Coste de construir la respuesta sin el resto de la petición HTTP
+        match_id, match = next(iter(game.matches.items()))
+        for label, clear in (("serializar", True), ("leer caché", False)):
+            start = perf_counter()
+            for _ in range(spectators):
+                if clear:
+                    game.spectator_cache.clear()
+                spectator_body(game, match_id, match)
+            elapsed = perf_counter() - start
+            print(f"{label}: {elapsed / spectators * 1e6:.1f} us por espectador")
+
+
+if __name__ == "__main__":
+    main()
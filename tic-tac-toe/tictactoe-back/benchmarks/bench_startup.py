@@ -0,0 +1,91 @@
+"""
+Arranque en frío de un proceso de trabajo.
+
+Cada medida lanza un intérprete nuevo que importa main, crea la
+aplicación con create_app() y atiende la primera petición (y la
+primera de Swagger si está activado). Se repite varias veces y se
+muestra la mediana, con la documentación activada y desactivada.
+También mide importar solo game.py, que es lo que necesitan las
+herramientas que trabajan con el estado sin servir HTTP.
+
+    uv run python benchmarks/bench_startup.py
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RUNS = 10
+
+WORKER = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import main
+imported = perf_counter()
+app = main.create_app({"DOCS": sys.argv[1] == "1", "RATE_LIMIT_ENABLED": False})
+created = perf_counter()
+client = app.test_client()
+client.post("/devices")
+first = perf_counter()
+client.post("/devices")
+second = perf_counter()
+swagger = None
+if sys.argv[1] == "1":
+    client.get("/swagger.json")
+    swagger = perf_counter() - second
+print(json.dumps({
+    "import": imported - start,
+    "create_app": created - imported,
+    "first_request": first - created,
+    "second_request": second - first,
+    "swagger": swagger,
+}))
+"""
+
+
+GAME_ONLY = """
+import json
+from time import perf_counter
+start = perf_counter()
+import game
+print(json.dumps({"import": perf_counter() - start}))
+"""
+
+
+def spawn(code, args, state_dir):
+    env = dict(
+        os.environ,
+        STATE_DIR=state_dir,
+        MOVE_JOURNAL_PATH=os.path.join(state_dir, "moves.journal"),
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        cwd=HERE,
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main(runs=RUNS):
+    with tempfile.TemporaryDirectory() as state_dir:
+        for docs in (True, False):
+            samples = [spawn(WORKER, ["1" if docs else "0"], state_dir) for _ in range(runs)]
+            print(f"documentación {'activada' if docs else 'desactivada'} ({runs} procesos):")
+            for key in ("import", "create_app", "first_request", "second_request", "swagger"):
+                values = [sample[key] for sample in samples if sample[key] is not None]
+                if values:
+                    print(f"  {key:15} {statistics.median(values) * 1000:7.1f} ms")
+        samples = [spawn(GAME_ONLY, [], state_dir)["import"] for _ in range(runs)]
+        print(f"solo game.py:\n  import          {statistics.median(samples) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
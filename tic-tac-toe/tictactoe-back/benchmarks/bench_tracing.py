@@ -0,0 +1,91 @@
+"""
+Coste de las trazas y reparto del tiempo de un movimiento por fases.
+
+Juega 300 movimientos sin ganador en 19x19 (el patrón de
+bench_gomoku.py) con el cliente de pruebas de Flask, con el muestreo
+a 0, 0.01 y 1, y compara el tiempo medio por movimiento. Con todas las
+peticiones muestreadas lee después el fichero OTLP/JSON y muestra la
+media de cada fase de POST /matches/<id>/moves y de POST /matches.
+
+    uv run python benchmarks/bench_tracing.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+from collections import defaultdict
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_gomoku import moves  # noqa: E402
+from main import create_app  # noqa: E402
+
+ROUNDS = 10  # partidas por medida
+
+
+def play(tmp, rate):
+    label = f"rate-{rate}"
+    trace_path = os.path.join(tmp, f"{label}.jsonl")
+    app = create_app(
+        {
+            "DOCS": False,
+            "RATE_LIMIT_ENABLED": False,
+            "MOVE_JOURNAL_PATH": os.path.join(tmp, f"{label}.journal"),
+            "STATE_DIR": os.path.join(tmp, label),
+            "TRACE_PATH": trace_path,
+            "TRACE_SAMPLE_RATE": rate,
+        }
+    )
+    tracer = app.extensions["tracer"]
+    tracer.start()
+    client = app.test_client()
+    sequence = moves(19)
+    elapsed = 0.0
+    for _ in range(ROUNDS):
+        d1 = client.post("/devices").get_json()["device_id"]
+        d2 = client.post("/devices").get_json()["device_id"]
+        client.post("/matches", json={"device_id": d1, "size": 19})
+        match = client.post("/matches", json={"device_id": d2, "size": 19}).get_json()
+        turn = next(pid for pid, sym in match["players"].items() if sym == "X")
+        other = d2 if turn == d1 else d1
+        url = f"/matches/{match['match_id']}/moves"
+        start = perf_counter()
+        for x, y in sequence:
+            client.post(url, json={"device_id": turn, "x": x, "y": y})
+            turn, other = other, turn
+        elapsed += perf_counter() - start
+    tracer.close()
+    app.extensions["tictactoe"].close()
+    return elapsed / (ROUNDS * len(sequence)), trace_path
+
+
+def phases(trace_path):
+    """Media en microsegundos de cada fase, por ruta."""
+    totals = defaultdict(lambda: defaultdict(list))
+    with open(trace_path) as f:
+        for line in f:
+            spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+            route = spans[0]["name"]
+            for span in spans:
+                duration = int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])
+                totals[route][span["name"]].append(duration / 1000)
+    return totals
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {rate: play(tmp, rate) for rate in (0.0, 0.01, 1.0)}
+        print(f"{'muestreo':>9} {'us/movimiento':>14}")
+        for rate, (per_move, _) in results.items():
+            print(f"{rate:9} {per_move * 1e6:14.1f}")
+        totals = phases(results[1.0][1])
+    for route in ("POST /matches/<match_id>/moves", "POST /matches"):
+        print(f"\n{route}")
+        for name, values in totals[route].items():
+            print(f"  {name:16} {sum(values) / len(values):8.1f} us  ({len(values)} spans)")
+
+
+if __name__ == "__main__":
+    main()
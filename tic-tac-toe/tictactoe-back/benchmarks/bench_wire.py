@@ -0,0 +1,139 @@
+"""
+Tamaño y coste de codificación de las respuestas: JSON frente a MessagePack.
+
+Codifica y decodifica las respuestas de sincronización (GET
+/matches/<id>) y de movimiento en tableros de 3x3 y 7x7 a media
+partida:
+
+- json:      lo que envía la API por defecto (tablero como lista de listas)
+- msgpack:   Accept: application/msgpack (tablero empaquetado, wire.py)
+- cbor:      el mismo objeto con cbor2, como referencia (si está instalado)
+
+Después mide la petición completa de sincronización con el cliente de
+pruebas de Flask en los dos formatos de la API.
+
+    uv run --extra binary python benchmarks/bench_wire.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import create_app  # noqa: E402
+from wire import MSGPACK, msgpack, pack_board  # noqa: E402
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+REPEAT = 20000
+DEVICE_ID = "3f2b8c1e-9a4d-4e6b-8f0a-1c2d3e4f5a6b"
+OPPONENT_ID = "7a6b5c4d-3e2f-4a1b-9c8d-7e6f5a4b3c2d"
+
+
+def half_played(size):
+    board = [[""] * size for _ in range(size)]
+    for i in range(size * size // 2):
+        board[i // size][i % size] = "XO"[i % 2]
+    return board
+
+
+def responses(size):
+    board = half_played(size)
+    sync = {
+        "board": board,
+        "stones": None,
+        "turn": DEVICE_ID,
+        "winner": None,
+        "draw": False,
+        "size": size,
+        "players": {DEVICE_ID: "X", OPPONENT_ID: "O"},
+        "opponent_left": False,
+        "retry_after_ms": 1000,
+    }
+    move = {
+        "board": board,
+        "changes": [{"x": 1, "y": 1, "symbol": "X"}],
+        "next_turn": OPPONENT_ID,
+        "winner": None,
+        "draw": False,
+    }
+    return {f"sincronización {size}x{size}": sync, f"movimiento {size}x{size}": move}
+
+
+def codecs():
+    """{formato: (codificar, decodificar)} con los formatos disponibles."""
+    available = {"json": (lambda d: json.dumps(d).encode(), json.loads)}
+    if msgpack is not None:
+        available["msgpack"] = (
+            lambda d: msgpack.packb({**d, "board": pack_board(d["board"])}),
+            msgpack.unpackb,
+        )
+    if cbor2 is not None:
+        available["cbor"] = (
+            lambda d: cbor2.dumps({**d, "board": pack_board(d["board"])}),
+            cbor2.loads,
+        )
+    return available
+
+
+def timed(function, argument):
+    start = perf_counter()
+    for _ in range(REPEAT):
+        function(argument)
+    return (perf_counter() - start) / REPEAT
+
+
+def http_sync(accept):
+    """Petición completa de sincronización de un jugador en 7x7."""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(
+            {
+                "DOCS": False,
+                "RATE_LIMIT_ENABLED": False,
+                "MOVE_JOURNAL_PATH": os.path.join(tmp, "moves.journal"),
+                "STATE_DIR": os.path.join(tmp, "state"),
+            }
+        )
+        client = app.test_client()
+        d1 = client.post("/devices").get_json()["device_id"]
+        d2 = client.post("/devices").get_json()["device_id"]
+        client.post("/matches", json={"device_id": d1, "size": 7})
+        match = client.post("/matches", json={"device_id": d2, "size": 7}).get_json()
+        url = f"/matches/{match['match_id']}?device_id={d1}"
+        size = len(client.get(url, headers={"Accept": accept}).data)
+        start = perf_counter()
+        for _ in range(REPEAT // 10):
+            client.get(url, headers={"Accept": accept})
+        elapsed = (perf_counter() - start) / (REPEAT // 10)
+        app.extensions["tictactoe"].close()
+    return elapsed, size
+
+
+def main():
+    available = codecs()
+    missing = [name for name, module in (("msgpack", msgpack), ("cbor2", cbor2)) if module is None]
+    if missing:
+        print(f"sin instalar: {', '.join(missing)}")
+    print(f"{'respuesta':>18} {'formato':>8} {'bytes':>6} {'cod. us':>8} {'dec. us':>8}")
+    for size in (3, 7):
+        for label, data in responses(size).items():
+            for name, (encode, decode) in available.items():
+                encoded = encode(data)
+                print(
+                    f"{label:>18} {name:>8} {len(encoded):6}"
+                    f" {timed(encode, data) * 1e6:8.2f} {timed(decode, encoded) * 1e6:8.2f}"
+                )
+    accepts = ["application/json"] + ([MSGPACK] if msgpack is not None else [])
+    for accept in accepts:
+        elapsed, size = http_sync(accept)
+        print(f"API {accept}: {elapsed * 1e6:.0f} us/petición, {size} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Simulación del emparejamiento por rating.
+
+Mantiene N jugadores esperando a la vez (cada emparejado se sustituye
+por uno nuevo). Cada jugador sondea el lobby cada 2 segundos como el
+cliente OnlineGame. Se compara el índice por rating (LobbyIndex) con
+el emparejamiento anterior, que tomaba al primero en espera.
+
+    uv run python benchmarks/sim_matchmaking.py [duración_en_segundos]
+"""
+
+import os
+import random
+import sys
+from collections import OrderedDict
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from matchmaking import LobbyIndex  # noqa: E402
+
+POLL_INTERVAL = 2  # segundos entre sondeos de cada cliente
+SIZES = (3, 4, 5, 6, 7)
+
+
+def new_player(rng):
+    return rng.choice(SIZES), rng.gauss(1500, 300)
+
+
+class FirstWaitingLobby:
+    """Comportamiento anterior: el primero que espera con el mismo tamaño."""
+
+    def __init__(self):
+        self._by_size = {size: OrderedDict() for size in SIZES}
+        self._sizes = {}
+
+    def add(self, device_id, size, rating, since):
+        self._by_size[size][device_id] = rating
+        self._sizes[device_id] = size
+
+    def remove(self, device_id):
+        size = self._sizes.pop(device_id, None)
+        if size is not None:
+            del self._by_size[size][device_id]
+
+    def find_opponent(self, size, rating, since, now, exclude=None):
+        for device_id in self._by_size[size]:
+            if device_id != exclude:
+                return device_id
+        return None
+
+
+def simulate(lobby, concurrent, duration, seed=1):
+    rng = random.Random(seed)
+    players = {}  # {device_id: (size, rating, llegada)}
+    next_id = 0
+    waits, gaps, searches = [], [], 0
+    search_time = 0.0
+
+    def arrive(now):
+        nonlocal next_id
+        size, rating = new_player(rng)
+        players[next_id] = (size, rating, now, rng.randrange(POLL_INTERVAL))
+        next_id += 1
+
+    for _ in range(concurrent):
+        arrive(0)
+
+    for now in range(duration):
+        for device_id in [d for d, p in players.items() if (now + p[3]) % POLL_INTERVAL == 0]:
+            if device_id not in players:
+                continue  # ya emparejado en este segundo
+            size, rating, since, _ = players[device_id]
+            start = perf_counter()
+            opponent = lobby.find_opponent(size, rating, since, now, exclude=device_id)
+            search_time += perf_counter() - start
+            searches += 1
+            if opponent is None:
+                lobby.add(device_id, size, rating, since)
+                continue
+            lobby.remove(opponent)
+            lobby.remove(device_id)
+            opp_size, opp_rating, opp_since, _ = players.pop(opponent)
+            del players[device_id]
+            waits.extend([now - since, now - opp_since])
+            gaps.append(abs(rating - opp_rating))
+            arrive(now)
+            arrive(now)
+
+    return {
+        "pairings": len(gaps),
+        "avg_wait": sum(waits) / max(1, len(waits)),
+        "avg_gap": sum(gaps) / max(1, len(gaps)),
+        "search_us": search_time / max(1, searches) * 1e6,
+    }
+
+
+def main(duration):
+    print(f"{'esperando':>9} {'lobby':>11} {'parejas':>8} {'espera media':>13} "
+          f"{'dif. rating':>12} {'búsqueda':>10}")
+    for concurrent in (100, 1_000, 10_000):
+        for name, lobby in (("rating", LobbyIndex()), ("primero", FirstWaitingLobby())):
+            r = simulate(lobby, concurrent, duration)
+            print(
+                f"{concurrent:>9} {name:>11} {r['pairings']:>8} {r['avg_wait']:>12.1f}s "
+                f"{r['avg_gap']:>12.0f} {r['search_us']:>8.1f}us"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60)
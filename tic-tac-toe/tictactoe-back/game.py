@@ -0,0 +1,827 @@
+"""
+Estado del juego en memoria y las operaciones que lo modifican.
+
+GameState agrupa dispositivos, partidas, lobby, clasificación, límites
+de peticiones y persistencia. Cada aplicación creada con
+main.create_app() tiene su propia instancia, así que los tests y los
+procesos de trabajo no comparten estado global. Este módulo no
+depende de Flask: la capa HTTP está en main.py.
+"""
+
+import gc
+import heapq
+import random
+import threading
+from collections import deque
+from itertools import islice
+from datetime import timedelta
+from time import time
+from uuid import uuid4
+
+from idempotency import ReplyCache
+from journal import MoveJournal
+from matchmaking import INITIAL_RATING, LobbyIndex, elo_draw, elo_update
+from matchstats import MatchStats
+from persistence import StateStore
+from ranking import IndexableSkipList, Leaderboard
+from ratelimit import TokenBucketLimiter
+from sharding import COORDINATOR, ShardClient
+from tracing import current_trace
+
+DISCONNECT_TIMEOUT = timedelta(minutes=5)
+FORFEIT_GRACE = 60.0  # segundos que se conserva una partida ganada por abandono
+HISTORY_SIZE = 20  # partidas terminadas que se guardan por dispositivo
+DEVICE_RATE, DEVICE_BURST = 2.0, 10  # peticiones/segundo y ráfaga por dispositivo
+IP_RATE, IP_BURST = 20.0, 60  # peticiones/segundo y ráfaga por IP
+POLL_BASELINE_MS = 2000  # intervalo fijo que usaban los clientes
+POLL_FAST_MS = 500  # justo después de un movimiento del rival
+POLL_SLOW_MS = 5000  # turno propio o lobby vacío
+POLL_BACKOFF = 0.25  # ms extra por ms sin cambios mientras juega el rival
+LOBBY_MAX_WAIT = 20.0  # segundos como mucho de POST /matches?wait=
+LOBBY_MAX_WAITERS = 8  # peticiones esperando rival a la vez en un proceso
+CLASSIC_SIZES = range(3, 8)  # tableros densos (3-7)
+LARGE_SIZES = (15, 19)  # Gomoku: un byte por casilla y 5 en línea
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))  # filas, columnas y diagonales
+
+
+class GameState:
+    """
+    Estado de un servidor de juego.
+    Las claves son los UUID en texto: traducirlos a handles enteros cuesta
+    más memoria y tiempo del que ahorra (ver benchmarks/bench_ids.py).
+    """
+
+    def __init__(
+        self,
+        journal_path="moves.journal",
+        state_dir="state",
+        snapshot_interval=60.0,
+        shard_index=0,
+        shard_peers=(),
+        max_lobby_waiters=LOBBY_MAX_WAITERS,
+    ):
+        self.devices = {}  # {device_id: {"last_active": timestamp, "wins": 0, "losses": 0, "draws": 0, "alias": str, "rating": float, "active_match": {...} or None}}
+        self.matches = {}  # {match_id: {"index": int, "players": {device_id: X/O}, "turn": device_id, "board": [[]], "size": int, "winner": symbol or None, "updated_at": timestamp, "version": int, "ratings": {device_id: float}}}
+        self.waiting_lobby = {}  # {device_id: {"size": int, "timestamp": timestamp, "rating": float}} - jugadores esperando partida
+        self.lobby_index = LobbyIndex()  # waiting_lobby indexado por tamaño y rating
+        self.move_journal = MoveJournal(journal_path)  # historial binario de movimientos
+        self.leaderboard = Leaderboard()  # clasificación incremental de dispositivos
+        self.device_index = IndexableSkipList()  # device_ids ordenados para paginar con cursor
+        # Montículo (last_active, device_id) para expirar sin recorrer `devices`.
+        # Se revisa al sacar cada entrada: la actividad no lo toca
+        self.activity_heap = []
+        self.device_limiter = TokenBucketLimiter(DEVICE_RATE, DEVICE_BURST)
+        self.ip_limiter = TokenBucketLimiter(IP_RATE, IP_BURST)
+        self.poll_stats = {
+            "polls": 0,
+            "suggested_ms": 0,
+            "observed": 0,
+            "observed_ms": 0.0,
+            "spectator_reads": 0,
+            "spectator_serializations": 0,
+            "lobby_waits": 0,
+            "lobby_waits_refused": 0,
+        }
+        self.spectator_cache = {}  # {match_id: (versión, respuesta JSON ya codificada)}
+        self.move_replies = ReplyCache()  # respuestas de movimientos por Idempotency-Key
+        # {device_id: deque(maxlen=HISTORY_SIZE)} de tuplas en el orden de HISTORY_FIELDS
+        self.histories = {}
+        # Contadores globales de GET /stats, por tamaño de tablero
+        self.stats = MatchStats(lambda key: self.store.mark_dirty("stats", key))
+        self.evictions = deque()  # (evict_at, match_id) en orden: partidas abandonadas por expirar
+        self.last_poll = {}  # {device_id: timestamp del último sondeo}
+        # None = un proceso; si no, cliente del resto de shards
+        self.shard = ShardClient(shard_index, list(shard_peers)) if shard_peers else None
+        # {device_id: {Event}} de las peticiones que esperan rival (POST /matches?wait=)
+        self.lobby_waiters = {}
+        self.lobby_waiting = 0  # peticiones en lobby_waiters
+        self.max_lobby_waiters = max_lobby_waiters  # cada una ocupa un hilo del servidor
+        self.lobby_open = True  # False al apagar: nadie más se queda esperando
+        self.paired_matches = {}  # coordinador: {device_id: partida} emparejado mientras esperaba
+        self.reserved = set()  # coordinador: rivales cuya partida se está creando en otro shard
+        self.lock = threading.RLock()  # protege todo el estado anterior
+        self.store = StateStore(
+            state_dir,
+            {
+                "devices": self.devices,
+                "matches": self.matches,
+                "waiting_lobby": self.waiting_lobby,
+                "histories": self.histories,
+                "stats": self.stats.counters,
+            },
+            self.lock,
+            snapshot_interval=snapshot_interval,
+        )
+
+    # ---------- dispositivos ----------
+    def register_device(self, alias=None):
+        """Da de alta un dispositivo nuevo y devuelve su ID."""
+        device_id = self.new_id()
+        self.devices[device_id] = {
+            "last_active": time(),
+            "wins": 0,
+            "losses": 0,
+            "draws": 0,
+            "alias": alias if alias is not None else device_id[:8],
+            "rating": INITIAL_RATING,
+            "active_match": None,
+        }
+        self.device_index.insert(device_id)
+        self.schedule_expiry(device_id)
+        self.leaderboard.update(device_id, 0, 0)
+        self.store.mark_dirty("devices", device_id)
+        return device_id
+
+    def schedule_expiry(self, device_id):
+        """Añade el dispositivo al montículo de expiración con su last_active actual."""
+        heapq.heappush(self.activity_heap, (self.devices[device_id]["last_active"], device_id))
+
+    def expired_devices(self, now):
+        """
+        Dispositivos inactivos por más de DISCONNECT_TIMEOUT. Solo saca del
+        montículo las entradas anteriores al corte: si el dispositivo ha
+        tenido actividad desde entonces vuelve a entrar con su last_active
+        actual (como mucho una vez por DISCONNECT_TIMEOUT), y si ya no
+        existe se descarta.
+        """
+        cutoff = now - DISCONNECT_TIMEOUT.total_seconds()
+        heap, inactive = self.activity_heap, {}
+        while heap and heap[0][0] < cutoff:
+            _, device_id = heapq.heappop(heap)
+            info = self.devices.get(device_id)
+            if info is None:
+                continue
+            if info["last_active"] < cutoff:
+                inactive[device_id] = None  # sin repetir si tenía varias entradas
+            else:
+                heapq.heappush(heap, (info["last_active"], device_id))
+        return list(inactive)
+
+    def cleanup_inactive_devices(self):
+        """
+        Elimina dispositivos inactivos por más de DISCONNECT_TIMEOUT.
+        También limpia el lobby de espera. Cuesta lo que expira, no el
+        número de dispositivos (ver expired_devices).
+        """
+        now = time()
+        for d in self.expired_devices(now):
+            # Su partida se resuelve a favor del rival (enlace directo, sin recorrer matches)
+            active_match = self.devices[d].get("active_match")
+            if active_match:
+                self.forfeit_match(active_match["match_id"], d, now)
+            del self.devices[d]
+            if self.histories.pop(d, None) is not None:
+                self.store.mark_dirty("histories", d)
+            self.device_index.remove(d)
+            self.leaderboard.remove(d)
+            self.device_limiter.forget(d)
+            self.last_poll.pop(d, None)
+            self.store.mark_dirty("devices", d)
+            # Limpiar del lobby si estaba esperando (en modo shards lo tiene el coordinador)
+            if self.shard is None or self.shard.is_coordinator:
+                self.leave_lobby(d)
+            else:
+                self.shard.send(COORDINATOR, "/internal/lobby/leave", {"device_id": d})
+        self.ip_limiter.sweep(now)
+        self.move_replies.sweep(now)
+        self.evict_matches(now)
+
+    def update_activity(self, device_id):
+        """Actualiza la última actividad del dispositivo."""
+        if device_id in self.devices:
+            self.devices[device_id]["last_active"] = time()
+            self.store.mark_dirty("devices", device_id)
+
+    def new_id(self):
+        """Nuevo UUID; en modo shards, uno que pertenezca a este shard."""
+        return self.shard.new_id() if self.shard is not None else str(uuid4())
+
+    def is_local(self, device_id):
+        """Indica si el dispositivo vive en este proceso."""
+        return self.shard is None or self.shard.owns(device_id)
+
+    def touch_device(self, device_id):
+        """Actualiza la actividad de un dispositivo, esté en este shard o en otro."""
+        if self.is_local(device_id):
+            self.update_activity(device_id)
+        else:
+            self.shard.send_event(device_id, {"type": "activity"})
+
+    def set_active_match(self, device_id, summary):
+        """Enlaza el dispositivo con su partida activa (o None al terminar)."""
+        if device_id in self.devices:
+            self.devices[device_id]["active_match"] = summary
+            self.store.mark_dirty("devices", device_id)
+
+    # ---------- lobby ----------
+    def join_lobby(self, device_id, size, rating, now):
+        """Añade el dispositivo al lobby de espera para un tamaño de tablero."""
+        self.waiting_lobby[device_id] = {"size": size, "timestamp": now, "rating": rating}
+        self.lobby_index.add(device_id, size, rating, now)
+        self.store.mark_dirty("waiting_lobby", device_id)
+
+    def leave_lobby(self, device_id):
+        """Saca al dispositivo del lobby de espera (si estaba)."""
+        if device_id in self.waiting_lobby:
+            del self.waiting_lobby[device_id]
+            self.lobby_index.remove(device_id)
+            self.store.mark_dirty("waiting_lobby", device_id)
+
+    def pair_in_lobby(self, device_id, size, rating):
+        """
+        Empareja al dispositivo con el rival de rating más cercano o lo deja
+        esperando. Devuelve {"status": "paired", "match": resumen} o
+        {"status": "waiting", "retry_after_ms": ms}. En modo shards solo lo
+        ejecuta el coordinador, y la partida se crea en el shard que le toca
+        sin tener el lock tomado. Lanza OSError si ese shard no responde.
+        """
+        with self.lock:
+            if device_id in self.paired_matches:  # emparejado mientras esperaba
+                return {"status": "paired", "match": self.paired_matches.pop(device_id)}
+            now = time()
+            if device_id in self.reserved:
+                return {"status": "waiting", "retry_after_ms": POLL_FAST_MS}
+
+            # Si ya esperaba con este tamaño se conserva su antigüedad en el lobby
+            waiting = self.waiting_lobby.get(device_id)
+            if waiting and waiting["size"] != size:
+                self.leave_lobby(device_id)
+                waiting = None
+            waiting_since = waiting["timestamp"] if waiting else now
+
+            # Buscar el oponente de rating más cercano con el mismo tamaño de tablero
+            with current_trace().span("find_opponent"):
+                opponent_id = self.lobby_index.find_opponent(
+                    size, rating, waiting_since, now, exclude=device_id
+                )
+            if not opponent_id:
+                # No hay oponente, entrar (o seguir) en el lobby de espera
+                if not waiting:
+                    self.join_lobby(device_id, size, rating, now)
+                retry_after_ms = self.lobby_poll_interval(device_id, size)
+                return {
+                    "status": "waiting",
+                    "retry_after_ms": self.suggest_poll(device_id, retry_after_ms, now),
+                }
+
+            # ¡Emparejamiento encontrado! Sacar a ambos del lobby
+            ratings = {
+                device_id: rating,
+                opponent_id: self.waiting_lobby[opponent_id]["rating"],
+            }
+            self.leave_lobby(opponent_id)
+            self.leave_lobby(device_id)
+
+            # Asignar símbolos aleatoriamente
+            players_list = [device_id, opponent_id]
+            random.shuffle(players_list)
+            players = {players_list[0]: "X", players_list[1]: "O"}
+            match_id = str(uuid4())
+
+            shard = self.shard
+            if shard is None or shard.owns(match_id):
+                summary = self.create_match_record(match_id, players, size, ratings, now)
+                if shard is None:
+                    self.set_active_match(device_id, summary)
+                    self.set_active_match(opponent_id, summary)
+                    self.update_activity(opponent_id)
+                    self.notify_lobby_waiters(opponent_id)
+                    return {"status": "paired", "match": summary}
+            self.reserved.add(opponent_id)
+
+        try:
+            if not shard.owns(match_id):
+                status, summary = shard.call(
+                    shard.owner(match_id),
+                    "POST",
+                    "/internal/matches",
+                    {"match_id": match_id, "players": players, "size": size, "ratings": ratings},
+                )
+                if status != 200:
+                    raise ConnectionError("No se pudo crear la partida en su shard")
+            with self.lock:
+                self.paired_matches[opponent_id] = summary
+                if self.is_local(opponent_id):
+                    self.notify_lobby_waiters(opponent_id)
+                else:
+                    self.shard.send_event(opponent_id, {"type": "paired"})
+        finally:
+            # Si algo falla, el rival vuelve a entrar en el lobby en su próximo sondeo
+            with self.lock:
+                self.reserved.discard(opponent_id)
+        return {"status": "paired", "match": summary}
+
+    # ---------- espera larga en el lobby ----------
+    def add_lobby_waiter(self, device_id):
+        """
+        Registra una petición que espera rival. Devuelve el Event que se
+        activa al emparejar al dispositivo, o None si ya hay
+        max_lobby_waiters esperando en este proceso o se está apagando.
+        """
+        with self.lock:
+            if not self.lobby_open or self.lobby_waiting >= self.max_lobby_waiters:
+                self.poll_stats["lobby_waits_refused"] += 1
+                return None
+            event = threading.Event()
+            self.lobby_waiters.setdefault(device_id, set()).add(event)
+            self.lobby_waiting += 1
+            self.poll_stats["lobby_waits"] += 1
+            return event
+
+    def remove_lobby_waiter(self, device_id, event):
+        with self.lock:
+            events = self.lobby_waiters[device_id]
+            events.discard(event)
+            if not events:
+                del self.lobby_waiters[device_id]
+            self.lobby_waiting -= 1
+
+    def notify_lobby_waiters(self, device_id):
+        """Despierta las peticiones del dispositivo que esperan rival (con el lock)."""
+        for event in self.lobby_waiters.get(device_id, ()):
+            event.set()
+
+    def release_lobby_waiters(self):
+        """Al apagar: las esperas en curso responden ya y no se admiten más."""
+        with self.lock:
+            self.lobby_open = False
+            for events in self.lobby_waiters.values():
+                for event in events:
+                    event.set()
+
+    # ---------- resultados ----------
+    def refresh_rank(self, device_id):
+        """Reubica al dispositivo en la clasificación tras cambiar sus estadísticas."""
+        info = self.devices[device_id]
+        self.leaderboard.update(device_id, info["wins"], info["losses"])
+
+    def apply_result(self, device_id, won, opponent_rating):
+        """Aplica a un dispositivo local el resultado de su partida y ajusta el Elo."""
+        device = self.devices.get(device_id)
+        if device is None:
+            return
+        if won:
+            device["wins"] += 1
+            device["rating"], _ = elo_update(device["rating"], opponent_rating)
+        else:
+            device["losses"] += 1
+            _, device["rating"] = elo_update(opponent_rating, device["rating"])
+        device["active_match"] = None
+        self.refresh_rank(device_id)
+        self.store.mark_dirty("devices", device_id)
+
+    def record_result(self, match_id, winner_id, loser_id, reason="line"):
+        """
+        Suma la victoria y la derrota de una partida terminada y la añade
+        al historial de los dos jugadores. `reason` es cómo terminó: line,
+        surrender, leave o forfeit. Los dispositivos de otro shard reciben
+        el resultado como evento.
+        """
+        match = self.matches[match_id]
+        now = time()
+        ratings = {
+            pid: self.devices[pid]["rating"]
+            if self.is_local(pid) and pid in self.devices
+            else match["ratings"][pid]
+            for pid in (winner_id, loser_id)
+        }
+        self.stats.match_finished(
+            match["size"],
+            match["players"][winner_id],
+            reason,
+            match["moves"],
+            now - match["created_at"],
+        )
+        for device_id, won, opponent_id in (
+            (winner_id, True, loser_id),
+            (loser_id, False, winner_id),
+        ):
+            entry = history_entry(
+                match_id, match, opponent_id, "win" if won else "loss", reason, now
+            )
+            if self.is_local(device_id):
+                self.apply_result(device_id, won, ratings[opponent_id])
+                self.add_history(device_id, entry)
+            else:
+                self.shard.send_event(
+                    device_id,
+                    {
+                        "type": "result",
+                        "won": won,
+                        "opponent_rating": ratings[opponent_id],
+                        "history": entry,
+                    },
+                )
+
+    def apply_draw(self, device_id, opponent_rating):
+        """Aplica a un dispositivo local un empate y ajusta el Elo."""
+        device = self.devices.get(device_id)
+        if device is None:
+            return
+        device["draws"] = device.get("draws", 0) + 1
+        device["rating"], _ = elo_draw(device["rating"], opponent_rating)
+        device["active_match"] = None
+        self.store.mark_dirty("devices", device_id)
+
+    def record_draw(self, match_id):
+        """Suma un empate a los dos jugadores de una partida sin líneas ganables."""
+        match = self.matches[match_id]
+        now = time()
+        first, second = match["players"]
+        ratings = {
+            pid: self.devices[pid]["rating"]
+            if self.is_local(pid) and pid in self.devices
+            else match["ratings"][pid]
+            for pid in (first, second)
+        }
+        self.stats.match_finished(
+            match["size"], None, "draw", match["moves"], now - match["created_at"]
+        )
+        for device_id, opponent_id in ((first, second), (second, first)):
+            entry = history_entry(match_id, match, opponent_id, "draw", "draw", now)
+            if self.is_local(device_id):
+                self.apply_draw(device_id, ratings[opponent_id])
+                self.add_history(device_id, entry)
+            else:
+                self.shard.send_event(
+                    device_id,
+                    {"type": "draw", "opponent_rating": ratings[opponent_id], "history": entry},
+                )
+
+    def add_history(self, device_id, entry):
+        """
+        Añade una partida terminada al historial del dispositivo. Es un
+        búfer circular: al llegar a HISTORY_SIZE se descarta la más antigua.
+        """
+        if device_id not in self.devices:
+            return
+        history = self.histories.get(device_id)
+        if history is None:
+            history = self.histories[device_id] = deque(maxlen=HISTORY_SIZE)
+        history.append(tuple(entry))
+        self.store.mark_dirty("histories", device_id)
+
+    def recent_history(self, device_id, limit):
+        """Las `limit` últimas partidas del dispositivo, la más reciente primero."""
+        history = self.histories.get(device_id, ())
+        return [dict(zip(HISTORY_FIELDS, entry)) for entry in islice(reversed(history), limit)]
+
+    # ---------- partidas ----------
+    def create_match_record(self, match_id, players, size, ratings, now):
+        """
+        Crea la partida en este proceso y devuelve su resumen.
+        Los tableros grandes no guardan la cuadrícula de cadenas sino un
+        byte por casilla (0 libre, "X" u "O"): 361 bytes en 19x19.
+        """
+        turn = next(pid for pid, sym in players.items() if sym == "X")
+        with current_trace().span("board"):
+            self.matches[match_id] = {
+                "index": self.move_journal.new_match_index(),
+                "players": players,
+                "turn": turn,
+                "board": None if is_large(size) else [[""] * size for _ in range(size)],
+                "cells": bytearray(size * size) if is_large(size) else None,
+                "size": size,
+                "winner": None,
+                "draw": False,
+                "moves": 0,
+                "created_at": now,
+                "updated_at": now,
+                "version": 0,
+                "ratings": ratings,
+            }
+            track_lines(self.matches[match_id])
+        self.store.mark_dirty("matches", match_id)
+        self.stats.match_created(size)
+        return {"match_id": match_id, "players": players, "board_size": size}
+
+    def forfeit_match(self, match_id, device_id, now):
+        """
+        El dispositivo ha expirado con la partida en curso: gana el rival.
+        La partida se conserva FORFEIT_GRACE segundos para que el rival vea
+        el resultado en su siguiente sondeo y después se elimina.
+        En modo shards se avisa al shard dueño de la partida.
+        """
+        if self.shard is not None and not self.shard.owns(match_id):
+            self.shard.send(
+                self.shard.owner(match_id),
+                f"/internal/matches/{match_id}/forfeit",
+                {"device_id": device_id},
+            )
+            return
+        match = self.matches.get(match_id)
+        if match is None or is_over(match) or device_id not in match["players"]:
+            return
+        opponent_id = next(pid for pid in match["players"] if pid != device_id)
+        match["winner"] = match["players"][opponent_id]
+        match["forfeited_by"] = device_id
+        match["evict_at"] = now + FORFEIT_GRACE
+        self.evictions.append((match["evict_at"], match_id))
+        self.record_result(match_id, opponent_id, device_id, "forfeit")
+        self.match_changed(match_id)
+
+    def evict_matches(self, now):
+        """Elimina las partidas abandonadas cuyo plazo de gracia ha vencido."""
+        while self.evictions and self.evictions[0][0] <= now:
+            _, match_id = self.evictions.popleft()
+            if match_id in self.matches:  # el rival pudo salir antes
+                self.remove_match(match_id)
+
+    def bulk_pair_error(self, pair, busy):
+        """Valida una pareja de la creación masiva. Devuelve el error o None."""
+        players = pair.get("players") if isinstance(pair, dict) else None
+        if not isinstance(players, list) or len(players) != 2:
+            return "Se requieren exactamente dos jugadores"
+        if players[0] == players[1]:
+            return "Un dispositivo no puede jugar contra sí mismo"
+        size = pair.get("size", 3)
+        if not isinstance(size, int) or not valid_size(size):
+            return "Tamaño de tablero no válido (3-7, 15 o 19)"
+        for device_id in players:
+            if not self.is_local(device_id):
+                return f"Dispositivo en otro shard: {device_id}"
+            if device_id not in self.devices:
+                return f"Dispositivo no encontrado: {device_id}"
+            if device_id in busy or self.devices[device_id].get("active_match"):
+                return f"El dispositivo ya está en una partida: {device_id}"
+        return None
+
+    def match_changed(self, match_id):
+        """
+        Registra un cambio de estado de la partida: sube su versión, lo que
+        invalida la respuesta cacheada para los espectadores.
+        """
+        match = self.matches[match_id]
+        match["version"] = match.get("version", 0) + 1
+        match["updated_at"] = time()
+        self.spectator_cache.pop(match_id, None)
+        self.store.mark_dirty("matches", match_id)
+
+    def remove_match(self, match_id):
+        """Elimina una partida del servidor."""
+        del self.matches[match_id]
+        self.spectator_cache.pop(match_id, None)
+        self.move_replies.forget(match_id)
+        self.store.mark_dirty("matches", match_id)
+
+    # ---------- sondeos ----------
+    def suggest_poll(self, device_id, retry_after_ms, now):
+        """Registra un sondeo y el intervalo sugerido para medir el ahorro."""
+        stats = self.poll_stats
+        stats["polls"] += 1
+        stats["suggested_ms"] += retry_after_ms
+        previous = self.last_poll.get(device_id)
+        if previous is not None and now - previous < 60:
+            stats["observed"] += 1
+            stats["observed_ms"] += (now - previous) * 1000
+        if device_id in self.devices:
+            self.last_poll[device_id] = now
+        return retry_after_ms
+
+    @staticmethod
+    def match_poll_interval(match, device_id, now):
+        """
+        Intervalo sugerido (ms) para el siguiente sondeo de la partida.
+        En su propio turno el cliente solo espera un abandono del rival, así
+        que sondea despacio. Mientras juega el rival se sondea rápido justo
+        después del último movimiento y cada vez más despacio si no mueve.
+        """
+        if is_over(match) or device_id not in match["players"]:
+            return POLL_BASELINE_MS
+        if match["turn"] == device_id:
+            return POLL_SLOW_MS
+        idle_ms = (now - match.get("updated_at", now)) * 1000
+        return int(min(POLL_SLOW_MS, POLL_FAST_MS + idle_ms * POLL_BACKOFF))
+
+    def lobby_poll_interval(self, device_id, size):
+        """Intervalo sugerido (ms) para volver a buscar partida en el lobby."""
+        others = self.lobby_index.waiting(size) - (device_id in self.lobby_index)
+        return POLL_BASELINE_MS if others > 0 else POLL_SLOW_MS
+
+    # ---------- ciclo de vida ----------
+    def restore(self):
+        """
+        Recupera el estado guardado y arranca los snapshots periódicos.
+        Los dispositivos recuperados reciben una nueva ventana de actividad
+        para que los clientes no tengan que registrarse otra vez.
+        """
+        # Sin el recolector de ciclos mientras se crean cientos de miles de
+        # objetos: cada pasada recorrería de nuevo todo el estado recuperado
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self.store.restore()
+            now = time()
+            for info in self.devices.values():
+                info["last_active"] = now
+                info.setdefault("rating", INITIAL_RATING)
+                info.setdefault("draws", 0)
+                info.setdefault("active_match", None)
+            # Índices construidos de una vez a partir de claves ordenadas
+            device_ids = sorted(self.devices)
+            self.device_index.build(device_ids)
+            self.activity_heap = [(now, device_id) for device_id in device_ids]  # ya ordenado
+            self.leaderboard.build(
+                (device_id, (info["wins"], info["losses"]))
+                for device_id, info in self.devices.items()
+            )
+            self.lobby_index.clear()
+            for device_id, entry in self.waiting_lobby.items():
+                entry.setdefault(
+                    "rating", self.devices.get(device_id, {}).get("rating", INITIAL_RATING)
+                )
+                self.lobby_index.add(device_id, entry["size"], entry["rating"], entry["timestamp"])
+            for match in self.matches.values():
+                match.setdefault("version", 0)
+                match.setdefault("cells", None)
+                match.setdefault("draw", False)
+                match.setdefault("created_at", match["updated_at"])
+                if "moves" not in match:
+                    match["moves"] = count_moves(match)
+                if "lines" not in match:
+                    track_lines(match)
+            # Los índices de las partidas recuperadas no se vuelven a repartir
+            self.move_journal.reserve_through(
+                max((match["index"] for match in self.matches.values()), default=-1)
+            )
+            self.evictions = deque(
+                sorted(
+                    (match["evict_at"], match_id)
+                    for match_id, match in self.matches.items()
+                    if "evict_at" in match
+                )
+            )
+        finally:
+            if collecting:
+                gc.enable()
+        self.store.start()
+        for key in self.stats.upgrade():
+            self.store.mark_dirty("stats", key)
+
+    def close(self):
+        """Vuelca los cambios pendientes y cierra los ficheros."""
+        self.store.close()
+        self.move_journal.close()
+
+
+HISTORY_FIELDS = ("match_id", "opponent_id", "size", "result", "reason", "moves", "started_at", "ended_at")
+
+
+def history_entry(match_id, match, opponent_id, result, reason, now):
+    """Resumen compacto de una partida terminada para el historial de un jugador."""
+    return (
+        match_id,
+        opponent_id,
+        match["size"],
+        result,
+        reason,
+        match["moves"],
+        match["created_at"],
+        now,
+    )
+
+
+def count_moves(match):
+    """Casillas ocupadas (para partidas guardadas antes de contar los movimientos)."""
+    if match["cells"] is not None:
+        return sum(1 for value in match["cells"] if value)
+    return sum(1 for row in match["board"] for symbol in row if symbol)
+
+
+def is_large(size):
+    """Indica si el tamaño corresponde al modo Gomoku (tablero grande)."""
+    return size in LARGE_SIZES
+
+
+def valid_size(size):
+    return size in CLASSIC_SIZES or size in LARGE_SIZES
+
+
+def in_line(size):
+    """
+    Fichas seguidas necesarias para ganar.
+    3 en tableros menores de 5x5, 4 hasta 7x7 y 5 en los tableros grandes.
+    """
+    if is_large(size):
+        return 5
+    return 4 if size >= 5 else 3
+
+
+def cell(match, x, y):
+    """Símbolo de la casilla ("" si está libre), sea cual sea el tablero."""
+    cells = match["cells"]
+    if cells is not None:
+        value = cells[x * match["size"] + y]
+        return chr(value) if value else ""
+    return match["board"][x][y]
+
+
+def place(match, x, y, symbol):
+    """Coloca una ficha en la casilla."""
+    if match["cells"] is not None:
+        match["cells"][x * match["size"] + y] = ord(symbol)
+    else:
+        match["board"][x][y] = symbol
+
+
+def wins_from(match, x, y, symbol):
+    """
+    Comprueba si la ficha recién puesta en (x, y) completa una línea.
+    Solo se recorren las cuatro líneas que pasan por esa casilla, hasta
+    in_line - 1 casillas a cada lado, así que el coste no depende del
+    tamaño del tablero.
+    """
+    size = match["size"]
+    needed = in_line(size)
+    for dx, dy in DIRECTIONS:
+        count = 1
+        for sign in (1, -1):
+            cx, cy = x + sign * dx, y + sign * dy
+            while (
+                count < needed
+                and 0 <= cx < size
+                and 0 <= cy < size
+                and cell(match, cx, cy) == symbol
+            ):
+                count += 1
+                cx, cy = cx + sign * dx, cy + sign * dy
+        if count >= needed:
+            return True
+    return False
+
+
+_line_tables = {}  # {size: (número de líneas, líneas que pasan por cada casilla)}
+
+
+def line_table(size):
+    """
+    Líneas del tablero: cada tramo de in_line(size) casillas seguidas en
+    fila, columna o diagonal. Devuelve cuántas hay y, para cada casilla
+    (x * size + y), los índices de las líneas que la contienen. Solo
+    depende del tamaño, así que se calcula una vez por tamaño.
+    """
+    table = _line_tables.get(size)
+    if table is None:
+        n = in_line(size)
+        by_cell = [[] for _ in range(size * size)]
+        count = 0
+        for x in range(size):
+            for y in range(size):
+                for dx, dy in DIRECTIONS:
+                    if 0 <= x + dx * (n - 1) < size and 0 <= y + dy * (n - 1) < size:
+                        for k in range(n):
+                            by_cell[(x + dx * k) * size + y + dy * k].append(count)
+                        count += 1
+        table = _line_tables[size] = (count, tuple(tuple(lines) for lines in by_cell))
+    return table
+
+
+def track_lines(match):
+    """
+    Inicializa el seguimiento de líneas ganables de la partida: un byte
+    por línea con los símbolos que contiene (1 = X, 2 = O) y el número de
+    líneas que aún tienen fichas de un solo símbolo (o ninguna).
+    """
+    size = match["size"]
+    count, _ = line_table(size)
+    match["lines"] = bytearray(count)
+    match["open_lines"] = count
+    for x in range(size):
+        for y in range(size):
+            symbol = cell(match, x, y)
+            if symbol:
+                update_lines(match, x, y, symbol)
+
+
+def update_lines(match, x, y, symbol):
+    """
+    Apunta la ficha en las líneas que pasan por (x, y) y devuelve cuántas
+    líneas quedan ganables. Con 0, ningún jugador puede ganar: empate.
+    """
+    bit = 1 if symbol == "X" else 2
+    lines = match["lines"]
+    size = match["size"]
+    for line in line_table(size)[1][x * size + y]:
+        mask = lines[line]
+        if mask == 3 - bit:  # tenía solo fichas del rival: deja de ser ganable
+            match["open_lines"] -= 1
+        lines[line] = mask | bit
+    return match["open_lines"]
+
+
+def is_over(match):
+    """Indica si la partida ha terminado (con ganador o en empate)."""
+    return bool(match["winner"] or match.get("draw"))
+
+
+def stone_list(match):
+    """Casillas ocupadas de un tablero grande (None en los tableros pequeños)."""
+    cells = match["cells"]
+    if cells is None:
+        return None
+    size = match["size"]
+    return [
+        {"x": index // size, "y": index % size, "symbol": chr(value)}
+        for index, value in enumerate(cells)
+        if value
+    ]
@@ -0,0 +1,80 @@
+"""
+Respuestas guardadas por Idempotency-Key.
+
+Los clientes móviles repiten un movimiento si no les llega la
+respuesta. Con la misma Idempotency-Key el reintento recibe la
+respuesta original en lugar de un 403/400, sin volver a validar el
+movimiento. Cada partida guarda como mucho `max_entries` respuestas
+durante `ttl` segundos; se guardan en orden de llegada, que es también
+el orden en que caducan, así que basta con podar por el principio.
+"""
+
+from collections import OrderedDict
+
+
+class ReplyCache:
+    """Caché acotada de respuestas por ámbito (partida) y clave."""
+
+    def __init__(self, max_entries=16, ttl=120.0, sweep_interval=60.0):
+        self.max_entries = max_entries  # respuestas por partida
+        self.ttl = ttl  # segundos
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.stored = 0
+        self._scopes = {}  # {partida: OrderedDict{clave: (caduca, respuesta)}}
+        self._last_sweep = 0.0
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._scopes.values())
+
+    def get(self, scope, key, now):
+        """Respuesta guardada para la clave o None si no hay (o ha caducado)."""
+        entries = self._scopes.get(scope)
+        if not entries:
+            return None
+        self._prune(scope, entries, now)
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, scope, key, reply, now):
+        """Guarda la respuesta; si la partida ya tiene max_entries, descarta la más antigua."""
+        entries = self._scopes.get(scope)
+        if entries:
+            self._prune(scope, entries, now)
+        entries = self._scopes.setdefault(scope, OrderedDict())
+        entries[key] = (now + self.ttl, reply)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        self.stored += 1
+
+    def forget(self, scope):
+        """Descarta las respuestas de una partida (p. ej. al eliminarla)."""
+        self._scopes.pop(scope, None)
+
+    def sweep(self, now):
+        """Elimina las respuestas caducadas. Como mucho una vez cada sweep_interval segundos."""
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        for scope, entries in list(self._scopes.items()):
+            self._prune(scope, entries, now)
+
+    def _prune(self, scope, entries, now):
+        while entries:
+            _, (expires, _) = next(iter(entries.items()))
+            if expires > now:
+                break
+            entries.popitem(last=False)
+        if not entries:
+            del self._scopes[scope]
+
+    def clear(self):
+        self._scopes.clear()
+        self.hits = 0
+        self.stored = 0
+
+    def stats(self):
+        return {"hits": self.hits, "stored": self.stored, "entries": len(self)}
@@ -0,0 +1,186 @@
+"""
+Diario binario de movimientos (append-only).
+
+Cada movimiento aceptado se guarda como un registro de ancho fijo:
+índice de partida, casilla, símbolo y timestamp. Las escrituras se
+acumulan en memoria y un hilo en segundo plano las vuelca al disco
+en grupos, con un único fsync por grupo. La lectura se hace con mmap
+y un índice en memoria de la posición de los registros de cada partida.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from time import time
+
+# índice de partida (uint32), casilla x*size+y (uint16), símbolo (1 byte), timestamp (float64)
+MOVE_RECORD = struct.Struct("<IHcd")
+MATCH_INDEX = struct.Struct("<I")  # primer campo de MOVE_RECORD
+
+
+class MoveJournal:
+    """Diario de movimientos con escritura agrupada y lectura por mmap."""
+
+    def __init__(self, path, group_size=256, group_interval=0.05):
+        self.path = str(path)
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self._buffer = bytearray()
+        self._pending = 0
+        self._buffer_lock = threading.Lock()  # protege el buffer en memoria
+        self._io_lock = threading.Lock()  # ordena las escrituras al fichero
+        self._wakeup = threading.Event()
+        self._file = None
+        self._flusher = None
+        self._next_index = None
+        self._offsets = {}  # {índice de partida: [posición de cada registro]}
+        self._indexed = 0  # bytes del fichero ya recorridos por el índice
+        self._index_lock = threading.Lock()
+        self._repair()
+
+    def _repair(self):
+        """
+        Recorta un registro a medias al final (caída durante la escritura).
+        Si se quedara, lo siguiente que se añadiera estaría desalineado.
+        """
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size % MOVE_RECORD.size:
+            os.truncate(self.path, size - size % MOVE_RECORD.size)
+
+    # ---------- escritura ----------
+    def new_match_index(self):
+        """Reserva un índice de partida que no aparezca ya en el diario."""
+        if self._next_index is None:
+            first = self._max_index_on_disk() + 1
+            with self._buffer_lock:
+                if self._next_index is None:
+                    self._next_index = first
+        with self._buffer_lock:
+            index = self._next_index
+            self._next_index += 1
+            return index
+
+    def reserve_through(self, match_index):
+        """
+        Hace que los próximos índices sean mayores que `match_index`. Al
+        recuperar el estado, una partida sin movimientos no deja rastro en
+        el diario y su índice volvería a repartirse.
+        """
+        first = max(self._max_index_on_disk(), match_index) + 1
+        with self._buffer_lock:
+            if self._next_index is None or self._next_index < first:
+                self._next_index = first
+
+    def append(self, match_index, cell, symbol, timestamp=None):
+        """Añade un movimiento al buffer. No bloquea en disco."""
+        record = MOVE_RECORD.pack(
+            match_index, cell, symbol.encode(), timestamp or time()
+        )
+        with self._buffer_lock:
+            self._buffer += record
+            self._pending += 1
+            if self._pending >= self.group_size:
+                self._wakeup.set()
+        if self._flusher is None:
+            self._start_flusher()
+
+    def flush(self, sync=True):
+        """Vuelca el buffer al fichero y, si sync, hace fsync del grupo."""
+        with self._io_lock:
+            with self._buffer_lock:
+                data = bytes(self._buffer)
+                self._buffer.clear()
+                self._pending = 0
+            if not data:
+                return
+            if self._file is None:
+                self._file = open(self.path, "ab")
+            self._file.write(data)
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        """Vuelca lo pendiente y cierra el fichero."""
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _start_flusher(self):
+        with self._buffer_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="move-journal", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.group_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    # ---------- lectura ----------
+    def records(self):
+        """Devuelve todos los registros como tuplas (índice, casilla, símbolo, ts)."""
+        self.flush(sync=False)
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return []
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Un registro a medias (caída durante la escritura) se ignora
+                usable = len(mm) - len(mm) % MOVE_RECORD.size
+                view = memoryview(mm)[:usable]
+                try:
+                    return [
+                        (index, cell, symbol.decode(), ts)
+                        for index, cell, symbol, ts in MOVE_RECORD.iter_unpack(view)
+                    ]
+                finally:
+                    view.release()
+
+    def replay(self, match_index):
+        """
+        Devuelve los movimientos de una partida en orden: (casilla, símbolo, ts).
+        Solo se decodifican los registros de esa partida.
+        """
+        self.flush(sync=False)
+        with self._index_lock:
+            self._update_index()
+            offsets = self._offsets.get(match_index)
+            if not offsets:
+                return []
+            with open(self.path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    moves = []
+                    for offset in offsets:
+                        _, cell, symbol, ts = MOVE_RECORD.unpack_from(mm, offset)
+                        moves.append((cell, symbol.decode(), ts))
+                    return moves
+
+    def _update_index(self):
+        # Se llama con _index_lock: añade al índice los registros escritos
+        # desde la última vez, leyendo solo el índice de partida de cada uno
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        usable = size - size % MOVE_RECORD.size
+        if usable <= self._indexed:
+            return
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset in range(self._indexed, usable, MOVE_RECORD.size):
+                    (index,) = MATCH_INDEX.unpack_from(mm, offset)
+                    self._offsets.setdefault(index, []).append(offset)
+        self._indexed = usable
+
+    def _max_index_on_disk(self):
+        with self._index_lock:
+            self._update_index()
+            return max(self._offsets, default=-1)
@@ -1,93 +1,296 @@
-from flask import Flask, request
-from flask_restx import Resource, Api, fields
+from flask import Flask, Response, current_app, g, request
+from flask_restx import Resource, Api, Namespace, fields, marshal
 from flask_cors import CORS
-from uuid import uuid4
-from datetime import timedelta
-from time import time
+from werkzeug.exceptions import HTTPException
+from functools import wraps
+from time import monotonic, perf_counter, time
+import atexit
+import json
+import math
+import os
 import random
 
+from accesslog import AccessLog
+from game import (
+    HISTORY_SIZE,
+    LOBBY_MAX_WAIT,
+    LOBBY_MAX_WAITERS,
+    POLL_BASELINE_MS,
+    GameState,
+    cell,
+    is_large,
+    is_over,
+    place,
+    stone_list,
+    update_lines,
+    wins_from,
+)
+from ranking import Leaderboard
+from matchstats import summary
+from sharding import COORDINATOR
+from tracing import Tracer, current_trace
+from wire import MSGPACK, MSGPACK_TYPES, decode_msgpack, msgpack, output_msgpack
+
 # ======== CONFIGURACIÓN ========
-DISCONNECT_TIMEOUT = timedelta(minutes=5)
+RATE_LIMIT_EXEMPT = {"tictactoe_match_move"}  # los movimientos ya los limita el turno
+# Valores por defecto de create_app(), tomados del entorno
+DEFAULT_CONFIG = {
+    "MOVE_JOURNAL_PATH": os.environ.get("MOVE_JOURNAL_PATH", "moves.journal"),
+    "STATE_DIR": os.environ.get("STATE_DIR", "state"),  # snapshots y diario de cambios
+    "SNAPSHOT_INTERVAL": float(os.environ.get("SNAPSHOT_INTERVAL", 60)),  # segundos
+    # Registro de accesos en JSON (vacío = desactivado); se rota al llegar a 10 MB
+    "ACCESS_LOG_PATH": os.environ.get("ACCESS_LOG_PATH", "access.log"),
+    # Trazas de fases en OTLP/JSON para una fracción de las peticiones (0 = ninguna)
+    "TRACE_SAMPLE_RATE": float(os.environ.get("TRACE_SAMPLE_RATE", 0)),
+    "TRACE_PATH": os.environ.get("TRACE_PATH", "traces.jsonl"),
+    "RATE_LIMIT_ENABLED": os.environ.get("RATE_LIMIT_ENABLED", "1") == "1",
+    # Peticiones POST /matches?wait= bloqueadas a la vez (cada una ocupa un hilo)
+    "LOBBY_MAX_WAITERS": int(os.environ.get("LOBBY_MAX_WAITERS", LOBBY_MAX_WAITERS)),
+    # Swagger UI y swagger.json; en producción se pueden desactivar con API_DOCS=0
+    "DOCS": os.environ.get("API_DOCS", "1") == "1",
+    # Modo shards: SHARD_PEERS="host:puerto,host:puerto,..." y SHARD_INDEX de este proceso
+    "SHARD_INDEX": int(os.environ.get("SHARD_INDEX", 0)),
+    "SHARD_PEERS": [
+        (host, int(port))
+        for host, port in (
+            peer.rsplit(":", 1)
+            for peer in os.environ.get("SHARD_PEERS", "").split(",")
+            if peer
+        )
+    ],
+}
 
-# ======== MODELOS EN MEMORIA ========
-devices = {}  # {device_id: {"last_active": timestamp, "wins": 0, "losses": 0, "alias": str}}
-matches = {}  # {match_id: {"players": {device_id: X/O}, "turn": device_id, "board": [[]], "size": int, "winner": symbol or None}}
-waiting_lobby = {}  # {device_id: {"size": int, "timestamp": timestamp}} - jugadores esperando partida
+# ======== API ========
+# Los modelos y rutas se declaran sobre un Namespace, que no necesita
+# aplicación: importar este módulo no crea la app ni Swagger.
+# create_app() los registra en cada aplicación nueva.
+api = Namespace("tictactoe", path="/", description="API REST del juego de TicTacToe")
 
-# ======== APP Y API ========
-app = Flask(__name__)
-CORS(app)
-api = Api(
-    app,
-    title="TicTacToe API",
-    version="1.0",
-    description="API REST del juego de TicTacToe",
-)
 
+def current_game():
+    """Estado del juego de la aplicación que atiende la petición."""
+    return current_app.extensions["tictactoe"]
 
-# ======== FUNCIONES AUXILIARES ========
-def cleanup_inactive_devices():
+
+class WaitingForOpponent(HTTPException):
+    """Respuesta 202 del lobby (werkzeug no define una excepción para 202)."""
+
+    code = 202
+
+    def __init__(self, description, retry_after_ms):
+        super().__init__(description)
+        # flask-restx usa `data` como cuerpo de la respuesta de error
+        self.data = {"message": description, "retry_after_ms": retry_after_ms}
+
+
+def with_state_lock(method):
+    """Ejecuta el método del endpoint con el estado bloqueado."""
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with current_game().lock:
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+class GameResource(Resource):
+    """Recurso base: todos los endpoints acceden al estado bajo su lock."""
+
+    method_decorators = [with_state_lock]
+
+
+def is_msgpack_body():
+    return msgpack is not None and request.mimetype in MSGPACK_TYPES
+
+
+def request_data(silent=False):
     """
-    Elimina dispositivos inactivos por más de DISCONNECT_TIMEOUT.
-    También limpia el lobby de espera.
+    Cuerpo de la petición en JSON o, con Content-Type application/msgpack,
+    en MessagePack. Como get_json(): con silent=True devuelve None si no
+    se puede leer; si no, responde 400 (o 415 si no es ninguno de los dos).
     """
-    now = time()
-    inactive = [
-        d
-        for d, info in devices.items()
-        if now - info["last_active"] > DISCONNECT_TIMEOUT.total_seconds()
-    ]
-    for d in inactive:
-        del devices[d]
-        # Limpiar del lobby si estaba esperando
-        if d in waiting_lobby:
-            del waiting_lobby[d]
+    if not is_msgpack_body():
+        return request.get_json(silent=silent)
+    # Se decodifica una vez por petición (también lo lee el control de admisión)
+    if "tictactoe.body" not in request.environ:
+        try:
+            body = decode_msgpack(request.get_data())
+        except ValueError:
+            body = None
+        request.environ["tictactoe.body"] = body
+    body = request.environ["tictactoe.body"]
+    if body is None and not silent:
+        api.abort(400, "Cuerpo MessagePack no válido")
+    return body
 
 
-def update_activity(device_id):
-    """Actualiza la última actividad del dispositivo."""
-    if device_id in devices:
-        devices[device_id]["last_active"] = time()
+def request_device_id():
+    """
+    device_id de la ruta, del cuerpo (JSON o MessagePack) o de la query
+    string de la petición (o None).
+    """
+    device_id = (request.view_args or {}).get("device_id")
+    if device_id is None and (request.is_json or is_msgpack_body()):
+        data = request_data(silent=True)
+        device_id = data.get("device_id") if isinstance(data, dict) else None
+    if device_id is None:
+        device_id = request.args.get("device_id")  # GET /matches/<id>?device_id=
+    return device_id
 
 
-def check_winner(board, size):
+def start_timer():
+    """Marca el inicio de la petición (registro de accesos) y, si toca, su traza."""
+    g.started = perf_counter()
+    tracer = current_app.extensions["tracer"]
+    if tracer.sample():
+        route = request.url_rule.rule if request.url_rule else request.path
+        g.trace_token = tracer.begin(
+            f"{request.method} {route}",
+            {"http.method": request.method, "http.route": route},
+        )
+
+
+def log_access(response):
     """
-    Verifica si hay ganador en el tablero.
-    Para tableros de 5x5 o mayores, se necesitan 4 en línea.
-    Para tableros menores, se necesitan 3 en línea.
+    Deja el registro de la petición en la cola del AccessLog.
+    Solo se construye una tupla: el JSON y la escritura los hace su hilo.
     """
-    n_in_line = 4 if size >= 5 else 3
+    access_log = current_app.extensions["access_log"]
+    if access_log.enabled:
+        view_args = request.view_args or {}
+        access_log.log(
+            (
+                time(),
+                request.method,
+                request.path,
+                request.endpoint,
+                response.status_code,
+                request_device_id(),
+                view_args.get("match_id"),
+                int((perf_counter() - g.started) * 1_000_000),
+            )
+        )
+    token = g.pop("trace_token", None)
+    if token is not None:
+        # La última fase marcada incluye marshal_with y la respuesta
+        current_app.extensions["tracer"].finish(token, {"http.status_code": response.status_code})
+    return response
 
-    def check_line(cells):
-        if len(set(cells)) == 1 and cells[0] in ["X", "O"]:
-            return cells[0]
-        return None
 
-    # Filas y columnas
-    for i in range(size):
-        for j in range(size - n_in_line + 1):
-            row_segment = board[i][j : j + n_in_line]
-            winner = check_line(row_segment)
-            if winner:
-                return winner
-            col_segment = [board[j + k][i] for k in range(n_in_line)]
-            winner = check_line(col_segment)
-            if winner:
-                return winner
-
-    # Diagonales
-    for i in range(size - n_in_line + 1):
-        for j in range(size - n_in_line + 1):
-            diag1 = [board[i + k][j + k] for k in range(n_in_line)]
-            diag2 = [board[i + k][j + n_in_line - 1 - k] for k in range(n_in_line)]
-            for diag in [diag1, diag2]:
-                winner = check_line(diag)
-                if winner:
-                    return winner
+def end_trace(error):
+    """Cierra la traza si la petición terminó con una excepción sin respuesta."""
+    token = g.pop("trace_token", None)
+    if token is not None:
+        current_app.extensions["tracer"].finish(token, {"http.status_code": 500})
 
+
+def admission_control():
+    """
+    Limita las peticiones por IP y por dispositivo (token bucket).
+    Se ejecuta antes de los recursos y sin tomar el lock del estado; si se
+    rechaza la petición responde 429 con Retry-After.
+    """
+    if not current_app.config["RATE_LIMIT_ENABLED"] or request.endpoint in RATE_LIMIT_EXEMPT:
+        return None
+    game = current_game()
+    if game.shard is not None and request.path.startswith("/internal/"):
+        return None  # llamadas entre shards
+    now = time()
+    client_ip = request.remote_addr
+    if game.shard is not None:  # detrás del router local
+        client_ip = request.headers.get("X-Forwarded-For", client_ip)
+    retry_after = game.ip_limiter.allow(client_ip, now)
+    if not retry_after:
+        device_id = request_device_id()
+        # Solo los dispositivos registrados tienen cubo: expira con ellos
+        if device_id in game.devices:
+            retry_after = game.device_limiter.allow(device_id, now)
+    if retry_after:
+        return (
+            {"message": "Demasiadas peticiones, vuelve a intentarlo más tarde"},
+            429,
+            {"Retry-After": str(math.ceil(retry_after))},
+        )
     return None
 
 
+# ======== FUNCIONES AUXILIARES ========
+def spectator_body(game, match_id, match):
+    """
+    Respuesta de sincronización para espectadores, codificada una sola
+    vez por versión de la partida y compartida por todos ellos.
+    """
+    game.poll_stats["spectator_reads"] += 1
+    cached = game.spectator_cache.get(match_id)
+    if cached is not None and cached[0] == match["version"]:
+        return cached[1]
+    payload = marshal(
+        {
+            "board": match["board"],
+            "stones": stone_list(match),
+            "turn": match["turn"],
+            "winner": match["winner"],
+            "draw": match["draw"],
+            "size": match["size"],
+            "players": match["players"],
+            "opponent_left": match.get("forfeited_by") is not None,
+            "retry_after_ms": POLL_BASELINE_MS,
+        },
+        sync_response,
+    )
+    body = json.dumps(payload).encode() + b"\n"
+    game.spectator_cache[match_id] = (match["version"], body)
+    game.poll_stats["spectator_serializations"] += 1
+    return body
+
+
+def lobby_round(game, device_id, size, rating):
+    """
+    Un intento de emparejar en el lobby: local o, en modo shards, en el
+    coordinador. Devuelve la respuesta de GameState.pair_in_lobby().
+    """
+    if game.shard is None or game.shard.is_coordinator:
+        try:
+            return game.pair_in_lobby(device_id, size, rating)
+        except OSError:
+            api.abort(502, "No se pudo crear la partida en su shard")
+    status, result = game.shard.call(
+        COORDINATOR,
+        "POST",
+        "/internal/lobby",
+        {"device_id": device_id, "size": size, "rating": rating},
+    )
+    if status != 200:
+        api.abort(502, "El coordinador del lobby no responde")
+    return result
+
+
+def wait_for_opponent(game, event, device_id, size, rating, wait, result):
+    """
+    POST /matches?wait=: bloquea la petición hasta que otro jugador empareje
+    al dispositivo o pasen `wait` segundos. Solo vuelve a mirar el lobby
+    cuando le avisan por `event` (notify_lobby_waiters), no cada vez que
+    vencería el intervalo de sondeo.
+    """
+    deadline = monotonic() + wait
+    while result["status"] == "waiting" and game.lobby_open:
+        remaining = deadline - monotonic()
+        if remaining <= 0 or not event.wait(remaining):
+            break
+        event.clear()
+        with game.lock:
+            # Sin shards el rival ya ha creado la partida y la ha enlazado
+            device = game.devices.get(device_id)
+            if device is None:
+                break
+            active_match = device.get("active_match")
+        if active_match:
+            return {"status": "paired", "match": active_match}
+        result = lobby_round(game, device_id, size, rating)
+    return result
+
+
 # ======== MODELOS DE DOCUMENTACIÓN ========
 register_request = api.model(
     "RegisterRequest",
@@ -108,16 +311,24 @@ device_list_response = api.model(
     {
         "connected_devices": fields.List(
             fields.String, description="IDs de los dispositivos actualmente conectados"
-        )
+        ),
+        "next_cursor": fields.String(
+            description="Cursor de la página siguiente (None si es la última)"
+        ),
     },
 )
 
+device_count_response = api.model(
+    "DeviceCountResponse",
+    {"connected": fields.Integer(description="Dispositivos registrados")},
+)
+
 match_create_request = api.model(
     "MatchCreateRequest",
     {
         "size": fields.Integer(
             required=False, 
-            description="Tamaño del tablero (3-7). Por defecto aleatorio."
+            description="Tamaño del tablero (3-7, o 15/19 para Gomoku). Por defecto aleatorio (3-7)."
         )
     },
 )
@@ -131,6 +342,46 @@ match_create_response = api.model(
     },
 )
 
+bulk_match_item = api.model(
+    "BulkMatchItem",
+    {
+        "players": fields.List(
+            fields.String,
+            required=True,
+            description="Los dos device_id de la partida (el primero juega con X)",
+        ),
+        "size": fields.Integer(
+            required=False,
+            description="Tamaño del tablero (3-7, o 15/19 para Gomoku). Por defecto 3.",
+        ),
+    },
+)
+
+bulk_match_request = api.model(
+    "BulkMatchRequest",
+    {"matches": fields.List(fields.Nested(bulk_match_item), required=True)},
+)
+
+bulk_match_result = api.model(
+    "BulkMatchResult",
+    {
+        "index": fields.Integer(description="Posición de la pareja en la petición"),
+        "match_id": fields.String(description="ID de la partida creada"),
+        "players": fields.Raw(description="Diccionario de jugadores y sus símbolos"),
+        "board_size": fields.Integer(description="Tamaño del tablero"),
+        "error": fields.String(description="Motivo si no se creó la partida"),
+    },
+)
+
+bulk_match_response = api.model(
+    "BulkMatchResponse",
+    {
+        "created": fields.Integer(description="Partidas creadas"),
+        "failed": fields.Integer(description="Parejas rechazadas"),
+        "results": fields.List(fields.Nested(bulk_match_result)),
+    },
+)
+
 move_request = api.model(
     "MoveRequest",
     {
@@ -140,14 +391,28 @@ move_request = api.model(
     },
 )
 
+stone = api.model(
+    "Stone",
+    {
+        "x": fields.Integer(description="Coordenada X"),
+        "y": fields.Integer(description="Coordenada Y"),
+        "symbol": fields.String(description="Símbolo de la ficha"),
+    },
+)
+
 move_response = api.model(
     "MoveResponse",
     {
         "board": fields.List(
-            fields.List(fields.String), description="Estado actualizado del tablero"
+            fields.List(fields.String),
+            description="Estado actualizado del tablero (None en tableros de 15 y 19)",
+        ),
+        "changes": fields.List(
+            fields.Nested(stone), description="Casillas que ha cambiado el movimiento"
         ),
         "next_turn": fields.String(description="ID del siguiente jugador"),
         "winner": fields.String(description="Símbolo del ganador (si existe)"),
+        "draw": fields.Boolean(description="Indica si la partida acabó en empate"),
     },
 )
 
@@ -155,13 +420,24 @@ sync_response = api.model(
     "SyncResponse",
     {
         "board": fields.List(
-            fields.List(fields.String), description="Estado actual del tablero"
+            fields.List(fields.String),
+            description="Estado actual del tablero (None en tableros de 15 y 19)",
+        ),
+        "stones": fields.List(
+            fields.Nested(stone),
+            description="Casillas ocupadas en tableros de 15 y 19 (None en el resto)",
         ),
         "turn": fields.String(description="ID del jugador cuyo turno es"),
         "winner": fields.String(description="Símbolo del ganador, si hay uno"),
+        "draw": fields.Boolean(
+            description="Indica si la partida acabó en empate (ninguna línea ganable)"
+        ),
         "size": fields.Integer(description="Tamaño del tablero"),
         "players": fields.Raw(description="Diccionario de jugadores y sus símbolos"),
         "opponent_left": fields.Boolean(description="Indica si el oponente abandonó"),
+        "retry_after_ms": fields.Integer(
+            description="Milisegundos sugeridos hasta el siguiente sondeo"
+        ),
     },
 )
 
@@ -196,16 +472,160 @@ device_status_response = api.model(
         ),
         "wins": fields.Integer(description="Número de victorias"),
         "losses": fields.Integer(description="Número de derrotas"),
+        "draws": fields.Integer(description="Número de empates"),
+        "ratio": fields.Float(description="Ratio de victorias/(victorias+derrotas)"),
+        "rating": fields.Float(description="Rating Elo del dispositivo"),
+    },
+)
+
+leaderboard_entry = api.model(
+    "LeaderboardEntry",
+    {
+        "rank": fields.Integer(description="Posición (desde 1)"),
+        "device_id": fields.String(description="ID del dispositivo"),
+        "alias": fields.String(description="Alias del dispositivo"),
+        "wins": fields.Integer(description="Número de victorias"),
+        "losses": fields.Integer(description="Número de derrotas"),
         "ratio": fields.Float(description="Ratio de victorias/(victorias+derrotas)"),
     },
 )
 
+leaderboard_response = api.model(
+    "LeaderboardResponse",
+    {
+        "by": fields.String(description="Criterio de orden: wins o ratio"),
+        "total": fields.Integer(description="Dispositivos clasificados"),
+        "offset": fields.Integer(description="Posición inicial de la página"),
+        "entries": fields.List(fields.Nested(leaderboard_entry)),
+    },
+)
+
+rank_response = api.model(
+    "RankResponse",
+    {
+        "device_id": fields.String(description="ID del dispositivo"),
+        "by": fields.String(description="Criterio de orden: wins o ratio"),
+        "rank": fields.Integer(description="Posición (desde 1)"),
+        "total": fields.Integer(description="Dispositivos clasificados"),
+    },
+)
+
+history_entry = api.model(
+    "HistoryEntry",
+    {
+        "match_id": fields.String(description="ID de la partida"),
+        "opponent_id": fields.String(description="ID del rival"),
+        "size": fields.Integer(description="Tamaño del tablero"),
+        "result": fields.String(description="win, loss o draw"),
+        "reason": fields.String(description="Cómo terminó: line, draw, surrender, leave o forfeit"),
+        "moves": fields.Integer(description="Movimientos jugados"),
+        "started_at": fields.Float(description="Inicio (timestamp)"),
+        "ended_at": fields.Float(description="Fin (timestamp)"),
+    },
+)
+
+history_response = api.model(
+    "HistoryResponse",
+    {
+        "device_id": fields.String(description="ID del dispositivo"),
+        "matches": fields.List(
+            fields.Nested(history_entry), description="Partidas terminadas, la más reciente primero"
+        ),
+    },
+)
+
+limiter_stats = api.model(
+    "LimiterStats",
+    {
+        "allowed": fields.Integer(description="Peticiones admitidas"),
+        "rejected": fields.Integer(description="Peticiones rechazadas con 429"),
+        "buckets": fields.Integer(description="Cubos activos en memoria"),
+    },
+)
+
+ratelimit_response = api.model(
+    "RateLimitResponse",
+    {
+        "device": fields.Nested(limiter_stats, description="Límite por dispositivo"),
+        "ip": fields.Nested(limiter_stats, description="Límite por IP"),
+    },
+)
+
+accesslog_response = api.model(
+    "AccessLogResponse",
+    {
+        "written": fields.Integer(description="Registros escritos"),
+        "dropped": fields.Integer(description="Registros descartados con la cola llena"),
+        "queued": fields.Integer(description="Registros pendientes de escribir"),
+        "rotations": fields.Integer(description="Rotaciones del fichero"),
+    },
+)
+
+polling_response = api.model(
+    "PollingResponse",
+    {
+        "polls": fields.Integer(description="Sondeos atendidos"),
+        "baseline_ms": fields.Integer(description="Intervalo fijo anterior"),
+        "avg_retry_after_ms": fields.Float(description="Intervalo medio sugerido"),
+        "avg_observed_ms": fields.Float(
+            description="Intervalo medio real entre sondeos del mismo dispositivo"
+        ),
+        "estimated_reduction": fields.Float(
+            description="Reducción estimada de peticiones frente al intervalo fijo"
+        ),
+        "spectator_reads": fields.Integer(description="Sondeos de espectadores"),
+        "spectator_serializations": fields.Integer(
+            description="Respuestas de espectador serializadas (una por cambio de partida)"
+        ),
+        "lobby_waits": fields.Integer(description="Peticiones POST /matches?wait= que han esperado"),
+        "lobby_waiting": fields.Integer(description="Peticiones esperando rival ahora mismo"),
+        "lobby_waits_refused": fields.Integer(
+            description="Peticiones con ?wait= respondidas sin esperar (límite de esperas)"
+        ),
+    },
+)
+
+stats_fields = {
+    "created": fields.Integer(description="Partidas creadas"),
+    "finished": fields.Integer(description="Partidas terminadas"),
+    "x_wins": fields.Integer(description="Victorias de X"),
+    "o_wins": fields.Integer(description="Victorias de O"),
+    "draws": fields.Integer(description="Empates"),
+    "surrenders": fields.Integer(description="Partidas terminadas por rendición"),
+    "leaves": fields.Integer(description="Partidas terminadas por abandono"),
+    "forfeits": fields.Integer(description="Partidas perdidas por expirar el dispositivo"),
+    "x_win_rate": fields.Float(description="Victorias de X / terminadas"),
+    "o_win_rate": fields.Float(description="Victorias de O / terminadas"),
+    "draw_rate": fields.Float(description="Empates / terminadas"),
+    "surrender_rate": fields.Float(description="Rendiciones / terminadas"),
+    "leave_rate": fields.Float(description="Abandonos / terminadas"),
+    "forfeit_rate": fields.Float(description="Expiraciones / terminadas"),
+    "avg_moves": fields.Float(description="Movimientos por partida terminada"),
+    "avg_seconds": fields.Float(description="Duración media de las partidas terminadas"),
+    "moves": fields.Integer(description="Movimientos de las partidas terminadas"),
+    "seconds": fields.Float(description="Segundos de las partidas terminadas"),
+}
+
+size_stats = api.model(
+    "SizeStats",
+    {"size": fields.Integer(description="Tamaño del tablero"), **stats_fields},
+)
+
+stats_response = api.model(
+    "StatsResponse",
+    {
+        **stats_fields,
+        "by_size": fields.List(fields.Nested(size_stats), description="Los mismos datos por tamaño"),
+    },
+)
+
 reset_stats_response = api.model(
     "ResetStatsResponse",
     {
         "message": fields.String(description="Mensaje de confirmación"),
         "wins": fields.Integer(description="Número de victorias (0 después del reset)"),
         "losses": fields.Integer(description="Número de derrotas (0 después del reset)"),
+        "draws": fields.Integer(description="Número de empates (0 después del reset)"),
     },
 )
 
@@ -216,6 +636,27 @@ surrender_request = api.model(
     },
 )
 
+replay_move = api.model(
+    "ReplayMove",
+    {
+        "x": fields.Integer(description="Coordenada X del movimiento"),
+        "y": fields.Integer(description="Coordenada Y del movimiento"),
+        "symbol": fields.String(description="Símbolo colocado"),
+        "timestamp": fields.Float(description="Momento del movimiento (epoch)"),
+    },
+)
+
+replay_response = api.model(
+    "ReplayResponse",
+    {
+        "match_id": fields.String(description="ID de la partida"),
+        "size": fields.Integer(description="Tamaño del tablero"),
+        "moves": fields.List(
+            fields.Nested(replay_move), description="Movimientos en orden"
+        ),
+    },
+)
+
 surrender_response = api.model(
     "SurrenderResponse",
     {
@@ -226,89 +667,244 @@ surrender_response = api.model(
 
 # ======== ENDPOINTS ========
 @api.route("/devices")
-class Devices(Resource):
+class Devices(GameResource):
     @api.expect(register_request)
     @api.marshal_with(register_response, code=201)
     def post(self):
         """Registra un nuevo dispositivo."""
-        device_id = str(uuid4())
+        game = current_game()
         data = request.get_json(silent=True) or {}
-        alias = data.get("alias", device_id[:8])
-        devices[device_id] = {
-            "last_active": time(),
-            "wins": 0,
-            "losses": 0,
-            "alias": alias,
-        }
+        device_id = game.register_device(data.get("alias"))
         return {"device_id": device_id}, 201
 
     @api.marshal_with(device_list_response)
     def get(self):
-        """Lista los dispositivos conectados."""
-        cleanup_inactive_devices()
-        return {"connected_devices": list(devices.keys())}
+        """
+        Lista los dispositivos conectados por páginas (?cursor=&limit=).
+        El cursor es el último device_id de la página anterior, así que
+        las altas y bajas entre páginas no repiten ni saltan dispositivos.
+        Con ?all=1 devuelve la lista completa en una sola respuesta.
+        """
+        game = current_game()
+        game.cleanup_inactive_devices()
+        if request.args.get("all") == "1":
+            return {"connected_devices": list(game.devices.keys()), "next_cursor": None}
+
+        limit = max(1, min(1000, request.args.get("limit", 100, type=int)))
+        cursor = request.args.get("cursor")
+        page = []
+        for device_id in game.device_index.iter_from(
+            game.device_index.bisect_left(cursor) if cursor else 0
+        ):
+            if device_id == cursor or device_id not in game.devices:
+                continue
+            if len(page) == limit:
+                return {"connected_devices": page, "next_cursor": page[-1]}
+            page.append(device_id)
+        return {"connected_devices": page, "next_cursor": None}
+
+
+@api.route("/devices/count")
+class DeviceCount(GameResource):
+    @api.marshal_with(device_count_response)
+    def get(self):
+        """
+        Número de dispositivos registrados, sin recorrerlos. Los que han
+        caducado se descuentan en la siguiente limpieza de inactivos.
+        """
+        game = current_game()
+        return {"connected": len(game.devices)}
 
 
 @api.route("/devices/<device_id>/info")
-class Device(Resource):
+class Device(GameResource):
     @api.marshal_with(device_status_response)
     def get(self, device_id):
         """Obtiene el estado de un dispositivo y sus estadísticas globales."""
-        cleanup_inactive_devices()
-        if device_id not in devices:
+        game = current_game()
+        game.cleanup_inactive_devices()
+        if device_id not in game.devices:
             api.abort(404, "Dispositivo no encontrado")
 
-        device = devices[device_id]
+        device = game.devices[device_id]
         ratio = device["wins"] / max(1, device["wins"] + device["losses"])
         return {
             "connected": True,
             "wins": device["wins"],
             "losses": device["losses"],
+            "draws": device["draws"],
             "ratio": ratio,
+            "rating": device["rating"],
         }
 
 
 @api.route("/devices/<device_id>/stats/reset")
-class DeviceStatsReset(Resource):
+class DeviceStatsReset(GameResource):
     @api.marshal_with(reset_stats_response)
     def post(self, device_id):
         """Reinicia las estadísticas de victorias y derrotas de un dispositivo."""
-        cleanup_inactive_devices()
-        if device_id not in devices:
+        game = current_game()
+        game.cleanup_inactive_devices()
+        if device_id not in game.devices:
             api.abort(404, "Dispositivo no encontrado")
         
-        devices[device_id]["wins"] = 0
-        devices[device_id]["losses"] = 0
-        update_activity(device_id)
+        game.devices[device_id]["wins"] = 0
+        game.devices[device_id]["losses"] = 0
+        game.devices[device_id]["draws"] = 0
+        game.refresh_rank(device_id)
+        game.update_activity(device_id)  # también marca el dispositivo para persistir
         
         return {
             "message": "Estadísticas reiniciadas correctamente",
             "wins": 0,
             "losses": 0,
+            "draws": 0,
         }
 
 
+def leaderboard_order():
+    """Lee y valida el criterio de orden (?by=wins|ratio)."""
+    by = request.args.get("by", "wins")
+    if by not in Leaderboard.ORDERS:
+        api.abort(400, "Criterio de orden no válido (wins o ratio)")
+    return by
+
+
+def leaderboard_page(game, by, offset, limit):
+    """Página de la clasificación de este proceso, como la devuelve GET /leaderboard."""
+    entries = []
+    for position, device_id in enumerate(
+        game.leaderboard.page(by, offset, limit), start=offset + 1
+    ):
+        device = game.devices[device_id]
+        entries.append(
+            {
+                "rank": position,
+                "device_id": device_id,
+                "alias": device["alias"],
+                "wins": device["wins"],
+                "losses": device["losses"],
+                "ratio": device["wins"] / max(1, device["wins"] + device["losses"]),
+            }
+        )
+    return {"by": by, "total": len(game.leaderboard), "offset": offset, "entries": entries}
+
+
+@api.route("/devices/<device_id>/rank")
+class DeviceRank(GameResource):
+    @api.marshal_with(rank_response)
+    def get(self, device_id):
+        """Devuelve la posición del dispositivo en la clasificación."""
+        game = current_game()
+        by = leaderboard_order()
+        rank = game.leaderboard.rank(device_id, by)
+        if rank is None:
+            api.abort(404, "Dispositivo no encontrado")
+        return {
+            "device_id": device_id,
+            "by": by,
+            "rank": rank + 1,
+            "total": len(game.leaderboard),
+        }
+
+
+@api.route("/devices/<device_id>/history")
+class DeviceHistory(GameResource):
+    @api.marshal_with(history_response)
+    def get(self, device_id):
+        """
+        Devuelve las últimas partidas terminadas del dispositivo (?limit=, como
+        mucho HISTORY_SIZE). Se leen del búfer circular del dispositivo.
+        """
+        game = current_game()
+        if device_id not in game.devices:
+            api.abort(404, "Dispositivo no encontrado")
+        limit = max(1, min(HISTORY_SIZE, request.args.get("limit", 10, type=int)))
+        return {"device_id": device_id, "matches": game.recent_history(device_id, limit)}
+
+
+@api.route("/leaderboard")
+class LeaderboardPage(GameResource):
+    @api.marshal_with(leaderboard_response)
+    def get(self):
+        """Devuelve una página de la clasificación (?by=wins|ratio&offset=&limit=)."""
+        game = current_game()
+        by = leaderboard_order()
+        offset = max(0, request.args.get("offset", 0, type=int))
+        limit = max(1, min(100, request.args.get("limit", 10, type=int)))
+        return leaderboard_page(game, by, offset, limit)
+
+
+@api.route("/ratelimit")
+class RateLimitStats(GameResource):
+    @api.marshal_with(ratelimit_response)
+    def get(self):
+        """Devuelve los contadores del control de admisión."""
+        game = current_game()
+        return {"device": game.device_limiter.stats(), "ip": game.ip_limiter.stats()}
+
+
+@api.route("/accesslog")
+class AccessLogStats(Resource):
+    @api.marshal_with(accesslog_response)
+    def get(self):
+        """Devuelve los contadores del registro de accesos (no toma el lock del estado)."""
+        return current_app.extensions["access_log"].stats()
+
+
+@api.route("/polling")
+class PollingStats(GameResource):
+    @api.marshal_with(polling_response)
+    def get(self):
+        """Devuelve el ahorro de sondeos gracias a los intervalos sugeridos."""
+        game = current_game()
+        polls = game.poll_stats["polls"]
+        avg_suggested = game.poll_stats["suggested_ms"] / polls if polls else POLL_BASELINE_MS
+        observed = game.poll_stats["observed"]
+        return {
+            "polls": polls,
+            "baseline_ms": POLL_BASELINE_MS,
+            "avg_retry_after_ms": avg_suggested,
+            "avg_observed_ms": game.poll_stats["observed_ms"] / observed if observed else None,
+            # Con intervalos medios de avg_suggested se hacen baseline/avg peticiones
+            "estimated_reduction": 1 - POLL_BASELINE_MS / avg_suggested,
+            "spectator_reads": game.poll_stats["spectator_reads"],
+            "spectator_serializations": game.poll_stats["spectator_serializations"],
+            "lobby_waits": game.poll_stats["lobby_waits"],
+            "lobby_waiting": game.lobby_waiting,
+            "lobby_waits_refused": game.poll_stats["lobby_waits_refused"],
+        }
+
+
+@api.route("/stats")
+class GlobalStats(GameResource):
+    @api.marshal_with(stats_response)
+    def get(self):
+        """
+        Devuelve las estadísticas globales de las partidas. Los contadores se
+        mantienen al crear y terminar partidas: no recorre partidas ni dispositivos.
+        """
+        return summary(current_game().stats.totals())
+
+
 @api.route("/devices/<device_id>/match")
-class DeviceMatch(Resource):
+class DeviceMatch(GameResource):
     @api.marshal_with(device_match_response)
     def get(self, device_id):
         """
         Busca si existe una partida activa para este dispositivo.
         Útil para reconectar a una partida en curso.
         """
-        cleanup_inactive_devices()
+        game = current_game()
+        game.cleanup_inactive_devices()
         
-        if device_id not in devices:
+        if device_id not in game.devices:
             api.abort(404, "Dispositivo no encontrado")
         
-        # Buscar partida activa para este dispositivo
-        for match_id, match in matches.items():
-            if device_id in match["players"] and not match["winner"]:
-                return {
-                    "match_id": match_id,
-                    "players": match["players"],
-                    "board_size": match["size"],
-                }
+        # Partida activa enlazada al dispositivo (sin recorrer matches)
+        active_match = game.devices[device_id].get("active_match")
+        if active_match:
+            return active_match
         
         api.abort(404, "No hay partida activa para este dispositivo")
 
@@ -316,148 +912,282 @@ class DeviceMatch(Resource):
 @api.route("/matches")
 class CreateMatch(Resource):
     @api.expect(match_create_request)
+    @api.doc(
+        params={
+            "wait": {
+                "in": "query",
+                "type": "number",
+                "description": "Segundos (como mucho 20) que se espera a un rival antes de"
+                " responder 202",
+            }
+        }
+    )
     @api.marshal_with(match_create_response, code=201)
     def post(self):
         """
         Crea una nueva partida o une a un jugador al lobby de espera.
-        Si hay otro jugador esperando con el mismo tamaño de tablero, los empareja.
-        Si no, el jugador entra en el lobby de espera.
+        Si hay otro jugador esperando con el mismo tamaño de tablero y un
+        rating cercano, los empareja. La diferencia de rating aceptada crece
+        con el tiempo de espera. Si no, el jugador entra en el lobby.
+        Con ?wait=<segundos> la petición no responde 202 enseguida: espera
+        hasta que llegue un rival y devuelve la partida en cuanto se crea.
         """
-        cleanup_inactive_devices()
-        
-        data = request.get_json(silent=True) or {}
+        game = current_game()
+        trace = current_trace()
+        trace.phase("parse")
+        data = request_data(silent=True) or {}
         size = data.get("size")
         device_id = data.get("device_id")
+        wait = max(0.0, min(LOBBY_MAX_WAIT, request.args.get("wait", 0.0, type=float)))
         
         if not device_id:
             api.abort(400, "Se requiere device_id")
         
-        if device_id not in devices:
-            api.abort(404, "Dispositivo no encontrado")
-        
-        # Verificar si este dispositivo ya está en una partida activa
-        for match_id, match in matches.items():
-            if device_id in match["players"] and not match["winner"]:
-                # Ya está en una partida, retornarla
-                return {
-                    "match_id": match_id,
-                    "players": match["players"],
-                    "board_size": match["size"]
-                }, 201
-        
-        if size is None:
-            size = random.randint(3, 7)
-        else:
-            size = max(3, min(7, int(size)))
-        
-        # Buscar si hay alguien esperando con el mismo tamaño de tablero
-        opponent_id = None
-        for waiting_id, waiting_info in list(waiting_lobby.items()):
-            if waiting_info["size"] == size and waiting_id != device_id:
-                opponent_id = waiting_id
-                break
-        
-        if opponent_id:
-            # ¡Emparejamiento encontrado! Crear partida
-            del waiting_lobby[opponent_id]
-            # Remover al dispositivo actual del lobby si estaba
-            if device_id in waiting_lobby:
-                del waiting_lobby[device_id]
-            
-            # Asignar símbolos aleatoriamente
-            players_list = [device_id, opponent_id]
-            random.shuffle(players_list)
-            
-            board = [["" for _ in range(size)] for _ in range(size)]
-            match_id = str(uuid4())
-            
-            players = {players_list[0]: "X", players_list[1]: "O"}
-            turn = next(pid for pid, sym in players.items() if sym == "X")
-            
-            matches[match_id] = {
-                "players": players,
-                "turn": turn,
-                "board": board,
-                "size": size,
-                "winner": None,
-            }
-            
-            update_activity(device_id)
-            update_activity(opponent_id)
-            
-            return {"match_id": match_id, "players": players, "board_size": size}, 201
-        else:
-            # No hay oponente, entrar en el lobby de espera
-            waiting_lobby[device_id] = {
-                "size": size,
-                "timestamp": time()
-            }
-            update_activity(device_id)
-            api.abort(202, f"Esperando oponente para tablero {size}x{size}")
+        # No se usa GameResource: en modo shards el lobby se consulta al
+        # coordinador y el lock no puede quedar tomado durante la llamada
+        with game.lock:
+            trace.phase("cleanup")
+            game.cleanup_inactive_devices()
+            if device_id not in game.devices:
+                api.abort(404, "Dispositivo no encontrado")
+
+            # Verificar si este dispositivo ya está en una partida activa
+            trace.phase("active_match")
+            active_match = game.devices[device_id].get("active_match")
+            if active_match:
+                trace.phase("marshal")
+                return active_match, 201
+
+            if size is None:
+                size = random.randint(3, 7)
+            else:
+                size = int(size)
+                if not is_large(size):  # 15 y 19 son los tableros de Gomoku
+                    size = max(3, min(7, size))
+            rating = game.devices[device_id]["rating"]
+            game.update_activity(device_id)
+
+        trace.phase("lobby")
+        trace.set("board.size", size)
+        # Se registra antes de mirar el lobby para no perder un aviso que
+        # llegue entre el primer intento y la espera
+        event = game.add_lobby_waiter(device_id) if wait else None
+        try:
+            result = lobby_round(game, device_id, size, rating)
+            if event is not None and result["status"] == "waiting":
+                trace.phase("wait")
+                result = wait_for_opponent(game, event, device_id, size, rating, wait, result)
+        finally:
+            if event is not None:
+                game.remove_lobby_waiter(device_id, event)
+
+        if result["status"] == "waiting":
+            raise WaitingForOpponent(
+                f"Esperando oponente para tablero {size}x{size}",
+                result["retry_after_ms"],
+            )
+        with game.lock:
+            game.set_active_match(device_id, result["match"])
+        trace.phase("marshal")
+        return result["match"], 201
+
+
+@api.route("/matches/bulk")
+class BulkCreateMatches(GameResource):
+    @api.expect(bulk_match_request)
+    @api.marshal_with(bulk_match_response, code=201)
+    def post(self):
+        """
+        Crea muchas partidas de una vez (p. ej. una ronda de un torneo).
+        Cada pareja se valida por separado: las que fallan se devuelven
+        con su error y el resto de partidas se crean igualmente.
+        """
+        game = current_game()
+        data = request.get_json(silent=True) or {}
+        pairs = data.get("matches")
+        if not isinstance(pairs, list):
+            api.abort(400, "Se requiere la lista matches")
+
+        game.cleanup_inactive_devices()
+        now = time()
+        busy = set()  # dispositivos emparejados en esta misma petición
+        results = []
+        for index, pair in enumerate(pairs):
+            error = game.bulk_pair_error(pair, busy)
+            if error:
+                results.append({"index": index, "error": error})
+                continue
+            first, second = pair["players"]
+            busy.update((first, second))
+            summary = game.create_match_record(
+                game.new_id(),
+                {first: "X", second: "O"},
+                pair.get("size", 3),
+                {pid: game.devices[pid]["rating"] for pid in (first, second)},
+                now,
+            )
+            for device_id in (first, second):
+                game.leave_lobby(device_id)
+                game.set_active_match(device_id, summary)
+                game.devices[device_id]["last_active"] = now
+                game.notify_lobby_waiters(device_id)  # si espera con POST /matches?wait=
+            results.append({"index": index, **summary})
+
+        created = len(busy) // 2
+        return {"created": created, "failed": len(results) - created, "results": results}, 201
 
 
 @api.route("/matches/<match_id>/moves")
-class MatchMove(Resource):
+class MatchMove(GameResource):
     @api.expect(move_request)
+    @api.doc(
+        params={
+            "Idempotency-Key": {
+                "in": "header",
+                "description": "Clave única del movimiento: un reintento con la misma clave"
+                " recibe la respuesta original",
+            }
+        }
+    )
     @api.marshal_with(move_response)
     def post(self, match_id):
-        """Realiza un movimiento en la partida."""
-        data = request.get_json()
+        """
+        Realiza un movimiento en la partida.
+        Si el cliente repite la petición con la misma Idempotency-Key (p. ej.
+        tras un timeout), se devuelve la respuesta del primer intento sin
+        volver a validar el movimiento.
+        """
+        game = current_game()
+        trace = current_trace()
+        trace.phase("parse")
+        data = request_data()
         device_id, x, y = data["device_id"], data["x"], data["y"]
+        key = request.headers.get("Idempotency-Key")
+        if key:
+            reply = game.move_replies.get(match_id, (device_id, key), time())
+            if reply is not None:
+                trace.set("idempotent_replay", True)
+                trace.phase("marshal")
+                return reply
 
-        if match_id not in matches:
+        trace.phase("validate")
+        if match_id not in game.matches:
             api.abort(404, "Partida no encontrada")
 
-        match = matches[match_id]
-        if match["winner"]:
+        match = game.matches[match_id]
+        if is_over(match):
             api.abort(400, "La partida ya ha terminado")
         if device_id != match["turn"]:
             api.abort(403, "No es tu turno")
         if not (0 <= x < match["size"] and 0 <= y < match["size"]):
             api.abort(400, "Movimiento fuera del tablero")
-        if match["board"][x][y] != "":
+        if cell(match, x, y):
             api.abort(400, "Casilla ocupada")
 
+        trace.set("board.size", match["size"])
+        trace.phase("apply")
         symbol = match["players"][device_id]
-        match["board"][x][y] = symbol
+        place(match, x, y, symbol)
+        match["moves"] += 1
+        game.move_journal.append(match["index"], x * match["size"] + y, symbol)
+        game.match_changed(match_id)
 
-        winner = check_winner(match["board"], match["size"])
-        if winner:
-            match["winner"] = winner
-            for pid, sym in match["players"].items():
-                if sym == winner:
-                    devices[pid]["wins"] += 1
-                else:
-                    devices[pid]["losses"] += 1
-            return {"board": match["board"], "next_turn": None, "winner": winner}
+        trace.phase("check_winner")
+        won = wins_from(match, x, y, symbol)
+        # Las líneas abiertas solo se actualizan si la partida sigue
+        drawn = not won and update_lines(match, x, y, symbol) == 0
 
-        next_turn = next(pid for pid in match["players"] if pid != device_id)
-        match["turn"] = next_turn
-        update_activity(device_id)
+        trace.phase("stats")
+        if won:
+            match["winner"] = symbol
+            loser_id = next(pid for pid in match["players"] if pid != device_id)
+            game.record_result(match_id, device_id, loser_id)
+            next_turn = None
+        elif drawn:
+            # Ninguna línea puede completarse ya: empate sin esperar a llenar el tablero
+            match["draw"] = True
+            game.record_draw(match_id)
+            next_turn = None
+        else:
+            next_turn = next(pid for pid in match["players"] if pid != device_id)
+            match["turn"] = next_turn
+            game.touch_device(device_id)
 
-        return {"board": match["board"], "next_turn": next_turn, "winner": None}
+        trace.phase("marshal")
+        # Solo se envía la casilla nueva; el tablero completo, en los pequeños.
+        # marshal() copia el tablero: la respuesta guardada no cambia con la partida
+        reply = marshal(
+            {
+                "board": match["board"],
+                "changes": [{"x": x, "y": y, "symbol": symbol}],
+                "next_turn": next_turn,
+                "winner": match["winner"],
+                "draw": match["draw"],
+            },
+            move_response,
+        )
+        if key:
+            game.move_replies.put(match_id, (device_id, key), reply, time())
+        return reply
 
 
 @api.route("/matches/<match_id>")
-class MatchState(Resource):
-    @api.marshal_with(sync_response)
+class MatchState(GameResource):
+    @api.response(200, "Estado de la partida", sync_response)
     def get(self, match_id):
-        """Devuelve el estado actual de la partida."""
-        if match_id not in matches:
+        """
+        Devuelve el estado actual de la partida.
+        Con ?device_id= incluye el intervalo de sondeo sugerido para ese jugador.
+        Los espectadores (sin device_id de un jugador) reciben una respuesta
+        cacheada que solo se vuelve a serializar cuando la partida cambia
+        (siempre en JSON, aunque pidan MessagePack).
+        """
+        game = current_game()
+        if match_id not in game.matches:
             api.abort(404, "Partida no encontrada")
-        m = matches[match_id]
-        return {
+        m = game.matches[match_id]
+        device_id = request.args.get("device_id")
+        now = time()
+        if device_id not in m["players"]:
+            game.suggest_poll(device_id, POLL_BASELINE_MS, now)
+            return Response(spectator_body(game, match_id, m), mimetype="application/json")
+        state = {
             "board": m["board"],
+            "stones": stone_list(m),
             "turn": m["turn"],
             "winner": m["winner"],
+            "draw": m["draw"],
             "size": m["size"],
             "players": m["players"],
-            "opponent_left": False,
+            # El rival expiró con la partida en curso y se le dio por perdida
+            "opponent_left": m.get("forfeited_by") not in (None, device_id),
+            "retry_after_ms": game.suggest_poll(
+                device_id, game.match_poll_interval(m, device_id, now), now
+            ),
         }
+        return marshal(state, sync_response)
+
+
+@api.route("/matches/<match_id>/replay")
+class MatchReplay(Resource):
+    @api.marshal_with(replay_response)
+    def get(self, match_id):
+        """Devuelve la secuencia de movimientos de la partida desde el diario."""
+        game = current_game()
+        # El diario se lee fuera del lock para no frenar al resto
+        with game.lock:
+            if match_id not in game.matches:
+                api.abort(404, "Partida no encontrada")
+            size, index = game.matches[match_id]["size"], game.matches[match_id]["index"]
+        moves = [
+            {"x": cell // size, "y": cell % size, "symbol": symbol, "timestamp": ts}
+            for cell, symbol, ts in game.move_journal.replay(index)
+        ]
+        return {"match_id": match_id, "size": size, "moves": moves}
 
 
 @api.route("/matches/<match_id>/leave")
-class MatchLeave(Resource):
+class MatchLeave(GameResource):
     @api.expect(leave_request)
     @api.marshal_with(leave_response)
     def post(self, match_id):
@@ -466,20 +1196,21 @@ class MatchLeave(Resource):
         El oponente gana automáticamente y se actualiza la puntuación.
         La partida se elimina del servidor.
         """
-        if match_id not in matches:
+        game = current_game()
+        if match_id not in game.matches:
             api.abort(404, "Partida no encontrada")
         
         data = request.get_json()
         device_id = data["device_id"]
         
-        match = matches[match_id]
+        match = game.matches[match_id]
         
         if device_id not in match["players"]:
             api.abort(403, "No eres parte de esta partida")
         
-        if match["winner"]:
+        if is_over(match):
             # La partida ya terminó, solo eliminarla
-            del matches[match_id]
+            game.remove_match(match_id)
             return {"message": "Partida finalizada"}
         
         # El que abandona pierde, el otro gana
@@ -487,17 +1218,16 @@ class MatchLeave(Resource):
         opponent_symbol = match["players"][opponent_id]
         
         match["winner"] = opponent_symbol
-        devices[opponent_id]["wins"] += 1
-        devices[device_id]["losses"] += 1
+        game.record_result(match_id, opponent_id, device_id, "leave")
         
         # Eliminar la partida
-        del matches[match_id]
+        game.remove_match(match_id)
         
         return {"message": f"Has abandonado. {opponent_symbol} gana la partida."}
 
 
 @api.route("/matches/<match_id>/surrender")
-class MatchSurrender(Resource):
+class MatchSurrender(GameResource):
     @api.expect(surrender_request)
     @api.marshal_with(surrender_response)
     def post(self, match_id):
@@ -505,18 +1235,19 @@ class MatchSurrender(Resource):
         El jugador se rinde y otorga la victoria al oponente.
         Actualiza las estadísticas correspondientes.
         """
-        if match_id not in matches:
+        game = current_game()
+        if match_id not in game.matches:
             api.abort(404, "Partida no encontrada")
         
         data = request.get_json()
         device_id = data["device_id"]
         
-        match = matches[match_id]
+        match = game.matches[match_id]
         
         if device_id not in match["players"]:
             api.abort(403, "No eres parte de esta partida")
         
-        if match["winner"]:
+        if is_over(match):
             api.abort(400, "La partida ya ha terminado")
         
         # El que se rinde pierde, el otro gana
@@ -525,11 +1256,198 @@ class MatchSurrender(Resource):
         opponent_symbol = match["players"][opponent_id]
         
         match["winner"] = opponent_symbol
-        devices[opponent_id]["wins"] += 1
-        devices[device_id]["losses"] += 1
+        game.record_result(match_id, opponent_id, device_id, "surrender")
+        game.match_changed(match_id)
         
         return {"message": f"Te has rendido. {opponent_symbol} gana la partida."}
 
 
+# ======== ENDPOINTS INTERNOS (MODO SHARDS) ========
+internal_lobby_request = api.model(
+    "InternalLobbyRequest",
+    {
+        "device_id": fields.String(required=True),
+        "size": fields.Integer(required=True),
+        "rating": fields.Float(required=True),
+    },
+)
+
+
+def require_shard():
+    """Los endpoints internos solo existen en modo shards."""
+    if current_game().shard is None:
+        api.abort(404, "No encontrado")
+
+
+@api.route("/internal/lobby", doc=False)
+class InternalLobby(Resource):
+    def post(self):
+        """Coordinador: empareja o deja esperando a un dispositivo de otro shard."""
+        game = current_game()
+        require_shard()
+        data = request.get_json()
+        try:
+            return game.pair_in_lobby(data["device_id"], data["size"], data["rating"])
+        except OSError:
+            api.abort(502, "No se pudo crear la partida en su shard")
+
+
+@api.route("/internal/lobby/leave", doc=False)
+class InternalLobbyLeave(GameResource):
+    def post(self):
+        """Coordinador: saca del lobby a un dispositivo que ha expirado."""
+        game = current_game()
+        require_shard()
+        device_id = request.get_json()["device_id"]
+        game.leave_lobby(device_id)
+        game.paired_matches.pop(device_id, None)
+        return {"message": "ok"}
+
+
+@api.route("/internal/matches", doc=False)
+class InternalMatches(GameResource):
+    def post(self):
+        """Crea en este shard una partida emparejada por el coordinador."""
+        game = current_game()
+        require_shard()
+        data = request.get_json()
+        players = data["players"]
+        return game.create_match_record(
+            data["match_id"], players, data["size"], data["ratings"], time()
+        )
+
+
+@api.route("/internal/matches/<match_id>/forfeit", doc=False)
+class InternalMatchForfeit(GameResource):
+    def post(self, match_id):
+        """Da por perdida una partida de este shard cuyo jugador ha expirado en otro."""
+        require_shard()
+        game = current_game()
+        game.forfeit_match(match_id, request.get_json()["device_id"], time())
+        return {"message": "ok"}
+
+
+@api.route("/internal/devices/<device_id>/events", doc=False)
+class InternalDeviceEvents(GameResource):
+    def post(self, device_id):
+        """Aplica a un dispositivo local un evento enviado por otro shard."""
+        game = current_game()
+        require_shard()
+        event = request.get_json()
+        if event["type"] == "result":
+            game.apply_result(device_id, event["won"], event["opponent_rating"])
+        elif event["type"] == "draw":
+            game.apply_draw(device_id, event["opponent_rating"])
+        elif event["type"] == "paired":  # el coordinador lo ha emparejado
+            game.notify_lobby_waiters(device_id)
+        if "history" in event:
+            game.add_history(device_id, event["history"])
+        game.update_activity(device_id)
+        return {"message": "ok"}
+
+
+@api.route("/internal/leaderboard/ahead", doc=False)
+class InternalLeaderboardAhead(GameResource):
+    def get(self):
+        """Cuántos dispositivos de este shard van por delante de unas estadísticas."""
+        game = current_game()
+        require_shard()
+        by = leaderboard_order()
+        ahead = game.leaderboard.count_ahead(
+            by,
+            request.args["device_id"],
+            request.args.get("wins", 0, type=int),
+            request.args.get("losses", 0, type=int),
+        )
+        return {"ahead": ahead, "total": len(game.leaderboard)}
+
+
+@api.route("/internal/leaderboard/top", doc=False)
+class InternalLeaderboardTop(GameResource):
+    @api.marshal_with(leaderboard_response)
+    def get(self):
+        """
+        Las primeras ?limit= entradas de la clasificación de este shard, sin
+        el tope de 100 de GET /leaderboard: el router pide offset + limit a
+        cada shard en una sola llamada.
+        """
+        game = current_game()
+        require_shard()
+        limit = max(1, request.args.get("limit", 10, type=int))
+        return leaderboard_page(game, leaderboard_order(), 0, limit)
+
+
+# ======== APLICACIÓN ========
+def create_app(config=None):
+    """
+    Crea una aplicación con su propio estado de juego.
+    `config` sobrescribe DEFAULT_CONFIG (y cualquier otra clave de Flask).
+    Con DOCS a False no se registran Swagger UI ni swagger.json, y los
+    modelos no se convierten a esquema en ningún momento.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    CORS(app)
+    docs = app.config["DOCS"]
+    rest_api = Api(
+        title="TicTacToe API",
+        version="1.0",
+        description="API REST del juego de TicTacToe",
+        doc="/" if docs else False,
+    )
+    if msgpack is not None:
+        # Se elige por Accept; JSON va primero y sigue siendo el formato por defecto
+        rest_api.representations[MSGPACK] = output_msgpack
+    rest_api.add_namespace(api)
+    # add_specs solo se respeta en init_app(), no en el constructor
+    rest_api.init_app(app, add_specs=docs)
+    app.extensions["tictactoe"] = GameState(
+        app.config["MOVE_JOURNAL_PATH"],
+        app.config["STATE_DIR"],
+        app.config["SNAPSHOT_INTERVAL"],
+        app.config["SHARD_INDEX"],
+        app.config["SHARD_PEERS"],
+        app.config["LOBBY_MAX_WAITERS"],
+    )
+    app.extensions["access_log"] = AccessLog(app.config["ACCESS_LOG_PATH"])
+    app.extensions["tracer"] = Tracer(app.config["TRACE_PATH"], app.config["TRACE_SAMPLE_RATE"])
+    # El cronómetro va antes del control de admisión: un 429 corta los siguientes
+    app.before_request(start_timer)
+    app.before_request(admission_control)
+    app.after_request(log_access)
+    app.teardown_request(end_trace)
+    return app
+
+
+def start_services(app):
+    """
+    Recupera el estado y arranca los hilos de fondo (persistencia,
+    registro de accesos, trazas). Todo se vuelca y se cierra al salir.
+    """
+    game = app.extensions["tictactoe"]
+    game.restore()
+    atexit.register(game.close)
+    if app.config["ACCESS_LOG_PATH"]:
+        access_log = app.extensions["access_log"]
+        access_log.start()
+        atexit.register(access_log.close)
+    if app.config["TRACE_SAMPLE_RATE"]:
+        tracer = app.extensions["tracer"]
+        tracer.start()
+        atexit.register(tracer.close)
+
+
+def run_server(host="127.0.0.1", port=5000, debug=False, config=None):
+    """
+    Crea la aplicación y la sirve con el servidor de desarrollo de Werkzeug.
+    En producción se usa serve.py.
+    """
+    app = create_app(config)
+    start_services(app)
+    # Sin reloader: el proceso vigilante también recuperaría el estado
+    app.run(host=host, port=port, debug=debug, use_reloader=False, threaded=True)
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    run_server(port=int(os.environ.get("PORT", 5000)), debug=True)
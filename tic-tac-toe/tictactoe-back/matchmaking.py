@@ -0,0 +1,101 @@
+"""
+Ratings Elo y emparejamiento por nivel.
+
+El lobby se indexa por tamaño de tablero y rating: para cada tamaño hay
+una skip list ordenada por (rating, desde_cuando, device_id), de modo
+que el oponente de rating más cercano se encuentra en O(log n). La
+diferencia de rating aceptada crece cuanto más tiempo lleva esperando
+cualquiera de los dos jugadores.
+"""
+
+from ranking import IndexableSkipList
+
+INITIAL_RATING = 1200.0
+ELO_K = 32  # ajuste máximo por partida
+RATING_WINDOW_BASE = 100.0  # diferencia aceptada sin esperar
+RATING_WINDOW_GROWTH = 10.0  # puntos extra por segundo de espera
+
+
+def expected_score(rating, opponent_rating):
+    """Probabilidad de victoria según Elo."""
+    return 1.0 / (1.0 + 10 ** ((opponent_rating - rating) / 400.0))
+
+
+def elo_update(winner_rating, loser_rating, k=ELO_K):
+    """Devuelve los nuevos ratings (ganador, perdedor) tras una partida."""
+    delta = k * (1.0 - expected_score(winner_rating, loser_rating))
+    return winner_rating + delta, loser_rating - delta
+
+
+def elo_draw(rating, opponent_rating, k=ELO_K):
+    """Devuelve los nuevos ratings tras un empate (medio punto para cada uno)."""
+    delta = k * (0.5 - expected_score(rating, opponent_rating))
+    return rating + delta, opponent_rating - delta
+
+
+def rating_window(waited):
+    """Diferencia de rating aceptada tras esperar `waited` segundos."""
+    return RATING_WINDOW_BASE + RATING_WINDOW_GROWTH * max(0.0, waited)
+
+
+class LobbyIndex:
+    """Índice del lobby por tamaño de tablero y rating."""
+
+    def __init__(self):
+        self._by_size = {}  # {size: IndexableSkipList[(rating, since, device_id)]}
+        self._keys = {}  # {device_id: (size, clave)}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, device_id):
+        return device_id in self._keys
+
+    def waiting(self, size):
+        """Número de jugadores esperando para un tamaño."""
+        return len(self._by_size.get(size, ()))
+
+    def add(self, device_id, size, rating, since):
+        self.remove(device_id)
+        key = (rating, since, device_id)
+        self._by_size.setdefault(size, IndexableSkipList()).insert(key)
+        self._keys[device_id] = (size, key)
+
+    def remove(self, device_id):
+        entry = self._keys.pop(device_id, None)
+        if entry is not None:
+            size, key = entry
+            self._by_size[size].remove(key)
+
+    def clear(self):
+        self._by_size.clear()
+        self._keys.clear()
+
+    def find_opponent(self, size, rating, since, now, exclude=None):
+        """
+        Busca el oponente de rating más cercano para un tamaño.
+        Solo se mira el vecino inmediato por debajo y por encima en la
+        skip list, así que la búsqueda es O(log n). Devuelve el
+        device_id o None si nadie cae dentro de la ventana.
+        """
+        waiting = self._by_size.get(size)
+        if not waiting:
+            return None
+        position = waiting.bisect_left((rating,))
+        candidates = []
+        if position > 0:
+            candidates.append(waiting[position - 1])
+        for key in waiting.iter_from(position):
+            if key[2] != exclude:
+                candidates.append(key)
+                break
+        best = None
+        for cand_rating, cand_since, cand_id in candidates:
+            if cand_id == exclude:
+                continue
+            gap = abs(cand_rating - rating)
+            if gap > rating_window(now - min(since, cand_since)):
+                continue
+            if best is None or gap < best[0]:
+                best = (gap, cand_id)
+        return best[1] if best else None
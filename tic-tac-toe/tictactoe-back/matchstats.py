@@ -0,0 +1,115 @@
+"""
+Estadísticas globales de las partidas (GET /stats).
+
+Los contadores se actualizan al crear y al terminar cada partida, así
+que leerlos no recorre `matches` ni `devices`: cuesta lo mismo con diez
+partidas que con un millón. Quien los actualiza ya tiene el lock del
+estado, y GET /stats lo toma solo para copiar unas pocas filas.
+"""
+
+# Contadores por tamaño de tablero, en este orden
+FIELDS = (
+    "created",
+    "finished",
+    "x_wins",
+    "o_wins",
+    "draws",
+    "surrenders",
+    "leaves",
+    "forfeits",
+    "moves",
+    "seconds",
+)
+CREATED, FINISHED, X_WINS, O_WINS, DRAWS, SURRENDERS, LEAVES, FORFEITS, MOVES, SECONDS = range(
+    len(FIELDS)
+)
+REASONS = {"surrender": SURRENDERS, "leave": LEAVES, "forfeit": FORFEITS}
+
+
+class MatchStats:
+    """
+    Contadores de partidas por tamaño de tablero. `counters` es una tabla
+    del StateStore: {tamaño: [contador por FIELDS]}. Se modifica con el
+    lock del estado tomado.
+    """
+
+    def __init__(self, on_change=None):
+        self.counters = {}
+        self.on_change = on_change  # recibe el tamaño modificado (mark_dirty)
+
+    def _row(self, size):
+        row = self.counters.get(size)
+        if row is None:
+            row = self.counters[size] = [0] * len(FIELDS)
+        if self.on_change is not None:
+            self.on_change(size)
+        return row
+
+    def match_created(self, size):
+        self._row(size)[CREATED] += 1
+
+    def match_finished(self, size, winner, reason, moves, seconds):
+        """`winner` es "X", "O" o None (empate); `reason` como en el historial."""
+        row = self._row(size)
+        row[FINISHED] += 1
+        if winner is None:
+            row[DRAWS] += 1
+        else:
+            row[X_WINS if winner == "X" else O_WINS] += 1
+        if reason in REASONS:
+            row[REASONS[reason]] += 1
+        row[MOVES] += moves
+        row[SECONDS] += seconds
+
+    def totals(self):
+        """Copia de {tamaño: contadores}."""
+        return {size: list(row) for size, row in self.counters.items()}
+
+    def upgrade(self):
+        """
+        Convierte el formato guardado antes de que hubiera una sola fila por
+        tamaño ({shard: {tamaño: contadores}}) sumando los shards. Devuelve
+        las claves que han cambiado (para marcarlas en el StateStore).
+        """
+        legacy = [key for key, value in self.counters.items() if isinstance(value, dict)]
+        if not legacy:
+            return []
+        shards = [self.counters.pop(key) for key in legacy]
+        changed = set(legacy)
+        for shard in shards:
+            for size, counters in shard.items():
+                row = self.counters.setdefault(size, [0] * len(FIELDS))
+                for i, value in enumerate(counters):
+                    row[i] += value
+                changed.add(size)
+        return sorted(changed)
+
+
+def describe(counters):
+    """Contadores (en el orden de FIELDS) con las tasas y medias sobre las terminadas."""
+    data = dict(zip(FIELDS, counters))
+    finished = data["finished"]
+
+    def per_match(value):
+        return value / finished if finished else 0.0
+
+    data.update(
+        x_win_rate=per_match(data["x_wins"]),
+        o_win_rate=per_match(data["o_wins"]),
+        draw_rate=per_match(data["draws"]),
+        surrender_rate=per_match(data["surrenders"]),
+        leave_rate=per_match(data["leaves"]),
+        forfeit_rate=per_match(data["forfeits"]),
+        avg_moves=per_match(data["moves"]),
+        avg_seconds=per_match(data["seconds"]),
+    )
+    return data
+
+
+def summary(totals):
+    """Respuesta de GET /stats a partir de {tamaño: contadores} (también la usa el router)."""
+    overall = [sum(values) for values in zip(*totals.values())] or [0] * len(FIELDS)
+    return {
+        **describe(overall),
+        "by_size": [{"size": size, **describe(totals[size])} for size in sorted(totals)],
+    }
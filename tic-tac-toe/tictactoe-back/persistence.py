@@ -0,0 +1,234 @@
+"""
+Persistencia del estado en memoria: snapshots + diario de cambios.
+
+- Los endpoints marcan como "sucias" las claves que modifican.
+- Un hilo vuelca periódicamente el valor actual de esas claves a un
+  diario de cambios (changes.<generación>.log), con un fsync por lote.
+- Otro hilo toma snapshots completos desde un proceso hijo (fork), que
+  escribe una copia copy-on-write del estado sin pausar las peticiones.
+- Al arrancar se carga el último snapshot y se aplican los diarios
+  de su generación en adelante.
+"""
+
+import glob
+import os
+import pickle
+import re
+import struct
+import threading
+from time import time
+
+SNAPSHOT_FILE = "snapshot.bin"
+CHANGES_PATTERN = re.compile(r"changes\.(\d+)\.log$")
+FRAME_HEADER = struct.Struct("<I")  # longitud del lote serializado
+
+
+class StateStore:
+    """Guarda y recupera un conjunto de diccionarios de estado."""
+
+    def __init__(
+        self,
+        directory,
+        tables,
+        lock,
+        flush_interval=0.1,
+        snapshot_interval=60.0,
+        use_fork=None,
+    ):
+        self.directory = str(directory)
+        self.tables = tables  # {nombre: dict vivo}
+        self.lock = lock  # lock que protege las tablas
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.use_fork = hasattr(os, "fork") if use_fork is None else use_fork
+        self.generation = 0
+        self.enabled = False
+        self._dirty = set()  # {(tabla, clave)}
+        self._log = None
+        self._io_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    # ---------- registro de cambios ----------
+    def mark_dirty(self, table, key):
+        """Marca una clave como modificada (o borrada) desde el último volcado."""
+        if self.enabled:
+            self._dirty.add((table, key))
+
+    def flush(self):
+        """Escribe en el diario el valor actual de las claves sucias."""
+        # Orden de locks: _io_lock -> lock. Así un lote tomado antes de un
+        # snapshot nunca acaba escrito en el diario de la generación siguiente.
+        with self._io_lock:
+            with self.lock:
+                frame = self._take_dirty()
+            if frame:
+                self._write_frame(frame)
+
+    def _take_dirty(self):
+        # Se llama con self.lock tomado: serializa los valores actuales
+        if not self._dirty:
+            return None
+        dirty, self._dirty = self._dirty, set()
+        batch = [
+            (table, key, self.tables[table].get(key)) for table, key in dirty
+        ]
+        return pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _write_frame(self, frame):
+        # Se llama con self._io_lock tomado
+        if self._log is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._log = open(self._log_path(self.generation), "ab")
+        self._log.write(FRAME_HEADER.pack(len(frame)) + frame)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def _log_path(self, generation):
+        return os.path.join(self.directory, f"changes.{generation:08d}.log")
+
+    # ---------- snapshots ----------
+    def snapshot(self):
+        """
+        Toma un snapshot completo y descarta los diarios que ya cubre.
+        Con fork, el hijo serializa su copia del estado mientras el padre
+        sigue atendiendo peticiones; sin fork se serializa bajo el lock.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._io_lock, self.lock:
+            frame = self._take_dirty()
+            if frame:
+                self._write_frame(frame)
+            self._rotate_log()
+            generation = self.generation
+            if self.use_fork:
+                pid = os.fork()
+                if pid == 0:  # proceso hijo
+                    code = 1
+                    try:
+                        self._write_snapshot(generation)
+                        code = 0
+                    finally:
+                        os._exit(code)
+            else:
+                self._write_snapshot(generation)
+
+        if self.use_fork:
+            _, status = os.waitpid(pid, 0)
+            if os.waitstatus_to_exitcode(status) != 0:
+                return False
+        self._drop_logs_before(generation)
+        return True
+
+    def _rotate_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        self.generation += 1
+
+    def _write_snapshot(self, generation):
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp = path + ".tmp"
+        data = {"generation": generation, "taken_at": time(), "tables": self.tables}
+        with open(tmp, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _drop_logs_before(self, generation):
+        for generation_found, path in self._existing_logs():
+            if generation_found < generation:
+                os.remove(path)
+
+    def _existing_logs(self):
+        logs = []
+        for path in glob.glob(os.path.join(self.directory, "changes.*.log")):
+            found = CHANGES_PATTERN.search(path)
+            if found:
+                logs.append((int(found.group(1)), path))
+        return sorted(logs)
+
+    # ---------- recuperación ----------
+    def restore(self):
+        """
+        Carga el último snapshot y aplica los diarios posteriores.
+        Las tablas se modifican en el sitio. Devuelve el número de
+        lotes del diario aplicados.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        base_generation = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            base_generation = data["generation"]
+            for name, table in self.tables.items():
+                table.clear()
+                table.update(data["tables"].get(name, {}))
+
+        applied = 0
+        last_generation = base_generation
+        for generation, log_path in self._existing_logs():
+            last_generation = max(last_generation, generation)
+            if generation < base_generation:
+                continue
+            for batch in self._read_frames(log_path):
+                for table, key, value in batch:
+                    if value is None:
+                        self.tables[table].pop(key, None)
+                    else:
+                        self.tables[table][key] = value
+                applied += 1
+
+        # Nunca se sigue escribiendo sobre un diario que pudo quedar truncado
+        self.generation = last_generation + 1
+        return applied
+
+    @staticmethod
+    def _read_frames(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + FRAME_HEADER.size <= len(data):
+            (length,) = FRAME_HEADER.unpack_from(data, offset)
+            start = offset + FRAME_HEADER.size
+            if start + length > len(data):
+                break  # lote a medio escribir
+            yield pickle.loads(data[start : start + length])
+            offset = start + length
+
+    # ---------- ciclo de vida ----------
+    def start(self):
+        """Activa el registro de cambios y arranca los hilos de volcado."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.enabled = True
+        self._stop.clear()
+        for target, name in [
+            (self._flush_loop, "state-flush"),
+            (self._snapshot_loop, "state-snapshot"),
+        ]:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        """Detiene los hilos y vuelca los cambios pendientes."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.flush()
+        with self._io_lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+        self.enabled = False
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.snapshot()
@@ -0,0 +1,265 @@
+"""
+Estructuras ordenadas para clasificaciones.
+
+IndexableSkipList es una skip list con anchuras en cada enlace, de modo
+que además de insertar y borrar en O(log n) permite consultar la
+posición de una clave y acceder por índice en O(log n). Partiendo de
+claves ya ordenadas, build() la construye entera en O(n).
+"""
+
+import random
+
+MAX_LEVELS = 24  # suficiente para ~16M elementos
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels  # elementos que salta cada enlace
+
+
+class IndexableSkipList:
+    """Lista ordenada de claves únicas con rango y acceso por índice en O(log n)."""
+
+    def __init__(self, max_levels=MAX_LEVELS):
+        self._levels = max_levels
+        self._nil = _Node(None, 0)
+        self._head = _Node(None, max_levels)
+        self._head.next = [self._nil] * max_levels
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def _search(self, key):
+        """Devuelve (cadena de nodos previos, pasos por nivel) para key."""
+        chain = [None] * self._levels
+        steps = [0] * self._levels
+        nil, node, position = self._nil, self._head, 0
+        for level in reversed(range(self._levels)):
+            nxt = node.next[level]
+            while nxt is not nil and nxt.key < key:
+                position += node.width[level]
+                node = nxt
+                nxt = node.next[level]
+            chain[level] = node
+            steps[level] = position
+        return chain, steps
+
+    def _random_levels(self):
+        levels = 1
+        while levels < self._levels and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, key):
+        """Inserta una clave (que no debe estar ya en la lista)."""
+        chain, steps = self._search(key)
+        levels = self._random_levels()
+        node = _Node(key, levels)
+        position = steps[0]  # posición del nodo previo en el nivel 0
+        for level in range(levels):
+            prev = chain[level]
+            distance = position - steps[level]  # de prev al previo en nivel 0
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - distance
+            prev.width[level] = distance + 1
+        for level in range(levels, self._levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        """Elimina una clave. Lanza KeyError si no existe."""
+        chain, _ = self._search(key)
+        node = chain[0].next[0]
+        if node is self._nil or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(len(node.next), self._levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def clear(self):
+        self.__init__(self._levels)
+
+    def build(self, keys):
+        """
+        Sustituye el contenido por `keys`, ya ordenadas y sin repetir, en
+        O(n) y sin búsquedas: el nivel 0 enlaza todos los nodos seguidos y
+        cada nivel superior enlaza los nodos que llegan a él, con la
+        distancia entre sus posiciones como anchura (la cabecera está en
+        la posición 0 y el final en n + 1).
+        """
+        self.clear()
+        # Niveles con la misma distribución que insert(): ceros finales de un
+        # número aleatorio, con un bit alto que limita el máximo
+        top = self._levels - 1
+        high, bits = 1 << top, random.getrandbits
+        draws = [bits(top) | high for _ in range(len(keys))]
+        nodes = [_Node(key, (draw & -draw).bit_length()) for key, draw in zip(keys, draws)]
+        self._size = size = len(nodes)
+        nil, head = self._nil, self._head
+        prev = head
+        for node in nodes:  # todas las anchuras del nivel 0 son 1
+            prev.next[0] = node
+            prev = node
+        prev.next[0] = nil
+        upper = [
+            (position, node) for position, node in enumerate(nodes, start=1) if len(node.next) > 1
+        ]
+        for level in range(1, self._levels):
+            prev, prev_position = head, 0
+            for position, node in upper:
+                prev.next[level] = node
+                prev.width[level] = position - prev_position
+                prev, prev_position = node, position
+            prev.next[level] = nil
+            prev.width[level] = size + 1 - prev_position
+            upper = [entry for entry in upper if len(entry[1].next) > level + 1]
+
+    def bisect_left(self, key):
+        """Número de claves estrictamente menores que key."""
+        _, steps = self._search(key)
+        return steps[0]
+
+    def rank(self, key):
+        """Posición (desde 0) de una clave existente, o None si no está."""
+        chain, steps = self._search(key)
+        node = chain[0].next[0]
+        if node is self._nil or node.key != key:
+            return None
+        return steps[0]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+    def _node_at(self, index):
+        node, remaining = self._head, index + 1
+        for level in reversed(range(self._levels)):
+            while node.next[level] is not self._nil and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def iter_from(self, index):
+        """Itera en orden desde la posición index: O(log n) + O(k)."""
+        if index >= self._size:
+            return
+        node = self._node_at(max(0, index))
+        while node is not self._nil:
+            yield node.key
+            node = node.next[0]
+
+    def page(self, offset, limit):
+        """Devuelve hasta limit claves a partir de offset."""
+        result = []
+        for key in self.iter_from(offset):
+            if len(result) >= limit:
+                break
+            result.append(key)
+        return result
+
+
+def _ratio(wins, losses):
+    return wins / max(1, wins + losses)
+
+
+class Leaderboard:
+    """
+    Clasificación incremental de dispositivos.
+    Mantiene una skip list por criterio de orden ("wins" o "ratio");
+    cada cambio de estadísticas reubica al dispositivo en O(log n).
+    """
+
+    ORDERS = {
+        "wins": lambda device_id, wins, losses: (-wins, losses, device_id),
+        "ratio": lambda device_id, wins, losses: (
+            -_ratio(wins, losses),
+            -wins,
+            device_id,
+        ),
+    }
+
+    def __init__(self):
+        self._lists = {by: IndexableSkipList() for by in self.ORDERS}
+        self._keys = {}  # {device_id: {criterio: clave actual}}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, device_id):
+        return device_id in self._keys
+
+    def update(self, device_id, wins, losses):
+        """Inserta o reubica un dispositivo con sus estadísticas actuales."""
+        old_keys = self._keys.get(device_id)
+        new_keys = {}
+        for by, make_key in self.ORDERS.items():
+            key = make_key(device_id, wins, losses)
+            new_keys[by] = key
+            if old_keys is not None:
+                if old_keys[by] == key:
+                    continue
+                self._lists[by].remove(old_keys[by])
+            self._lists[by].insert(key)
+        self._keys[device_id] = new_keys
+
+    def build(self, stats):
+        """
+        Sustituye la clasificación por la de `stats`, pares (device_id,
+        (victorias, derrotas)): ordena una vez las claves de cada criterio
+        y construye cada skip list en O(n), sin insertar una a una.
+        """
+        self.clear()
+        orders = list(self.ORDERS.items())
+        columns = {by: [] for by in self.ORDERS}
+        for device_id, (wins, losses) in stats:
+            keys = self._keys[device_id] = {}
+            for by, make_key in orders:
+                key = keys[by] = make_key(device_id, wins, losses)
+                columns[by].append(key)
+        for by, keys in columns.items():
+            keys.sort()
+            self._lists[by].build(keys)
+
+    def remove(self, device_id):
+        """Quita un dispositivo de la clasificación (si está)."""
+        keys = self._keys.pop(device_id, None)
+        if keys is not None:
+            for by, key in keys.items():
+                self._lists[by].remove(key)
+
+    def clear(self):
+        self.__init__()
+
+    def rank(self, device_id, by="wins"):
+        """Posición (desde 0) del dispositivo, o None si no está clasificado."""
+        keys = self._keys.get(device_id)
+        if keys is None:
+            return None
+        return self._lists[by].rank(keys[by])
+
+    def count_ahead(self, by, device_id, wins, losses):
+        """
+        Dispositivos que irían por delante de unas estadísticas dadas
+        (las de un dispositivo de otro shard, para su posición global).
+        """
+        return self._lists[by].bisect_left(self.ORDERS[by](device_id, wins, losses))
+
+    def page(self, by="wins", offset=0, limit=10):
+        """IDs de dispositivo de las posiciones [offset, offset + limit)."""
+        return [key[-1] for key in self._lists[by].page(offset, limit)]
@@ -0,0 +1,91 @@
+"""
+Control de admisión con token buckets en memoria.
+
+Cada clave (device_id o IP) tiene un cubo de `burst` fichas que se
+rellena a `rate` fichas por segundo. Cada petición consume una ficha;
+sin fichas, la petición se rechaza y se indica cuánto esperar.
+El cubo es una lista [fichas, último_relleno]: no hay hilos ni timers,
+el relleno se calcula al consultar. El limitador tiene su propio lock:
+allow() se llama sin el lock del estado y sweep() con él.
+"""
+
+import threading
+
+
+class TokenBucketLimiter:
+    """Limitador token bucket por clave con contadores de admisión."""
+
+    def __init__(self, rate, burst, sweep_interval=60.0):
+        self.rate = rate  # fichas por segundo
+        self.burst = burst  # capacidad del cubo
+        self.sweep_interval = sweep_interval
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = {}  # {clave: [fichas, último_relleno]}
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, now):
+        """
+        Consume una ficha de la clave. Devuelve 0 si se admite la
+        petición o los segundos que faltan para la siguiente ficha.
+        """
+        with self._lock:
+            return self._allow(key, now)
+
+    def _allow(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [self.burst - 1, now]
+            self.allowed += 1
+            return 0
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            self.allowed += 1
+            return 0
+        bucket[0] = tokens
+        self.rejected += 1
+        return (1 - tokens) / self.rate
+
+    def forget(self, key):
+        """Elimina el cubo de una clave (p. ej. al expirar el dispositivo)."""
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def sweep(self, now):
+        """
+        Elimina los cubos que ya se habrían rellenado del todo: equivalen
+        a no tener cubo. Como mucho una vez cada sweep_interval segundos.
+        """
+        with self._lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+            full = [
+                key
+                for key, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate >= self.burst
+            ]
+            for key in full:
+                del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self.allowed = 0
+            self.rejected = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+                "buckets": len(self._buckets),
+            }
@@ -0,0 +1,339 @@
+"""
+Router local para ejecutar la API en varios procesos (shards).
+
+Cada petición se reenvía al shard dueño del device_id o match_id de la
+ruta según el anillo de hashing consistente (ver sharding.py). Las
+consultas globales (lista de dispositivos, clasificación, estadísticas)
+se reparten entre todos los shards y se combinan aquí; si un shard
+no responde o falla, la consulta global responde 502 indicando cuál.
+
+Uso:
+    python router.py --shards 4 --port 5000
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from matchstats import FIELDS, summary
+from sharding import COORDINATOR, HashRing
+
+# Cabeceras que no se reenvían tal cual (hop-by-hop o recalculadas)
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "host"}
+LEADERBOARD_SORT = {
+    "wins": lambda e: (-e["wins"], e["losses"], e["device_id"]),
+    "ratio": lambda e: (-e["ratio"], -e["wins"], e["device_id"]),
+}
+
+
+class ShardError(Exception):
+    """Un shard no ha respondido, o no con 200, a una consulta global."""
+
+    def __init__(self, shard, status=None, data=None):
+        super().__init__(shard, status)
+        self.shard = shard
+        self.status = status  # None si no hubo respuesta
+        self.data = data
+
+
+class Cluster:
+    """Shards del clúster y conexiones keep-alive hacia ellos (por hilo)."""
+
+    # Más que la espera máxima de POST /matches?wait= (game.LOBBY_MAX_WAIT)
+    def __init__(self, peers, timeout=30.0):
+        self.peers = peers
+        self.ring = HashRing(len(peers))
+        self.timeout = timeout
+        self._local = threading.local()
+        self._next = count()
+
+    def owner(self, key):
+        return self.ring.owner(key)
+
+    def round_robin(self):
+        return next(self._next) % len(self.peers)
+
+    def request(self, shard, method, path, body=None, headers=None):
+        """Reenvía una petición y devuelve (status, cabeceras, cuerpo)."""
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        for attempt in range(2):
+            conn = connections.get(shard)
+            if conn is None:
+                host, port = self.peers[shard]
+                conn = connections[shard] = http.client.HTTPConnection(
+                    host, port, timeout=self.timeout
+                )
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                return response.status, response.getheaders(), response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                del connections[shard]
+                if attempt:
+                    raise
+
+    def get_json(self, shard, path, headers=None):
+        """(status, json); el json es None si el cuerpo no lo es (p. ej. un 500 en HTML)."""
+        status, _, body = self.request(shard, "GET", path, headers=headers)
+        try:
+            return status, json.loads(body) if body else None
+        except ValueError:
+            return status, None
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive con los clientes
+    disable_nagle_algorithm = True  # cabeceras y cuerpo van en escrituras separadas
+    cluster = None  # se asigna al crear el servidor
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---------- respuesta ----------
+    def reply(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in HOP_HEADERS:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_json(self, status, data):
+        body = json.dumps(data).encode()
+        headers = [("Content-Type", "application/json")]
+        origin = self.headers.get("Origin")
+        if origin:
+            headers.append(("Access-Control-Allow-Origin", origin))
+        self.reply(status, headers, body)
+
+    def forward(self, shard, body):
+        headers = {
+            name: value
+            for name, value in self.headers.items()
+            if name.lower() not in HOP_HEADERS
+        }
+        headers["X-Forwarded-For"] = self.client_address[0]
+        try:
+            status, response_headers, response_body = self.cluster.request(
+                shard, self.command, self.path, body, headers
+            )
+        except OSError:
+            self.reply_json(502, {"message": f"El shard {shard} no responde"})
+            return
+        self.reply(status, response_headers, response_body)
+
+    # ---------- enrutado ----------
+    def route(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+
+        if parts[:1] == ["internal"]:
+            self.reply_json(403, {"message": "Ruta interna"})
+        elif self.command == "GET" and len(parts) == 3 and parts[0] == "devices" and parts[2] == "rank":
+            self.global_rank(parts[1], parse_qs(url.query))
+        elif self.command == "GET" and parts == ["devices", "count"]:
+            self.count_devices()
+        elif parts == ["matches", "bulk"]:
+            self.forward(COORDINATOR, body)  # solo empareja dispositivos de ese shard
+        elif len(parts) >= 2 and parts[0] in ("devices", "matches"):
+            self.forward(self.cluster.owner(parts[1]), body)
+        elif self.command == "POST" and parts == ["matches"]:
+            try:
+                device_id = json.loads(body or b"{}").get("device_id")
+            except ValueError:
+                device_id = None
+            shard = self.cluster.owner(device_id) if device_id else COORDINATOR
+            self.forward(shard, body)
+        elif self.command == "POST" and parts == ["devices"]:
+            self.forward(self.cluster.round_robin(), body)
+        elif self.command == "GET" and parts == ["devices"]:
+            self.list_devices(url.query)
+        elif self.command == "GET" and parts == ["leaderboard"]:
+            self.merged_leaderboard(parse_qs(url.query))
+        elif self.command == "GET" and parts == ["stats"]:
+            self.merged_stats()
+        else:
+            self.forward(COORDINATOR, body)
+
+    def route_request(self):
+        try:
+            self.route()
+        except ShardError as error:
+            if error.status is not None and 400 <= error.status < 500:
+                # Lo que ya respondió el shard (404 del dispositivo, 429...)
+                self.reply_json(error.status, error.data)
+            elif error.status is None:
+                self.reply_json(502, {"message": f"El shard {error.shard} no responde"})
+            else:
+                self.reply_json(
+                    502, {"message": f"El shard {error.shard} ha fallado ({error.status})"}
+                )
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_OPTIONS = route_request
+
+    # ---------- consultas globales ----------
+    def fan_out(self, shard, path):
+        """
+        GET a un shard en nombre del cliente (cuenta para su límite por IP).
+        Devuelve el JSON de la respuesta; si no es un 200 lanza ShardError.
+        """
+        try:
+            status, data = self.cluster.get_json(
+                shard, path, {"X-Forwarded-For": self.client_address[0]}
+            )
+        except OSError:
+            raise ShardError(shard) from None
+        if status != 200:
+            raise ShardError(shard, status, data)
+        return data
+
+    def list_devices(self, query_string):
+        """
+        Une las páginas de todos los shards. Cada shard pagina por
+        device_id con el mismo cursor, así que basta con mezclarlas.
+        """
+        query = parse_qs(query_string)
+        connected, more = [], False
+        for shard in range(len(self.cluster.peers)):
+            data = self.fan_out(shard, f"/devices?{query_string}")
+            connected.extend(data["connected_devices"])
+            more = more or data["next_cursor"] is not None
+        if query.get("all") == ["1"]:
+            self.reply_json(200, {"connected_devices": connected, "next_cursor": None})
+            return
+        limit = max(1, min(1000, int(query.get("limit", [100])[0])))
+        connected.sort()
+        more = more or len(connected) > limit
+        connected = connected[:limit]
+        next_cursor = connected[-1] if more and connected else None
+        self.reply_json(200, {"connected_devices": connected, "next_cursor": next_cursor})
+
+    def count_devices(self):
+        connected = sum(
+            self.fan_out(shard, "/devices/count")["connected"]
+            for shard in range(len(self.cluster.peers))
+        )
+        self.reply_json(200, {"connected": connected})
+
+    def merged_stats(self):
+        """Suma los contadores por tamaño de cada shard y recalcula tasas y medias."""
+        totals = {}
+        for shard in range(len(self.cluster.peers)):
+            for entry in self.fan_out(shard, "/stats")["by_size"]:
+                total = totals.setdefault(entry["size"], [0] * len(FIELDS))
+                for i, name in enumerate(FIELDS):
+                    total[i] += entry[name]
+        self.reply_json(200, summary(totals))
+
+    def global_rank(self, device_id, query):
+        """Posición local en su shard + dispositivos por delante en el resto."""
+        by = query.get("by", ["wins"])[0]
+        owner = self.cluster.owner(device_id)
+        rank = self.fan_out(owner, f"/devices/{device_id}/rank?by={by}")
+        info = self.fan_out(owner, f"/devices/{device_id}/info")
+        params = urlencode(
+            {"by": by, "device_id": device_id, "wins": info["wins"], "losses": info["losses"]}
+        )
+        for shard in range(len(self.cluster.peers)):
+            if shard != owner:
+                other = self.fan_out(shard, f"/internal/leaderboard/ahead?{params}")
+                rank["rank"] += other["ahead"]
+                rank["total"] += other["total"]
+        self.reply_json(200, rank)
+
+    def merged_leaderboard(self, query):
+        """Une las primeras offset + limit entradas de cada shard (una llamada por shard)."""
+        by = query.get("by", ["wins"])[0]
+        if by not in LEADERBOARD_SORT:
+            self.reply_json(400, {"message": "Criterio de orden no válido (wins o ratio)"})
+            return
+        offset = max(0, int(query.get("offset", [0])[0]))
+        limit = max(1, min(100, int(query.get("limit", [10])[0])))
+        entries, total = [], 0
+        for shard in range(len(self.cluster.peers)):
+            page = self.fan_out(
+                shard, f"/internal/leaderboard/top?by={by}&limit={offset + limit}"
+            )
+            entries.extend(page["entries"])
+            total += page["total"]
+        entries.sort(key=LEADERBOARD_SORT[by])
+        entries = entries[offset : offset + limit]
+        for position, entry in enumerate(entries, start=offset + 1):
+            entry["rank"] = position
+        self.reply_json(200, {"by": by, "total": total, "offset": offset, "entries": entries})
+
+
+def make_server(host, port, peers):
+    """Crea el servidor del router para los shards indicados."""
+    handler = type("Handler", (RouterHandler,), {"cluster": Cluster(peers)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def launch_shards(shards, base_port, host="127.0.0.1"):
+    """Arranca un proceso por shard, cada uno con su estado y su diario."""
+    peers = [(host, base_port + index) for index in range(shards)]
+    peer_list = ",".join(f"{h}:{p}" for h, p in peers)
+    here = os.path.dirname(os.path.abspath(__file__))
+    processes = []
+    for index, (_, port) in enumerate(peers):
+        state_dir = os.path.join(os.environ.get("STATE_DIR", "state"), f"shard-{index}")
+        env = dict(
+            os.environ,
+            SHARD_INDEX=str(index),
+            SHARD_PEERS=peer_list,
+            STATE_DIR=state_dir,
+            MOVE_JOURNAL_PATH=os.path.join(state_dir, "moves.journal"),
+        )
+        # Cada shard con el servidor de producción: al pararlo vuelca su estado
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "serve.py", "--host", host, "--port", str(port)],
+                cwd=here,
+                env=env,
+            )
+        )
+    return peers, processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Router local de shards")
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--base-port", type=int, default=5100)
+    args = parser.parse_args()
+
+    peers, processes = launch_shards(args.shards, args.base_port)
+    server = make_server(args.host, args.port, peers)
+    print(f"Router en {args.host}:{args.port} con {args.shards} shards")
+    # Con SIGTERM también se paran los shards
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
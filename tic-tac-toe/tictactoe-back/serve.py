@@ -0,0 +1,291 @@
+"""
+Servidor de producción de la API.
+
+`python main.py` arranca el servidor de desarrollo de Werkzeug con el
+depurador. Este módulo es el punto de entrada para producción:
+
+- Un proceso maestro abre el socket y lo mantiene abierto mientras
+  viva; las conexiones que llegan entre dos procesos de trabajo
+  esperan en la cola del socket en lugar de ser rechazadas.
+- Un proceso de trabajo atiende las peticiones con un grupo acotado de
+  hilos (--threads) y conexiones keep-alive.
+- SIGTERM o Ctrl+C: el trabajador deja de aceptar conexiones, termina
+  las peticiones en curso (las que esperan rival en el lobby responden
+  202 en el acto) y vuelca el estado (diario, snapshot, registros)
+  antes de salir.
+- SIGHUP: recarga sin cortar el servicio. Se lanza un trabajador nuevo
+  con el código actual, que importa todo mientras el anterior sigue
+  atendiendo; después el anterior termina y vuelca el estado, y el
+  nuevo lo recupera y empieza a aceptar. La pausa es solo vaciar,
+  volcar y recuperar.
+- Si el trabajador muere, el maestro lanza otro (que recupera el
+  estado del disco).
+
+El estado del juego vive en la memoria del trabajador, así que hay un
+único trabajador por socket: varios procesos compartiendo el socket
+verían dispositivos y partidas distintos. Para repartir la carga entre
+varios procesos se usan shards (router.py), y cada shard se sirve con
+este módulo.
+
+Uso:
+    python serve.py --host 0.0.0.0 --port 5000 --threads 16
+    kill -HUP <pid del maestro>   # recarga
+"""
+
+import argparse
+import io
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+KEEPALIVE_TIMEOUT = 5.0  # segundos que se mantiene abierta una conexión sin peticiones
+IDLE_CHECK = 0.1  # cada cuánto mira una conexión ociosa si hay que cerrar
+# Al vaciar, una conexión ociosa aún atiende (con Connection: close) la petición
+# que el cliente ya hubiera enviado tras una respuesta sin Connection: close
+DRAIN_GRACE = 0.25
+MAX_BUFFERED_BODY = 8 * 1024 * 1024  # cuerpos mayores cierran la conexión al terminar
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    """
+    HTTP/1.1 con keep-alive. El manejador de Werkzeug cierra siempre la
+    conexión (envía Connection: close y descarta lo que quede en el
+    socket, que con keep-alive sería la petición siguiente). Aquí el
+    cuerpo se lee entero antes de llamar a la aplicación, así que lo
+    que no lea la aplicación no queda en el socket, y se mantiene la
+    conexión abierta. Entre peticiones espera sin bloquearse del todo
+    para poder cerrarla si otra conexión espera un hilo libre o poco
+    después de que el servidor empiece a vaciarse (DRAIN_GRACE).
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # cabeceras y cuerpo van en escrituras separadas
+    served = False  # ya ha atendido alguna petición de esta conexión
+    keep_alive = False  # la petición en curso deja la conexión abierta
+
+    def run_wsgi(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        self.keep_alive = (
+            not self.close_connection  # HTTP/1.0 o Connection: close
+            and "Transfer-Encoding" not in self.headers
+            and 0 <= length <= MAX_BUFFERED_BODY
+        )
+        if not self.keep_alive:
+            super().run_wsgi()  # Werkzeug cierra la conexión al terminar
+            return
+        socket_file = self.rfile
+        self.rfile = io.BytesIO(socket_file.read(length))
+        try:
+            super().run_wsgi()
+        finally:
+            self.rfile = socket_file
+
+    def send_header(self, keyword, value):
+        if (
+            keyword.lower() == "connection"
+            and value.lower() == "close"
+            and self.keep_alive
+            and self.server.draining_since is None
+        ):
+            return
+        super().send_header(keyword, value)
+
+    def handle_one_request(self):
+        if self.served and not self.wait_for_request():
+            self.close_connection = True
+            return
+        self.served = True
+        super().handle_one_request()
+
+    def wait_for_request(self):
+        deadline = monotonic() + KEEPALIVE_TIMEOUT
+        while True:
+            if self.server.draining_since is not None:
+                deadline = min(deadline, self.server.draining_since + DRAIN_GRACE)
+            remaining = deadline - monotonic()
+            if remaining <= 0 or self.server.saturated():
+                return False  # sin más peticiones, o hay conexiones esperando un hilo
+            readable, _, _ = select.select([self.connection], [], [], min(IDLE_CHECK, remaining))
+            if readable:
+                return True
+
+    def log_request(self, code="-", size="-"):
+        pass  # cada petición ya queda en el registro de accesos
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Servidor WSGI con un número fijo de hilos para las conexiones."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, handler=KeepAliveHandler, fd=fd)
+        self.draining_since = None  # monotonic() al empezar a vaciar
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="http")
+        self.threads = threads
+        self.connections = 0  # conexiones aceptadas y no cerradas (con hilo o esperándolo)
+        self._connections_lock = threading.Lock()
+
+    def saturated(self):
+        """Hay conexiones esperando porque todos los hilos están ocupados."""
+        return self.connections > self.threads
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self.connections += 1
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._connections_lock:
+                self.connections -= 1
+
+    def drain(self):
+        """Deja de aceptar y espera a que terminen las peticiones en curso."""
+        self.draining_since = monotonic()
+        self.shutdown()  # sale de serve_forever (se llama desde otro hilo)
+        self.pool.shutdown(wait=True)
+
+
+# ======== PROCESO DE TRABAJO ========
+def run_worker(host, port, fd, threads, ready_fd):
+    """
+    Importa la aplicación, avisa al maestro por `ready_fd` y espera su
+    "go" por la entrada estándar antes de recuperar el estado (el
+    trabajador anterior tiene que haberlo volcado).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C lo gestiona el maestro
+    import main
+
+    app = main.create_app()
+    os.write(ready_fd, b"r")
+    os.close(ready_fd)
+    if sys.stdin.readline().strip() != "go":
+        return  # el maestro se fue antes de darle paso
+    main.start_services(app)  # recupera el estado; atexit lo vuelca al salir
+    server = PooledWSGIServer(host, port, app, threads, fd=fd)
+    game = app.extensions["tictactoe"]
+
+    def stop():
+        game.release_lobby_waiters()  # POST /matches?wait= responde ya, sin esperar al rival
+        server.drain()
+
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=stop, daemon=True).start())
+    server.serve_forever()
+    server.pool.shutdown(wait=True)
+
+
+# ======== PROCESO MAESTRO ========
+class Master:
+    """Mantiene el socket y un trabajador vivo; recarga con SIGHUP."""
+
+    def __init__(self, host, port, threads, backlog=1024):
+        self.host = host
+        self.threads = threads
+        self.sock = socket.create_server((host, port), backlog=backlog)
+        self.sock.set_inheritable(True)
+        self.port = self.sock.getsockname()[1]
+        self.worker = None
+        self.reloads = 0
+        self._reload = False
+        self._stop = False
+
+    def spawn(self):
+        """Lanza un trabajador y espera a que haya importado la aplicación."""
+        ready_r, ready_w = os.pipe()
+        worker = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--worker",
+                "--host", self.host,
+                "--port", str(self.port),
+                "--fd", str(self.sock.fileno()),
+                "--ready-fd", str(ready_w),
+                "--threads", str(self.threads),
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdin=subprocess.PIPE,
+            pass_fds=(self.sock.fileno(), ready_w),
+        )
+        os.close(ready_w)
+        with os.fdopen(ready_r, "rb") as ready:
+            if ready.read(1) != b"r":
+                worker.wait()
+                raise RuntimeError("El trabajador no ha arrancado")
+        return worker
+
+    @staticmethod
+    def go(worker):
+        worker.stdin.write(b"go\n")
+        worker.stdin.close()
+
+    @staticmethod
+    def stop_worker(worker):
+        worker.send_signal(signal.SIGTERM)
+        worker.wait()
+
+    def reload(self):
+        new = self.spawn()
+        self.stop_worker(self.worker)  # vacía y vuelca el estado
+        self.go(new)
+        self.worker = new
+        self.reloads += 1
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "_reload", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "_stop", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "_stop", True))
+        self.worker = self.spawn()
+        self.go(self.worker)
+        print(f"Sirviendo en {self.host}:{self.port} (pid {os.getpid()}, {self.threads} hilos)")
+        try:
+            while not self._stop:
+                if self._reload:
+                    self._reload = False
+                    self.reload()
+                elif self.worker.poll() is not None:
+                    print(f"El trabajador terminó ({self.worker.returncode}); se relanza")
+                    self.worker = self.spawn()
+                    self.go(self.worker)
+                sleep(0.1)
+        finally:
+            if self.worker.poll() is None:
+                self.stop_worker(self.worker)
+            self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción de la API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--fd", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--ready-fd", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.host, args.port, args.fd, args.threads, args.ready_fd)
+    else:
+        Master(args.host, args.port, args.threads, args.backlog).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Reparto de partidas y dispositivos entre varios procesos (shards).
+
+Cada ID (device_id o match_id) pertenece al shard que le asigna un
+anillo de hashing consistente. Los shards se comunican entre sí por
+HTTP local: llamadas síncronas para el lobby (que coordina el shard 0)
+y eventos asíncronos, en un hilo aparte, para actualizar dispositivos
+que viven en otro shard (resultados y actividad).
+"""
+
+import bisect
+import hashlib
+import http.client
+import json
+import queue
+import threading
+from uuid import uuid4
+
+COORDINATOR = 0  # shard que mantiene el lobby global
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Anillo de hashing consistente con nodos virtuales."""
+
+    def __init__(self, shard_count, replicas=100):
+        self.shard_count = shard_count
+        points = sorted(
+            (_hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(shard_count)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def owner(self, key):
+        """Shard dueño de una clave."""
+        position = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._shards[position]
+
+
+class ShardClient:
+    """Conexión de un shard con el resto del clúster."""
+
+    def __init__(self, index, peers, timeout=5.0):
+        self.index = index
+        self.peers = peers  # [(host, puerto)] por shard
+        self.ring = HashRing(len(peers))
+        self.timeout = timeout
+        self._local = threading.local()  # conexiones keep-alive por hilo
+        self._events = queue.Queue()
+        self._sender = None
+
+    @property
+    def is_coordinator(self):
+        return self.index == COORDINATOR
+
+    def owner(self, key):
+        return self.ring.owner(key)
+
+    def owns(self, key):
+        return self.ring.owner(key) == self.index
+
+    def new_id(self):
+        """Genera un UUID que pertenece a este shard (muestreo por rechazo)."""
+        while True:
+            candidate = str(uuid4())
+            if self.owns(candidate):
+                return candidate
+
+    # ---------- llamadas síncronas ----------
+    def call(self, shard, method, path, body=None):
+        """Llama a otro shard y devuelve (status, json). Nunca con state_lock."""
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload else {}
+        for attempt in range(2):
+            conn = connections.get(shard)
+            if conn is None:
+                host, port = self.peers[shard]
+                conn = connections[shard] = http.client.HTTPConnection(
+                    host, port, timeout=self.timeout
+                )
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                return response.status, json.loads(data) if data else None
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                del connections[shard]
+                if attempt:
+                    raise
+
+    # ---------- eventos asíncronos ----------
+    def send(self, shard, path, body):
+        """Encola un POST para otro shard sin esperar la respuesta."""
+        self._events.put((shard, path, body))
+        if self._sender is None:
+            self._start_sender()
+
+    def send_event(self, device_id, event):
+        """Encola un evento para el shard dueño del dispositivo."""
+        self.send(self.owner(device_id), f"/internal/devices/{device_id}/events", event)
+
+    def _start_sender(self):
+        self._sender = threading.Thread(
+            target=self._send_loop, name="shard-events", daemon=True
+        )
+        self._sender.start()
+
+    def _send_loop(self):
+        while True:
+            shard, path, body = self._events.get()
+            try:
+                self.call(shard, "POST", path, body)
+            except OSError:
+                pass  # el shard no responde: el evento se pierde
+            finally:
+                self._events.task_done()
+
+    def drain(self):
+        """Espera a que se hayan enviado los eventos encolados."""
+        self._events.join()
@@ -1,49 +1,123 @@
+import heapq
+import http.client
+import json
+import random
+import sys
+import threading
+from time import perf_counter, sleep
+
 import pytest
-from main import api, devices, matches, DISCONNECT_TIMEOUT
+import game as game_module
+import main
+import router
+import serve
+from journal import MoveJournal
+from accesslog import AccessLog
+from tracing import NO_TRACE, current_trace
+from wire import pack_board, unpack_board
+from game import DEVICE_BURST, DISCONNECT_TIMEOUT, FORFEIT_GRACE, POLL_BASELINE_MS, POLL_SLOW_MS
+from matchmaking import INITIAL_RATING, LobbyIndex, rating_window
+from matchstats import MatchStats
+from game import HISTORY_SIZE, line_table
+from idempotency import ReplyCache
+from ratelimit import TokenBucketLimiter
+from persistence import StateStore
+from ranking import IndexableSkipList, Leaderboard
+from sharding import HashRing, ShardClient
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = main.create_app(
+        {
+            "TESTING": True,
+            "DOCS": False,
+            "RATE_LIMIT_ENABLED": False,
+            "MOVE_JOURNAL_PATH": tmp_path / "moves.journal",
+            "STATE_DIR": tmp_path / "state",
+            "ACCESS_LOG_PATH": tmp_path / "access.log",
+            "TRACE_PATH": tmp_path / "traces.jsonl",
+        }
+    )
+    yield app
+    app.extensions["tictactoe"].move_journal.close()
 
 
 @pytest.fixture
-def client():
-    api.app.config["TESTING"] = True
-    with api.app.test_client() as client:
+def game(app):
+    return app.extensions["tictactoe"]
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
         yield client
 
 
+def create_match(client, d1, d2, size=3):
+    """Empareja dos dispositivos a través del lobby y devuelve la respuesta."""
+    client.post("/matches", json={"size": size, "device_id": d1})
+    return client.post("/matches", json={"size": size, "device_id": d2})
+
+
+def expire_device(game, device_id):
+    """Simula que el dispositivo lleva DISCONNECT_TIMEOUT sin actividad."""
+    game.devices[device_id]["last_active"] -= DISCONNECT_TIMEOUT.total_seconds()
+    game.schedule_expiry(device_id)
+
+
 # ===========================================================
 #  TESTS DE DISPOSITIVOS
 # ===========================================================
 
 
-def test_register_device(client):
-    devices.clear()
-    matches.clear()
-
+def test_register_device(client, game):
     res = client.post("/devices", json={"alias": "TestDev"})
     assert res.status_code == 201
     data = res.get_json()
     assert "device_id" in data
     device_id = data["device_id"]
-    assert device_id in devices
-    assert devices[device_id]["alias"] == "TestDev"
+    assert device_id in game.devices
+    assert game.devices[device_id]["alias"] == "TestDev"
 
 
-def test_unregister_device(client):
-    devices.clear()
-    matches.clear()
-
+def test_unregister_device(client, game):
     res = client.post("/devices", json={"alias": "TestDev"})
     device_id = res.get_json()["device_id"]
 
     # Simulamos inactividad forzada
-    devices[device_id]["last_active"] -= DISCONNECT_TIMEOUT.total_seconds()
+    expire_device(game, device_id)
     client.get("/devices")
-    assert device_id not in devices
+    assert device_id not in game.devices
 
 
-def test_list_devices(client):
-    devices.clear()
-    matches.clear()
+def test_expired_player_forfeits_active_match(client, game, monkeypatch):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match = create_match(client, d1, d2).get_json()
+    match_id = match["match_id"]
+
+    expire_device(game, d1)
+    client.get("/devices")
+    assert d1 not in game.devices
 
+    # El rival gana y ya no tiene partida activa, pero aún ve el resultado
+    info = client.get(f"/devices/{d2}/info").get_json()
+    assert info["wins"] == 1
+    assert client.get(f"/devices/{d2}/match").status_code == 404
+    state = client.get(f"/matches/{match_id}?device_id={d2}").get_json()
+    assert state["winner"] == match["players"][d2]
+    assert state["opponent_left"] is True
+
+    # Pasado el plazo de gracia la partida se elimina
+    later = game_module.time() + FORFEIT_GRACE + 1
+    monkeypatch.setattr(game_module, "time", lambda: later)
+    game.cleanup_inactive_devices()
+    assert match_id not in game.matches
+    assert not game.evictions
+
+
+def test_list_devices(client):
     client.post("/devices", json={"alias": "TestDev"})
     res = client.get("/devices")
     assert res.status_code == 200
@@ -52,26 +126,57 @@ def test_list_devices(client):
     assert len(data["connected_devices"]) > 0
 
 
+def test_list_devices_pages_with_stable_cursor(client, game):
+    ids = sorted(client.post("/devices").get_json()["device_id"] for _ in range(7))
+    first = client.get("/devices?limit=3").get_json()
+    assert first["connected_devices"] == ids[:3]
+    assert first["next_cursor"] == ids[2]
+
+    # Una baja entre páginas no hace repetir ni saltar dispositivos
+    expire_device(game, ids[1])
+    expire_device(game, ids[3])
+    second = client.get(f"/devices?limit=3&cursor={first['next_cursor']}").get_json()
+    assert second["connected_devices"] == ids[4:7]
+    assert second["next_cursor"] is None
+
+    assert client.get("/devices/count").get_json()["connected"] == 5
+    full = client.get("/devices?all=1").get_json()
+    assert sorted(full["connected_devices"]) == ids[:1] + ids[2:3] + ids[4:]
+
+
+def test_cleanup_only_revisits_devices_past_the_timeout(client, game):
+    stale, active = (client.post("/devices").get_json()["device_id"] for _ in range(2))
+    # Entrada antigua de un dispositivo que ha seguido activo: se vuelve a
+    # programar con su last_active real en lugar de eliminarlo
+    game.activity_heap.append((game.devices[active]["last_active"] - DISCONNECT_TIMEOUT.total_seconds(), active))
+    heapq.heapify(game.activity_heap)
+    expire_device(game, stale)
+
+    game.cleanup_inactive_devices()
+    assert stale not in game.devices
+    assert active in game.devices
+    assert [d for _, d in game.activity_heap].count(active) == 2
+    # La entrada que queda del dispositivo eliminado se descarta al salir
+    assert game.expired_devices(game.devices[active]["last_active"] + 2 * DISCONNECT_TIMEOUT.total_seconds()) == [active]
+
+
 # ===========================================================
 #  TESTS DE PARTIDA
 # ===========================================================
 
 
-def test_create_match(client):
-    devices.clear()
-    matches.clear()
-
+def test_create_match(client, game):
     d1 = client.post("/devices", json={"alias": "TestDev1"}).get_json()["device_id"]
     d2 = client.post("/devices", json={"alias": "TestDev2"}).get_json()["device_id"]
 
-    res = client.post("/matches", json={"size": 3})
+    res = create_match(client, d1, d2)
     assert res.status_code == 201
     data = res.get_json()
 
     assert "match_id" in data
     match_id = data["match_id"]
-    assert len(matches) == 1
-    match = matches[match_id]
+    assert len(game.matches) == 1
+    match = game.matches[match_id]
 
     assert len(match["board"]) == match["size"]
     assert match["turn"] in match["players"]
@@ -82,14 +187,11 @@ def test_create_match(client):
 # ===========================================================
 
 
-def test_make_move_and_turn_change(client):
-    devices.clear()
-    matches.clear()
-
-    client.post("/devices", json={"alias": "P1"})
-    client.post("/devices", json={"alias": "P2"})
-    match_id = client.post("/matches").get_json()["match_id"]
-    match = matches[match_id]
+def test_make_move_and_turn_change(client, game):
+    d1 = client.post("/devices", json={"alias": "P1"}).get_json()["device_id"]
+    d2 = client.post("/devices", json={"alias": "P2"}).get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    match = game.matches[match_id]
     turn = match["turn"]
 
     # Primer movimiento
@@ -103,15 +205,12 @@ def test_make_move_and_turn_change(client):
     assert data["next_turn"] != turn
 
 
-def test_invalid_turn(client):
-    devices.clear()
-    matches.clear()
-
-    client.post("/devices")
-    client.post("/devices")
-    match_id = client.post("/matches").get_json()["match_id"]
+def test_invalid_turn(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
 
-    match = matches[match_id]
+    match = game.matches[match_id]
     wrong_player = [p for p in match["players"] if p != match["turn"]][0]
 
     res = client.post(
@@ -120,14 +219,11 @@ def test_invalid_turn(client):
     assert res.status_code == 403
 
 
-def test_cell_occupied(client):
-    devices.clear()
-    matches.clear()
-
-    client.post("/devices")
-    client.post("/devices")
-    match_id = client.post("/matches").get_json()["match_id"]
-    match = matches[match_id]
+def test_cell_occupied(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    match = game.matches[match_id]
     turn = match["turn"]
 
     # Primer movimiento válido
@@ -141,46 +237,230 @@ def test_cell_occupied(client):
     assert res.status_code == 400
 
 
+def test_draw_declared_when_no_line_can_be_won(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    x_id = game.matches[match_id]["turn"]
+    o_id = d2 if x_id == d1 else d1
+
+    # X O X / O X . / O X O: la casilla (1, 2) ya no completa ninguna línea
+    cells = [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (2, 0), (2, 1), (2, 2)]
+    for i, (x, y) in enumerate(cells):
+        data = client.post(
+            f"/matches/{match_id}/moves",
+            json={"device_id": (x_id, o_id)[i % 2], "x": x, "y": y},
+        ).get_json()
+        assert data["draw"] == (i == len(cells) - 1)
+    assert data["winner"] is None
+    assert data["next_turn"] is None
+
+    state = client.get(f"/matches/{match_id}?device_id={x_id}").get_json()
+    assert state["draw"] is True
+    res = client.post(f"/matches/{match_id}/moves", json={"device_id": x_id, "x": 1, "y": 2})
+    assert res.status_code == 400
+    for device_id in (d1, d2):
+        info = client.get(f"/devices/{device_id}/info").get_json()
+        assert (info["wins"], info["losses"], info["draws"]) == (0, 0, 1)
+        assert client.get(f"/devices/{device_id}/match").status_code == 404
+
+
+def test_line_table_counts_windows_per_size():
+    assert line_table(3)[0] == 8
+    assert line_table(7)[0] == 88  # 4 en línea
+    assert line_table(19)[0] == 2 * 19 * 15 + 2 * 15 * 15  # 5 en línea
+    _, by_cell = line_table(3)
+    assert len(by_cell[4]) == 4  # el centro está en fila, columna y dos diagonales
+
+
+# ===========================================================
+#  TESTS DE REINTENTOS (IDEMPOTENCY-KEY)
+# ===========================================================
+
+
+def test_move_retry_with_same_key_returns_original(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    x_id = game.matches[match_id]["turn"]
+    o_id = d2 if x_id == d1 else d1
+
+    def move(device_id, x, y, key):
+        return client.post(
+            f"/matches/{match_id}/moves",
+            json={"device_id": device_id, "x": x, "y": y},
+            headers={"Idempotency-Key": key},
+        )
+
+    first = move(x_id, 0, 0, "m1")
+    assert first.status_code == 200
+    move(o_id, 1, 0, "m2")
+    retry = move(x_id, 0, 0, "m1")  # ya no es su turno y la casilla está ocupada
+    assert retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert move(x_id, 0, 0, "m3").status_code == 400
+
+    move(x_id, 0, 1, "m4")
+    move(o_id, 1, 1, "m5")
+    win = move(x_id, 0, 2, "m6")
+    assert win.get_json()["winner"] == "X"
+    assert move(x_id, 0, 2, "m6").get_json() == win.get_json()
+    assert game.devices[x_id]["wins"] == 1
+    assert game.move_replies.stats()["hits"] == 2
+
+
+def test_reply_cache_is_bounded_and_expires():
+    cache = ReplyCache(max_entries=2, ttl=10.0, sweep_interval=0.0)
+    for i, key in enumerate("abc"):
+        cache.put("m", key, {"n": i}, now=float(i))
+    assert cache.get("m", "a", 3.0) is None  # la más antigua se descarta
+    assert cache.get("m", "c", 3.0) == {"n": 2}
+    assert cache.get("m", "b", 11.5) is None  # caducada
+    cache.put("other", "a", {}, now=0.0)
+    cache.sweep(20.0)
+    assert len(cache) == 0
+    cache.put("m", "a", {}, now=20.0)
+    cache.forget("m")
+    assert cache.stats() == {"hits": 1, "stored": 5, "entries": 0}
+
+
 # ===========================================================
 #  TESTS DE SINCRONIZACIÓN
 # ===========================================================
 
 
 def test_sync_game(client):
-    devices.clear()
-    matches.clear()
-
     d1 = client.post("/devices").get_json()["device_id"]
     d2 = client.post("/devices").get_json()["device_id"]
-    match_id = client.post("/matches").get_json()["match_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
 
     res = client.get(f"/matches/{match_id}")
     assert res.status_code == 200
     data = res.get_json()
 
-    assert set(data.keys()) == {"board", "turn", "winner", "size", "players"}
+    assert set(data.keys()) == {
+        "board",
+        "stones",
+        "turn",
+        "winner",
+        "draw",
+        "size",
+        "players",
+        "opponent_left",
+        "retry_after_ms",
+    }
     assert set(data["players"].keys()) == {d1, d2}
     assert data["turn"] in [d1, d2]
     assert data["players"][d1] != data["players"][d2]
 
 
+def test_board_packs_one_byte_per_cell():
+    board = [["X", "", ""], ["", "O", ""], ["", "", "X"]]
+    packed = pack_board(board)
+    assert packed == b"X\x00\x00\x00O\x00\x00\x00X"
+    assert unpack_board(packed, 3) == board
+
+
+def test_msgpack_negotiated_by_accept_and_content_type(client):
+    msgpack = pytest.importorskip("msgpack")
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    client.post("/matches", json={"size": 3, "device_id": d1})
+    res = client.post(
+        "/matches",
+        data=msgpack.packb({"size": 3, "device_id": d2}),
+        content_type="application/msgpack",
+        headers={"Accept": "application/msgpack"},
+    )
+    assert res.status_code == 201
+    assert res.mimetype == "application/msgpack"
+    match = msgpack.unpackb(res.data)
+    x_player = next(pid for pid, sym in match["players"].items() if sym == "X")
+
+    res = client.post(
+        f"/matches/{match['match_id']}/moves",
+        data=msgpack.packb({"device_id": x_player, "x": 1, "y": 2}),
+        content_type="application/msgpack",
+        headers={"Accept": "application/msgpack"},
+    )
+    move = msgpack.unpackb(res.data)
+    assert move["board"] == b"\x00" * 5 + b"X" + b"\x00" * 3
+    assert unpack_board(move["board"], 3)[1][2] == "X"
+
+    res = client.get(
+        f"/matches/{match['match_id']}?device_id={d1}",
+        headers={"Accept": "application/msgpack"},
+    )
+    assert len(res.data) < len(client.get(f"/matches/{match['match_id']}?device_id={d1}").data)
+    assert msgpack.unpackb(res.data)["board"] == move["board"]
+
+    # JSON sigue siendo el formato por defecto
+    res = client.get(f"/matches/{match['match_id']}?device_id={d1}", headers={"Accept": "*/*"})
+    assert res.get_json()["board"][1][2] == "X"
+
+
+# ===========================================================
+#  TESTS DE TABLEROS GRANDES (GOMOKU)
+# ===========================================================
+
+
+def test_gomoku_large_board_five_in_line(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    res = create_match(client, d1, d2, size=19)
+    assert res.get_json()["board_size"] == 19
+    match_id = res.get_json()["match_id"]
+    match = game.matches[match_id]
+    assert match["board"] is None
+
+    x_id = next(pid for pid, sym in match["players"].items() if sym == "X")
+    o_id = d2 if x_id == d1 else d1
+    for i in range(4):
+        data = client.post(
+            f"/matches/{match_id}/moves", json={"device_id": x_id, "x": 9, "y": 7 + i}
+        ).get_json()
+        assert data["board"] is None
+        assert data["changes"] == [{"x": 9, "y": 7 + i, "symbol": "X"}]
+        assert data["winner"] is None  # 4 en línea no basta en 19x19
+        client.post(f"/matches/{match_id}/moves", json={"device_id": o_id, "x": 0, "y": 2 * i})
+
+    occupied = client.post(f"/matches/{match_id}/moves", json={"device_id": x_id, "x": 0, "y": 0})
+    assert occupied.status_code == 400
+
+    # La quinta ficha cierra la línea por el otro extremo
+    data = client.post(
+        f"/matches/{match_id}/moves", json={"device_id": x_id, "x": 9, "y": 6}
+    ).get_json()
+    assert data["winner"] == "X"
+    assert sum(1 for value in match["cells"] if value) == 9
+
+    state = client.get(f"/matches/{match_id}?device_id={o_id}").get_json()
+    assert state["board"] is None
+    assert {"x": 9, "y": 6, "symbol": "X"} in state["stones"]
+    assert len(state["stones"]) == 9
+
+
+def test_large_sizes_kept_and_others_clamped(client):
+    ids = [client.post("/devices").get_json()["device_id"] for _ in range(4)]
+    assert create_match(client, ids[0], ids[1], size=15).get_json()["board_size"] == 15
+    assert create_match(client, ids[2], ids[3], size=12).get_json()["board_size"] == 7
+
+
 # ===========================================================
 #  TESTS DE ESTADO DE DISPOSITIVO
 # ===========================================================
 
 
 def test_device_status_connected(client):
-    devices.clear()
     d1 = client.post("/devices").get_json()["device_id"]
     res = client.get(f"/devices/{d1}/info")
     assert res.status_code == 200
     assert res.get_json()["connected"] is True
 
 
-def test_device_status_disconnected(client):
-    devices.clear()
+def test_device_status_disconnected(client, game):
     d1 = client.post("/devices").get_json()["device_id"]
-    devices[d1]["last_active"] -= DISCONNECT_TIMEOUT.total_seconds()
+    expire_device(game, d1)
     res = client.get(f"/devices/{d1}/info")
     assert res.status_code == 404
 
@@ -191,9 +471,6 @@ def test_device_status_disconnected(client):
 
 
 def test_device_stats_global(client):
-    devices.clear()
-    matches.clear()
-
     # Registrar dos dispositivos
     r1 = client.post("/devices", json={"alias": "A"})
     r2 = client.post("/devices", json={"alias": "B"})
@@ -201,7 +478,7 @@ def test_device_stats_global(client):
     d2 = r2.get_json()["device_id"]
 
     # Crear partida
-    match_resp = client.post("/matches", json={"size": 3})
+    match_resp = create_match(client, d1, d2)
     match_data = match_resp.get_json()
     match_id = match_data["match_id"]
     players = match_data["players"]
@@ -240,10 +517,7 @@ def test_device_stats_global(client):
 # ===========================================================
 
 
-def test_full_game_flow_x_wins(client):
-    devices.clear()
-    matches.clear()
-
+def test_full_game_flow_x_wins(client, game):
     # Registrar dos dispositivos
     r1 = client.post("/devices", json={"alias": "Jugador1"})
     r2 = client.post("/devices", json={"alias": "Jugador2"})
@@ -253,7 +527,7 @@ def test_full_game_flow_x_wins(client):
     d1, d2 = data1["device_id"], data2["device_id"]
 
     # Crear partida (el jugador con símbolo X siempre empieza)
-    match_res = client.post("/matches", json={"size": 3})
+    match_res = create_match(client, d1, d2)
     match_data = match_res.get_json()
     match_id = match_data["match_id"]
     players = match_data["players"]
@@ -279,5 +553,975 @@ def test_full_game_flow_x_wins(client):
         assert res.status_code == 200, f"Movimiento inválido para {device}"
 
     # Comprobar que gana X
-    final_data = matches[match_id]
+    final_data = game.matches[match_id]
     assert final_data["winner"] == "X"
+
+
+# ===========================================================
+#  TESTS DE HISTORIAL DE PARTIDAS
+# ===========================================================
+
+
+def test_history_lists_finished_matches_newest_first(client):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match = create_match(client, d1, d2).get_json()
+    players = match["players"]
+    device_x = next(pid for pid, sym in players.items() if sym == "X")
+    device_o = next(pid for pid, sym in players.items() if sym == "O")
+    for device, x, y in [(device_x, 0, 0), (device_o, 1, 0), (device_x, 0, 1), (device_o, 1, 1), (device_x, 0, 2)]:
+        client.post(f"/matches/{match['match_id']}/moves", json={"device_id": device, "x": x, "y": y})
+    client.post(f"/matches/{match['match_id']}/leave", json={"device_id": device_x})
+
+    second = create_match(client, d1, d2).get_json()
+    client.post(f"/matches/{second['match_id']}/surrender", json={"device_id": d1})
+
+    history = client.get(f"/devices/{device_x}/history").get_json()["matches"]
+    assert [(h["match_id"], h["result"], h["reason"]) for h in history] == [
+        (second["match_id"], "loss" if device_x == d1 else "win", "surrender"),
+        (match["match_id"], "win", "line"),
+    ]
+    assert history[1]["opponent_id"] == device_o
+    assert history[1]["moves"] == 5 and history[1]["size"] == 3
+    assert history[1]["started_at"] <= history[1]["ended_at"] <= history[0]["ended_at"]
+
+    latest = client.get(f"/devices/{device_o}/history?limit=1").get_json()["matches"]
+    assert [h["match_id"] for h in latest] == [second["match_id"]]
+    assert client.get("/devices/nope/history").status_code == 404
+
+
+def test_history_is_a_bounded_ring_buffer(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    for i in range(HISTORY_SIZE + 5):
+        game.add_history(d1, (f"m{i}", "rival", 3, "win", "line", 5, float(i), float(i)))
+    assert len(game.histories[d1]) == HISTORY_SIZE
+    recent = game.recent_history(d1, 3)
+    assert [h["match_id"] for h in recent] == [f"m{HISTORY_SIZE + 4 - i}" for i in range(3)]
+
+    expire_device(game, d1)
+    client.get("/devices")
+    assert d1 not in game.histories
+
+
+# ===========================================================
+#  TESTS DE ESTADÍSTICAS GLOBALES
+# ===========================================================
+
+
+def test_global_stats_follow_created_and_finished_matches(client):
+    devices = [client.post("/devices").get_json()["device_id"] for _ in range(6)]
+    won = create_match(client, devices[0], devices[1]).get_json()
+    x = next(pid for pid, sym in won["players"].items() if sym == "X")
+    o = next(pid for pid, sym in won["players"].items() if sym == "O")
+    for device, cx, cy in [(x, 0, 0), (o, 1, 0), (x, 0, 1), (o, 1, 1), (x, 0, 2)]:
+        client.post(f"/matches/{won['match_id']}/moves", json={"device_id": device, "x": cx, "y": cy})
+    surrendered = create_match(client, devices[2], devices[3]).get_json()
+    x_surrenders = next(pid for pid, sym in surrendered["players"].items() if sym == "X")
+    client.post(f"/matches/{surrendered['match_id']}/surrender", json={"device_id": x_surrenders})
+    left = create_match(client, devices[4], devices[5], size=5).get_json()
+    x_leaves = next(pid for pid, sym in left["players"].items() if sym == "X")
+    client.post(f"/matches/{left['match_id']}/leave", json={"device_id": x_leaves})
+
+    stats = client.get("/stats").get_json()
+    assert (stats["created"], stats["finished"]) == (3, 3)
+    assert (stats["x_wins"], stats["o_wins"], stats["draws"]) == (1, 2, 0)
+    assert stats["surrender_rate"] == stats["leave_rate"] == pytest.approx(1 / 3)
+    assert stats["avg_moves"] == pytest.approx(5 / 3)
+    by_size = {entry["size"]: entry for entry in stats["by_size"]}
+    assert (by_size[3]["created"], by_size[5]["created"]) == (2, 1)
+    assert by_size[5]["leaves"] == 1 and by_size[5]["o_win_rate"] == 1.0
+
+
+def test_global_stats_are_restored_and_old_shards_folded(tmp_path):
+    state = game_module.GameState(tmp_path / "moves.journal", tmp_path / "state")
+    state.restore()
+    with state.lock:
+        state.stats.match_created(3)
+        state.stats.match_finished(3, "X", "line", 5, 2.0)
+    assert state.stats.totals() == {3: [1, 1, 1, 0, 0, 0, 0, 0, 5, 2.0]}
+    state.close()
+
+    restored = game_module.GameState(tmp_path / "moves.journal", tmp_path / "state")
+    restored.restore()
+    assert restored.stats.totals() == {3: [1, 1, 1, 0, 0, 0, 0, 0, 5, 2.0]}
+    restored.close()
+
+    # Formato anterior: una copia de los contadores por hilo
+    old = {0: {3: [2, 1, 0, 1, 0, 0, 0, 0, 7, 1.0]}, 5: {3: [1, 0, 0, 0, 0, 0, 0, 0, 0, 0]}}
+    stats = MatchStats()
+    stats.counters.update(old)
+    assert stats.upgrade() == [0, 3, 5]
+    assert stats.totals() == {3: [3, 1, 0, 1, 0, 0, 0, 0, 7, 1.0]}
+
+
+# ===========================================================
+#  TESTS DEL REGISTRO DE ACCESOS
+# ===========================================================
+
+
+def test_access_log_records_move_with_ids_and_timing(client, app, tmp_path):
+    access_log = app.extensions["access_log"]
+    access_log.start()
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match = create_match(client, d1, d2).get_json()
+    x_player = next(pid for pid, sym in match["players"].items() if sym == "X")
+    client.post(
+        f"/matches/{match['match_id']}/moves", json={"device_id": x_player, "x": 0, "y": 0}
+    )
+    access_log.close()
+
+    lines = (tmp_path / "access.log").read_text().splitlines()
+    records = [json.loads(line) for line in lines]
+    assert len(records) == 5
+    move = records[-1]
+    assert move["endpoint"] == "tictactoe_match_move"
+    assert move["status"] == 200
+    assert move["device_id"] == x_player
+    assert move["match_id"] == match["match_id"]
+    assert isinstance(move["duration_us"], int) and move["duration_us"] >= 0
+    assert records[-2]["status"] == 201
+    assert client.get("/accesslog").get_json()["written"] == 5
+
+
+def test_access_log_drops_when_full_and_rotates(tmp_path):
+    full = AccessLog(tmp_path / "full.log", max_queue=2)
+    full.enabled = True  # sin hilo escritor: la cola no se vacía
+    for i in range(5):
+        full.log((i, "GET", "/", None, 200, None, None, 1))
+    assert full.stats()["dropped"] == 3
+
+    path = tmp_path / "access.log"
+    access_log = AccessLog(path, batch_size=1, max_bytes=300, backups=2)
+    access_log.start()
+    for i in range(40):
+        access_log.log((i, "GET", "/devices", "tictactoe_devices", 200, None, None, 10))
+    access_log.close()
+    assert access_log.stats()["written"] == 40
+    assert access_log.rotations > 2
+    assert path.exists() and (tmp_path / "access.log.2").exists()
+    assert not (tmp_path / "access.log.3").exists()
+    assert path.stat().st_size <= 300
+
+
+# ===========================================================
+#  TESTS DE TRAZAS
+# ===========================================================
+
+
+def test_sampled_move_exports_phase_spans(client, app, tmp_path):
+    tracer = app.extensions["tracer"]
+    tracer.sample_rate = 1.0
+    tracer.start()
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match = create_match(client, d1, d2).get_json()
+    x_player = next(pid for pid, sym in match["players"].items() if sym == "X")
+    client.post(
+        f"/matches/{match['match_id']}/moves", json={"device_id": x_player, "x": 0, "y": 0}
+    )
+    tracer.close()
+    assert current_trace() is NO_TRACE
+
+    traces = [
+        json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        for line in (tmp_path / "traces.jsonl").read_text().splitlines()
+    ]
+    assert len(traces) == 5
+    spans = traces[-1]
+    root = spans[0]
+    assert root["name"] == "POST /matches/<match_id>/moves"
+    assert "parentSpanId" not in root
+    assert [s["name"] for s in spans[1:]] == [
+        "parse", "validate", "apply", "check_winner", "stats", "marshal"
+    ]
+    assert all(s["parentSpanId"] == root["spanId"] for s in spans[1:])
+    assert all(s["traceId"] == root["traceId"] for s in spans)
+    starts = [int(s["startTimeUnixNano"]) for s in spans[1:]]
+    assert starts == sorted(starts)
+    assert int(spans[-1]["endTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+    status = next(a for a in root["attributes"] if a["key"] == "http.status_code")
+    assert status["value"] == {"intValue": "200"}
+
+    # El segundo jugador empareja: la reserva del tablero cuelga de la fase lobby
+    pairing = {s["name"]: s for s in traces[-2]}
+    assert pairing["board"]["parentSpanId"] == pairing["lobby"]["spanId"]
+    assert pairing["find_opponent"]["parentSpanId"] == pairing["lobby"]["spanId"]
+
+
+def test_unsampled_requests_write_no_traces(client, app, tmp_path):
+    tracer = app.extensions["tracer"]
+    tracer.start()  # sample_rate 0 por defecto
+    client.post("/devices")
+    tracer.close()
+    assert not (tmp_path / "traces.jsonl").exists()
+    assert tracer.stats()["written"] == 0
+
+
+# ===========================================================
+#  TESTS DEL SERVIDOR DE PRODUCCIÓN
+# ===========================================================
+
+
+def test_serve_reload_keeps_state_and_socket(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("MOVE_JOURNAL_PATH", str(tmp_path / "moves.journal"))
+    monkeypatch.setenv("ACCESS_LOG_PATH", str(tmp_path / "access.log"))
+    monkeypatch.setenv("API_DOCS", "0")
+    master = serve.Master("127.0.0.1", 0, threads=2)
+    master.worker = master.spawn()
+    master.go(master.worker)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", master.port, timeout=10)
+        conn.request("POST", "/devices")
+        res = conn.getresponse()
+        device_id = json.loads(res.read())["device_id"]
+        assert not res.will_close  # keep-alive
+        conn.request("GET", f"/devices/{device_id}/info")
+        assert conn.getresponse().read()
+        conn.close()
+
+        # El trabajador nuevo recupera lo que volcó el anterior
+        old = master.worker
+        master.reload()
+        assert old.returncode == 0
+        conn = http.client.HTTPConnection("127.0.0.1", master.port, timeout=10)
+        conn.request("GET", f"/devices/{device_id}/info")
+        assert conn.getresponse().status == 200
+        conn.close()
+    finally:
+        master.stop_worker(master.worker)
+        master.sock.close()
+    assert len((tmp_path / "access.log").read_text().splitlines()) == 3
+
+
+# ===========================================================
+#  TESTS DEL DIARIO DE MOVIMIENTOS
+# ===========================================================
+
+
+def test_replay_returns_moves_in_order(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    players = create_match(client, d1, d2).get_json()["players"]
+    match_id = next(iter(game.matches))
+    device_x = next(pid for pid, sym in players.items() if sym == "X")
+    device_o = next(pid for pid, sym in players.items() if sym == "O")
+
+    for device, x, y in [(device_x, 0, 0), (device_o, 2, 1), (device_x, 1, 1)]:
+        client.post(
+            f"/matches/{match_id}/moves", json={"device_id": device, "x": x, "y": y}
+        )
+
+    res = client.get(f"/matches/{match_id}/replay")
+    assert res.status_code == 200
+    moves = res.get_json()["moves"]
+    assert [(m["x"], m["y"], m["symbol"]) for m in moves] == [
+        (0, 0, "X"),
+        (2, 1, "O"),
+        (1, 1, "X"),
+    ]
+
+
+def test_journal_survives_reopen(tmp_path):
+    path = tmp_path / "moves.journal"
+    journal = MoveJournal(path)
+    first = journal.new_match_index()
+    journal.append(first, 4, "X")
+    journal.close()
+
+    # Un registro truncado al final no debe romper la lectura
+    with open(path, "ab") as f:
+        f.write(b"\x01\x02")
+
+    reopened = MoveJournal(path)
+    assert reopened.replay(first)[0][:2] == (4, "X")
+    second = reopened.new_match_index()
+    assert second > first
+
+    # Lo que se añade después queda alineado (el registro a medias se recorta al abrir)
+    reopened.append(second, 7, "O")
+    reopened.append(first, 2, "O")
+    reopened.close()
+    again = MoveJournal(path)
+    assert [move[:2] for move in again.replay(first)] == [(4, "X"), (2, "O")]
+    assert [move[:2] for move in again.replay(second)] == [(7, "O")]
+    assert again.replay(second + 1) == []
+
+
+def test_restored_match_without_moves_keeps_its_journal_index(tmp_path):
+    state = game_module.GameState(tmp_path / "moves.journal", tmp_path / "state")
+    state.restore()
+    players = {"a": "X", "b": "O"}
+    state.create_match_record("m1", players, 3, {}, 0.0)
+    state.create_match_record("m2", players, 3, {}, 0.0)  # sin movimientos
+    state.move_journal.append(state.matches["m1"]["index"], 4, "X")
+    state.close()
+
+    restored = game_module.GameState(tmp_path / "moves.journal", tmp_path / "state")
+    restored.restore()
+    restored.create_match_record("m3", players, 3, {}, 0.0)
+    indexes = {match_id: match["index"] for match_id, match in restored.matches.items()}
+    assert len(set(indexes.values())) == 3
+    restored.move_journal.append(indexes["m3"], 0, "X")
+    assert restored.move_journal.replay(indexes["m2"]) == []
+    restored.close()
+
+
+# ===========================================================
+#  TESTS DE PERSISTENCIA (SNAPSHOT + DIARIO DE CAMBIOS)
+# ===========================================================
+
+
+def restored_copy(directory):
+    """Recupera el estado guardado en directory sobre diccionarios nuevos."""
+    tables = {"devices": {}, "matches": {}, "waiting_lobby": {}, "stats": {}}
+    StateStore(directory, tables, threading.RLock()).restore()
+    return tables
+
+
+@pytest.mark.parametrize("use_fork", [True, False])
+def test_state_restored_from_snapshot_and_changes(client, game, tmp_path, use_fork):
+    store = StateStore(
+        tmp_path / "state",
+        {
+            "devices": game.devices,
+            "matches": game.matches,
+            "waiting_lobby": game.waiting_lobby,
+            "stats": game.stats.counters,
+        },
+        game.lock,
+        use_fork=use_fork,
+    )
+    store.enabled = True  # sin hilos: los volcados se hacen a mano
+    game.store = store
+
+    d1 = client.post("/devices", json={"alias": "A"}).get_json()["device_id"]
+    d2 = client.post("/devices", json={"alias": "B"}).get_json()["device_id"]
+    assert store.snapshot()
+
+    # Cambios posteriores al snapshot: solo quedan en el diario
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    turn = game.matches[match_id]["turn"]
+    client.post(f"/matches/{match_id}/moves", json={"device_id": turn, "x": 1, "y": 1})
+    d3 = client.post("/devices").get_json()["device_id"]
+    client.post("/matches", json={"size": 5, "device_id": d3})
+    store.flush()
+
+    restored = restored_copy(tmp_path / "state")
+    assert restored["devices"] == game.devices
+    assert restored["matches"] == game.matches
+    assert restored["waiting_lobby"] == game.waiting_lobby
+    assert restored["stats"] == game.stats.counters
+    assert restored["matches"][match_id]["board"][1][1] != ""
+
+
+def test_state_restore_ignores_truncated_change_batch(tmp_path):
+    tables = {"devices": {}, "matches": {}, "waiting_lobby": {}}
+    store = StateStore(tmp_path, tables, threading.RLock())
+    store.enabled = True
+    tables["devices"]["a"] = {"wins": 1}
+    store.mark_dirty("devices", "a")
+    store.flush()
+    del tables["devices"]["a"]
+    store.mark_dirty("devices", "a")
+    store.flush()
+    store.close()
+
+    # Simula una caída a mitad del último lote
+    log_path = tmp_path / "changes.00000000.log"
+    data = log_path.read_bytes()
+    log_path.write_bytes(data[:-3])
+
+    assert restored_copy(tmp_path)["devices"] == {"a": {"wins": 1}}
+
+
+# ===========================================================
+#  TESTS DE CLASIFICACIÓN
+# ===========================================================
+
+
+def play_win(client, winner_id, loser_id):
+    """Juega una partida 3x3 que gana winner_id completando la fila superior."""
+    data = create_match(client, winner_id, loser_id).get_json()
+    match_id, players = data["match_id"], data["players"]
+    moves = [
+        (winner_id, 0, 0),
+        (loser_id, 1, 0),
+        (winner_id, 0, 1),
+        (loser_id, 1, 1),
+        (winner_id, 0, 2),
+    ]
+    if players[winner_id] == "O":
+        moves = [(loser_id, 2, 0)] + moves[:3] + [(loser_id, 2, 2), (winner_id, 0, 2)]
+    for device, x, y in moves:
+        client.post(
+            f"/matches/{match_id}/moves", json={"device_id": device, "x": x, "y": y}
+        )
+    return match_id
+
+
+def test_leaderboard_pages_and_ranks(client):
+    ids = [client.post("/devices").get_json()["device_id"] for _ in range(4)]
+    winner, loser = ids[0], ids[1]
+    play_win(client, winner, loser)
+    play_win(client, winner, ids[2])
+
+    res = client.get("/leaderboard?by=wins&limit=2")
+    assert res.status_code == 200
+    data = res.get_json()
+    assert data["total"] == 4
+    assert [e["rank"] for e in data["entries"]] == [1, 2]
+    assert data["entries"][0]["device_id"] == winner
+    assert data["entries"][0]["wins"] == 2
+
+    rank = client.get(f"/devices/{winner}/rank?by=ratio").get_json()
+    assert rank["rank"] == 1
+    # Sin victorias, quien no ha perdido va por delante de los que perdieron
+    assert client.get(f"/devices/{ids[3]}/rank").get_json()["rank"] == 2
+    assert {
+        client.get(f"/devices/{d}/rank").get_json()["rank"] for d in (loser, ids[2])
+    } == {3, 4}
+    assert client.get("/leaderboard?by=nope").status_code == 400
+
+
+def test_leaderboard_follows_reset_and_expiry(client, game):
+    winner = client.post("/devices").get_json()["device_id"]
+    loser = client.post("/devices").get_json()["device_id"]
+    play_win(client, winner, loser)
+
+    client.post(f"/devices/{winner}/stats/reset")
+    entries = client.get("/leaderboard").get_json()["entries"]
+    assert all(e["wins"] == 0 for e in entries)
+
+    expire_device(game, loser)
+    client.get("/devices")
+    assert client.get(f"/devices/{loser}/rank").status_code == 404
+    assert client.get("/leaderboard").get_json()["total"] == 1
+
+
+# ===========================================================
+#  TESTS DE RATING Y EMPAREJAMIENTO
+# ===========================================================
+
+
+def test_elo_updated_on_match_result(client):
+    winner = client.post("/devices").get_json()["device_id"]
+    loser = client.post("/devices").get_json()["device_id"]
+    play_win(client, winner, loser)
+
+    rating_winner = client.get(f"/devices/{winner}/info").get_json()["rating"]
+    rating_loser = client.get(f"/devices/{loser}/info").get_json()["rating"]
+    assert rating_winner > INITIAL_RATING > rating_loser
+    assert rating_winner + rating_loser == pytest.approx(2 * INITIAL_RATING)
+
+
+def test_lobby_pairs_closest_rating(client, game):
+    waiting = {}
+    for rating in (900, 1250, 1600):
+        device_id = client.post("/devices").get_json()["device_id"]
+        game.devices[device_id]["rating"] = rating
+        assert client.post("/matches", json={"size": 3, "device_id": device_id}).status_code == 202
+        waiting[rating] = device_id
+
+    joiner = client.post("/devices").get_json()["device_id"]
+    game.devices[joiner]["rating"] = 1300
+    res = client.post("/matches", json={"size": 3, "device_id": joiner})
+    assert res.status_code == 201
+    assert set(res.get_json()["players"]) == {joiner, waiting[1250]}
+    assert waiting[1250] not in game.waiting_lobby
+    assert len(game.waiting_lobby) == 2
+
+
+def test_rating_window_widens_with_wait(client, game, monkeypatch):
+    strong = client.post("/devices").get_json()["device_id"]
+    weak = client.post("/devices").get_json()["device_id"]
+    game.devices[strong]["rating"] = 1200 + rating_window(0) + 200
+    game.devices[weak]["rating"] = 1200
+
+    assert client.post("/matches", json={"size": 4, "device_id": strong}).status_code == 202
+    assert client.post("/matches", json={"size": 4, "device_id": weak}).status_code == 202
+
+    # Tras esperar, la ventana cubre la diferencia y el siguiente sondeo empareja
+    later = game_module.time() + 60
+    monkeypatch.setattr(game_module, "time", lambda: later)
+    res = client.post("/matches", json={"size": 4, "device_id": weak})
+    assert res.status_code == 201
+    assert set(res.get_json()["players"]) == {strong, weak}
+
+
+def test_lobby_index_ignores_other_sizes_and_self():
+    index = LobbyIndex()
+    index.add("a", 3, 1200, 0)
+    index.add("b", 5, 1200, 0)
+    assert index.find_opponent(3, 1200, 0, 0, exclude="a") is None
+    assert index.find_opponent(5, 1210, 0, 0, exclude="c") == "b"
+    index.remove("b")
+    assert index.waiting(5) == 0
+
+
+def long_poll(app, device_id, wait, replies):
+    """POST /matches?wait= desde otro hilo; deja (status, cuerpo, segundos) en replies."""
+    with app.test_client() as other:
+        start = perf_counter()
+        res = other.post(f"/matches?wait={wait}", json={"size": 3, "device_id": device_id})
+        replies.append((res.status_code, res.get_json(), perf_counter() - start))
+
+
+def wait_until(condition, timeout=5.0):
+    start = perf_counter()
+    while not condition():
+        assert perf_counter() - start < timeout
+        sleep(0.01)
+
+
+def test_long_poll_returns_match_as_soon_as_opponent_arrives(app, client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    replies = []
+    waiter = threading.Thread(target=long_poll, args=(app, d1, 10, replies))
+    waiter.start()
+    wait_until(lambda: d1 in game.waiting_lobby)
+
+    res = client.post("/matches", json={"size": 3, "device_id": d2})
+    waiter.join(5)
+    status, match, elapsed = replies[0]
+    assert res.status_code == status == 201
+    assert match["match_id"] == res.get_json()["match_id"]
+    assert elapsed < 2
+    assert game.lobby_waiting == 0 and not game.lobby_waiters
+
+
+def test_long_poll_returns_match_created_in_bulk(app, client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    replies = []
+    waiter = threading.Thread(target=long_poll, args=(app, d1, 10, replies))
+    waiter.start()
+    wait_until(lambda: d1 in game.waiting_lobby)
+
+    res = client.post("/matches/bulk", json={"matches": [{"players": [d2, d1]}]})
+    waiter.join(5)
+    status, match, elapsed = replies[0]
+    assert res.status_code == status == 201
+    assert match["match_id"] == res.get_json()["results"][0]["match_id"]
+    assert elapsed < 2
+    assert d1 not in game.waiting_lobby and game.lobby_waiting == 0
+
+
+def test_long_poll_times_out_is_capped_and_released_on_shutdown(app, client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    start = perf_counter()
+    res = client.post("/matches?wait=0.2", json={"size": 3, "device_id": d1})
+    assert res.status_code == 202 and perf_counter() - start >= 0.2
+
+    # Sin hueco para esperar se responde 202 en el acto
+    game.max_lobby_waiters = 0
+    start = perf_counter()
+    assert client.post("/matches?wait=10", json={"size": 3, "device_id": d1}).status_code == 202
+    assert perf_counter() - start < 1
+
+    game.max_lobby_waiters = 1
+    replies = []
+    waiter = threading.Thread(target=long_poll, args=(app, d1, 10, replies))
+    waiter.start()
+    wait_until(lambda: game.lobby_waiting == 1)
+    game.release_lobby_waiters()
+    waiter.join(5)
+    assert replies[0][0] == 202 and replies[0][2] < 2
+
+    polling = client.get("/polling").get_json()
+    assert (polling["lobby_waits"], polling["lobby_waits_refused"], polling["lobby_waiting"]) == (2, 1, 0)
+
+
+# ===========================================================
+#  TESTS DE CONTROL DE ADMISIÓN
+# ===========================================================
+
+
+def test_polling_storm_gets_429_with_retry_after(client, app):
+    app.config["RATE_LIMIT_ENABLED"] = True
+
+    d1 = client.post("/devices").get_json()["device_id"]
+    codes = [
+        client.post("/matches", json={"size": 3, "device_id": d1}).status_code
+        for _ in range(DEVICE_BURST + 5)
+    ]
+    assert codes[: DEVICE_BURST] == [202] * DEVICE_BURST
+    res = client.post("/matches", json={"size": 3, "device_id": d1})
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) >= 1
+
+    stats = client.get("/ratelimit").get_json()
+    assert stats["device"]["rejected"] >= 6
+    assert stats["device"]["buckets"] == 1
+
+
+def test_match_polling_storm_uses_device_bucket(client, app):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    app.config["RATE_LIMIT_ENABLED"] = True
+
+    url = f"/matches/{match_id}?device_id={d1}"
+    codes = [client.get(url).status_code for _ in range(DEVICE_BURST)]
+    assert codes == [200] * DEVICE_BURST
+    res = client.get(url)
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) >= 1
+    # El rival sigue teniendo su propio cubo
+    assert client.get(f"/matches/{match_id}?device_id={d2}").status_code == 200
+
+
+def test_device_bucket_expires_with_device(client, game, app):
+    app.config["RATE_LIMIT_ENABLED"] = True
+
+    d1 = client.post("/devices").get_json()["device_id"]
+    client.get(f"/devices/{d1}/info")
+    assert len(game.device_limiter) == 1
+    expire_device(game, d1)
+    client.get("/devices")
+    assert len(game.device_limiter) == 0
+
+
+def test_bucket_sweep_runs_alongside_concurrent_requests(app, game):
+    app.config["RATE_LIMIT_ENABLED"] = True
+    game.ip_limiter.sweep_interval = 0  # GET /devices barre los cubos cada vez
+    codes = []
+
+    def burst(worker):
+        with app.test_client() as other:
+            for i in range(100):
+                # Una IP nueva por petición: cada una añade un cubo mientras otras barren
+                res = other.get("/devices", environ_base={"REMOTE_ADDR": f"10.{worker}.{i}.1"})
+                codes.append(res.status_code)
+
+    threads = [threading.Thread(target=burst, args=(worker,)) for worker in range(8)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)  # cambios de hilo frecuentes: más intercalados
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert codes == [200] * 800
+
+
+def test_token_bucket_refills_over_time():
+    limiter = TokenBucketLimiter(rate=2.0, burst=2)
+    assert limiter.allow("k", 0.0) == 0
+    assert limiter.allow("k", 0.0) == 0
+    assert limiter.allow("k", 0.0) == pytest.approx(0.5)
+    assert limiter.allow("k", 0.5) == 0
+    limiter.sweep(100.0)
+    assert len(limiter) == 0
+    assert limiter.stats() == {"allowed": 3, "rejected": 1, "buckets": 0}
+
+
+# ===========================================================
+#  TESTS DE INTERVALOS DE SONDEO
+# ===========================================================
+
+
+def test_lobby_suggests_slow_poll_when_empty(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    res = client.post("/matches", json={"size": 3, "device_id": d1})
+    assert res.status_code == 202
+    assert res.get_json()["retry_after_ms"] == POLL_SLOW_MS
+
+    # Con alguien esperando fuera de la ventana de rating se sondea más a menudo
+    game.devices[d2]["rating"] = 3000
+    res = client.post("/matches", json={"size": 3, "device_id": d2})
+    assert res.status_code == 202
+    assert res.get_json()["retry_after_ms"] == POLL_BASELINE_MS
+
+
+def test_sync_poll_interval_depends_on_turn(client, game, monkeypatch):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    turn = game.matches[match_id]["turn"]
+    other = d2 if turn == d1 else d1
+
+    own = client.get(f"/matches/{match_id}?device_id={turn}").get_json()
+    assert own["retry_after_ms"] == POLL_SLOW_MS
+    waiting = client.get(f"/matches/{match_id}?device_id={other}").get_json()
+    assert waiting["retry_after_ms"] < POLL_BASELINE_MS
+
+    # Si el rival tarda en mover, el intervalo crece hasta el máximo
+    later = main.time() + 60
+    monkeypatch.setattr(main, "time", lambda: later)
+    idle = client.get(f"/matches/{match_id}?device_id={other}").get_json()
+    assert idle["retry_after_ms"] == POLL_SLOW_MS
+
+    stats = client.get("/polling").get_json()
+    assert stats["polls"] == 4  # 3 sincronizaciones + la espera en el lobby
+    assert stats["avg_retry_after_ms"] > 0
+
+
+def test_bulk_create_reports_errors_per_pair(client):
+    ids = [client.post("/devices").get_json()["device_id"] for _ in range(5)]
+    res = client.post(
+        "/matches/bulk",
+        json={
+            "matches": [
+                {"players": [ids[0], ids[1]], "size": 4},
+                {"players": [ids[1], ids[2]]},  # ids[1] ya está en la primera
+                {"players": [ids[2], "nope"]},
+                {"players": [ids[3], ids[3]]},
+                {"players": [ids[3], ids[4]], "size": 9},
+                {"players": [ids[2], ids[3]]},
+            ]
+        },
+    )
+    assert res.status_code == 201
+    data = res.get_json()
+    assert data["created"] == 2 and data["failed"] == 4
+    first, *errors, last = data["results"]
+    assert first["players"] == {ids[0]: "X", ids[1]: "O"}
+    assert first["board_size"] == 4
+    assert all(e["error"] and e["match_id"] is None for e in errors)
+    assert last["error"] is None and last["index"] == 5
+
+    # Las partidas creadas se juegan como cualquier otra
+    res = client.post(
+        f"/matches/{first['match_id']}/moves", json={"device_id": ids[0], "x": 0, "y": 0}
+    )
+    assert res.status_code == 200
+    assert client.get(f"/devices/{ids[1]}/match").get_json()["match_id"] == first["match_id"]
+
+
+def test_bulk_create_bracket_round(client, game):
+    ids = [client.post("/devices").get_json()["device_id"] for _ in range(512)]
+    pairs = [{"players": ids[i : i + 2]} for i in range(0, len(ids), 2)]
+    data = client.post("/matches/bulk", json={"matches": pairs}).get_json()
+    assert data["created"] == 256
+    assert len({r["match_id"] for r in data["results"]}) == 256
+    assert len({game.matches[r["match_id"]]["index"] for r in data["results"]}) == 256
+
+
+def test_spectators_share_one_serialization_per_version(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    turn = game.matches[match_id]["turn"]
+
+    bodies = {client.get(f"/matches/{match_id}").data for _ in range(20)}
+    assert len(bodies) == 1
+    assert client.get(f"/matches/{match_id}").get_json()["turn"] == turn
+
+    client.post(f"/matches/{match_id}/moves", json={"device_id": turn, "x": 0, "y": 0})
+    for _ in range(20):
+        state = client.get(f"/matches/{match_id}").get_json()
+    assert state["board"][0][0] == game.matches[match_id]["players"][turn]
+
+    client.post(f"/matches/{match_id}/surrender", json={"device_id": d1})
+    assert client.get(f"/matches/{match_id}").get_json()["winner"]
+
+    stats = client.get("/polling").get_json()
+    assert stats["spectator_reads"] == 42
+    assert stats["spectator_serializations"] == 3  # una por versión
+
+    # Los jugadores siguen recibiendo su propio intervalo de sondeo
+    player = client.get(f"/matches/{match_id}?device_id={d1}").get_json()
+    assert player["retry_after_ms"] == POLL_BASELINE_MS
+
+
+# ===========================================================
+#  TESTS DE SHARDS
+# ===========================================================
+
+
+def test_active_match_link_follows_match(client, game):
+    d1 = client.post("/devices").get_json()["device_id"]
+    d2 = client.post("/devices").get_json()["device_id"]
+    match_id = create_match(client, d1, d2).get_json()["match_id"]
+    for device_id in (d1, d2):
+        assert game.devices[device_id]["active_match"]["match_id"] == match_id
+    # Volver a pedir partida devuelve la activa sin pasar por el lobby
+    assert client.post("/matches", json={"device_id": d1}).get_json()["match_id"] == match_id
+
+    client.post(f"/matches/{match_id}/surrender", json={"device_id": d1})
+    assert game.devices[d1]["active_match"] is None
+    assert game.devices[d2]["active_match"] is None
+    assert client.get(f"/devices/{d2}/match").status_code == 404
+
+
+def test_hash_ring_spreads_keys_and_new_id_is_local():
+    ring = HashRing(4)
+    owners = [ring.owner(f"device-{i}") for i in range(4000)]
+    assert all(600 < owners.count(shard) < 1400 for shard in range(4))
+    # Añadir un shard solo mueve una parte de las claves
+    bigger = HashRing(5)
+    moved = sum(bigger.owner(f"device-{i}") != owners[i] for i in range(4000))
+    assert moved < 4000 * 0.35
+
+    peers = [("127.0.0.1", 5100 + i) for i in range(4)]
+    shard = ShardClient(2, peers)
+    assert not shard.is_coordinator
+    assert all(ring.owner(shard.new_id()) == 2 for _ in range(20))
+
+
+def test_skiplist_and_leaderboard_build_match_incremental_inserts():
+    keys = sorted(random.sample(range(100_000), 3000))
+    built = IndexableSkipList()
+    built.build(keys)
+    assert list(built) == keys and len(built) == 3000
+    assert [built[i] for i in (0, 1234, 2999)] == [keys[0], keys[1234], keys[2999]]
+    assert built.rank(keys[777]) == 777 and built.bisect_left(keys[10] + 1) == 11
+    # Sigue admitiendo cambios incrementales
+    built.remove(keys[0])
+    built.insert(-1)
+    assert built.page(0, 3) == [-1] + keys[1:3]
+
+    stats = [(f"d{i}", (i % 7, i % 5)) for i in range(500)]
+    board, reference = Leaderboard(), Leaderboard()
+    board.build(stats)
+    for device_id, (wins, losses) in stats:
+        reference.update(device_id, wins, losses)
+    for by in Leaderboard.ORDERS:
+        assert board.page(by, 0, 500) == reference.page(by, 0, 500)
+        assert [board.rank(d, by) for d, _ in stats] == [reference.rank(d, by) for d, _ in stats]
+    board.update("d3", 9, 0)
+    assert board.page("wins", 0, 1) == ["d3"]
+
+
+def test_count_ahead_matches_rank_of_same_stats():
+    board = Leaderboard()
+    for device_id, wins, losses in [("a", 3, 0), ("b", 1, 1), ("c", 0, 2)]:
+        board.update(device_id, wins, losses)
+    assert board.count_ahead("wins", "x", 1, 0) == 1
+    assert board.count_ahead("ratio", "x", 1, 1) == 2  # empate con "b": desempata el id
+    board.update("x", 1, 0)
+    assert board.rank("x", "wins") == board.count_ahead("wins", "x", 1, 0)
+
+
+def test_internal_endpoints_hidden_without_shards(client):
+    res = client.post("/internal/lobby", json={"device_id": "x", "size": 3, "rating": 1200})
+    assert res.status_code == 404
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    """
+    Tres shards en el mismo proceso detrás del router. No se abren
+    conexiones con los shards: sus llamadas van a los clientes de pruebas.
+    Devuelve (apps, servidor del router, shards que no responden).
+    """
+    peers = [("127.0.0.1", 5100 + index) for index in range(3)]
+    apps = [
+        main.create_app(
+            {
+                "TESTING": True,
+                "DOCS": False,
+                "RATE_LIMIT_ENABLED": False,
+                "MOVE_JOURNAL_PATH": tmp_path / f"shard-{index}" / "moves.journal",
+                "STATE_DIR": tmp_path / f"shard-{index}",
+                "ACCESS_LOG_PATH": "",
+                "SHARD_INDEX": index,
+                "SHARD_PEERS": peers,
+            }
+        )
+        for index in range(3)
+    ]
+    down = set()
+
+    def call(shard, method, path, body=None):
+        res = apps[shard].test_client().open(path, method=method, json=body)
+        return res.status_code, res.get_json(silent=True)
+
+    def request(shard, method, path, body=None, headers=None):
+        if shard in down:
+            raise ConnectionRefusedError(path)
+        res = apps[shard].test_client().open(path, method=method, data=body, headers=headers)
+        return res.status_code, list(res.headers.items()), res.data
+
+    for app in apps:
+        app.extensions["tictactoe"].shard.call = call
+    server = router.make_server("127.0.0.1", 0, peers)
+    server.RequestHandlerClass.cluster.request = request
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield apps, server, down
+    server.shutdown()
+    server.server_close()
+    for app in apps:
+        app.extensions["tictactoe"].move_journal.close()
+
+
+def via_router(server, method, path, body=None):
+    """Petición al router por HTTP; devuelve (status, json)."""
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+    payload = json.dumps(body) if body is not None else None
+    conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+    res = conn.getresponse()
+    data = json.loads(res.read())
+    conn.close()
+    return res.status, data
+
+
+def drain_events(apps):
+    """Espera a que los shards hayan entregado sus eventos asíncronos."""
+    for app in apps:
+        app.extensions["tictactoe"].shard.drain()
+
+
+def test_router_pairs_across_shards_and_merges_global_queries(cluster):
+    apps, server, _ = cluster
+    devices = [via_router(server, "POST", "/devices")[1]["device_id"] for _ in range(6)]
+    owners = {
+        device_id: index
+        for index, app in enumerate(apps)
+        for device_id in app.extensions["tictactoe"].devices
+    }
+    # El router reparte las altas y cada dispositivo vive en el shard de su id
+    assert sorted(owners) == sorted(devices)
+    assert {owners[device_id] for device_id in devices} == {0, 1, 2}
+    assert all(HashRing(3).owner(device_id) == owners[device_id] for device_id in devices)
+
+    # Dos dispositivos de shards distintos, ninguno el coordinador
+    d1 = next(d for d in devices if owners[d] == 1)
+    d2 = next(d for d in devices if owners[d] == 2)
+    assert via_router(server, "POST", "/matches", {"size": 3, "device_id": d1})[0] == 202
+    status, match = via_router(server, "POST", "/matches", {"size": 3, "device_id": d2})
+    assert status == 201
+    match_id = match["match_id"]
+    assert match_id in apps[HashRing(3).owner(match_id)].extensions["tictactoe"].matches
+    # El que esperaba se entera en su siguiente sondeo
+    status, found = via_router(server, "POST", "/matches", {"size": 3, "device_id": d1})
+    assert status == 201 and found["match_id"] == match_id
+    assert via_router(server, "GET", f"/devices/{d1}/match")[1]["match_id"] == match_id
+
+    via_router(server, "POST", f"/matches/{match_id}/surrender", {"device_id": d1})
+    drain_events(apps)
+
+    status, listed = via_router(server, "GET", "/devices?all=1")
+    assert status == 200 and sorted(listed["connected_devices"]) == sorted(devices)
+    assert via_router(server, "GET", "/devices/count")[1]["connected"] == 6
+    status, board = via_router(server, "GET", "/leaderboard?by=wins&limit=2")
+    assert status == 200
+    assert board["total"] == 6
+    assert [entry["device_id"] for entry in board["entries"]][0] == d2
+    assert [entry["rank"] for entry in board["entries"]] == [1, 2]
+    _, page = via_router(server, "GET", "/leaderboard?by=wins&offset=5&limit=3")
+    assert [entry["rank"] for entry in page["entries"]] == [6]
+    assert page["entries"][0]["device_id"] == d1  # la derrota la deja la última
+    assert via_router(server, "GET", f"/devices/{d1}/rank")[1]["rank"] == 6
+    assert via_router(server, "GET", "/stats")[1]["finished"] == 1
+
+
+def test_router_reports_failed_shard_in_global_queries(cluster):
+    apps, server, down = cluster
+    device_id = via_router(server, "POST", "/devices")[1]["device_id"]
+    assert via_router(server, "GET", "/devices/unknown/rank")[0] == 404
+
+    down.add(2)
+    status, data = via_router(server, "GET", "/devices/count")
+    assert status == 502
+    assert data["message"] == "El shard 2 no responde"
+    assert via_router(server, "GET", "/leaderboard")[0] == 502
+    if HashRing(3).owner(device_id) != 2:
+        assert via_router(server, "GET", f"/devices/{device_id}/info")[0] == 200
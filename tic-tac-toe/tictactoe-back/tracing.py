@@ -0,0 +1,187 @@
+"""
+Trazas muestreadas de las fases de una petición.
+
+Una fracción `sample_rate` de las peticiones lleva una traza: un span
+raíz para la petición entera y un span hijo por fase (`phase()` cierra
+la anterior y abre la siguiente) o por bloque (`with span():`). El
+resto de peticiones usan NO_TRACE, cuyos métodos no hacen nada, así
+que con el muestreo a 0 solo cuesta una llamada vacía por fase.
+
+La traza activa se guarda en una ContextVar para que game.py pueda
+marcar fases sin depender de Flask. Las trazas terminadas se escriben
+en segundo plano (con el escritor de accesslog.py) como líneas JSON en
+el formato OTLP/JSON de OpenTelemetry: un ExportTraceServiceRequest
+por línea, lo que lee el receptor `otlpjsonfile` del Collector.
+"""
+
+import json
+import os
+import random
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from time import perf_counter_ns, time_ns
+
+from accesslog import AccessLog
+
+SERVICE_NAME = "tictactoe-back"
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_ERROR = 2
+
+
+class Trace:
+    """Spans de una petición muestreada: [id, padre, nombre, inicio, fin, atributos]."""
+
+    __slots__ = ("trace_id", "spans", "_origin", "_base", "_phase", "_current")
+
+    def __init__(self, name, attributes=None):
+        self.trace_id = os.urandom(16).hex()
+        # Tiempos monótonos relativos a un instante de reloj de pared
+        self._origin = time_ns()
+        self._base = perf_counter_ns()
+        root = [os.urandom(8).hex(), None, name, self._origin, None, dict(attributes or {})]
+        self.spans = [root]
+        self._phase = None
+        self._current = root
+
+    def _now(self):
+        return self._origin + perf_counter_ns() - self._base
+
+    def _open(self, name, parent):
+        span = [os.urandom(8).hex(), parent[0], name, self._now(), None, {}]
+        self.spans.append(span)
+        return span
+
+    def phase(self, name):
+        """Cierra la fase en curso y abre otra como hija de la raíz."""
+        now = self._now()
+        if self._phase is not None:
+            self._phase[4] = now
+        self._phase = self._open(name, self.spans[0])
+        self._current = self._phase
+
+    @contextmanager
+    def span(self, name):
+        """Span hijo de la fase en curso mientras dura el bloque."""
+        parent = self._current
+        span = self._open(name, parent)
+        self._current = span
+        try:
+            yield span
+        finally:
+            span[4] = self._now()
+            self._current = parent
+
+    def set(self, key, value):
+        """Añade un atributo al span raíz."""
+        self.spans[0][5][key] = value
+
+    def end(self):
+        """Cierra la fase en curso y la raíz."""
+        now = self._now()
+        for span in self.spans:
+            if span[4] is None:
+                span[4] = now
+
+
+class NoTrace:
+    """Traza de las peticiones no muestreadas: no registra nada."""
+
+    __slots__ = ()
+
+    def phase(self, name):
+        pass
+
+    def span(self, name):
+        return _NULL_SPAN
+
+    def set(self, key, value):
+        pass
+
+
+_NULL_SPAN = nullcontext()
+NO_TRACE = NoTrace()
+_current = ContextVar("trace", default=NO_TRACE)
+
+
+def current_trace():
+    """Traza de la petición en curso (NO_TRACE si no se muestrea)."""
+    return _current.get()
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        wrapped = {"boolValue": value}
+    elif isinstance(value, int):
+        wrapped = {"intValue": str(value)}  # int64 va como cadena en OTLP/JSON
+    elif isinstance(value, float):
+        wrapped = {"doubleValue": value}
+    else:
+        wrapped = {"stringValue": str(value)}
+    return {"key": key, "value": wrapped}
+
+
+def encode_otlp(trace):
+    """Línea OTLP/JSON (ExportTraceServiceRequest) con los spans de una traza."""
+    spans = []
+    for span_id, parent_id, name, start, end, attributes in trace.spans:
+        span = {
+            "traceId": trace.trace_id,
+            "spanId": span_id,
+            "name": name,
+            "kind": SPAN_KIND_INTERNAL if parent_id else SPAN_KIND_SERVER,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(end),
+            "attributes": [_attribute(k, v) for k, v in attributes.items()],
+        }
+        if parent_id:
+            span["parentSpanId"] = parent_id
+        elif attributes.get("http.status_code", 0) >= 500:
+            span["status"] = {"code": STATUS_ERROR}
+        spans.append(span)
+    return json.dumps(
+        {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+                    "scopeSpans": [{"scope": {"name": "tictactoe"}, "spans": spans}],
+                }
+            ]
+        },
+        separators=(",", ":"),
+    )
+
+
+class Tracer:
+    """Decide qué peticiones se trazan y exporta las trazas terminadas."""
+
+    def __init__(self, path, sample_rate=0.0):
+        self.sample_rate = sample_rate
+        self.exporter = AccessLog(path, max_queue=1000, encode=encode_otlp)
+
+    def sample(self):
+        """Decide si la petición en curso se traza."""
+        if not self.sample_rate or not self.exporter.enabled:
+            return False
+        return random.random() < self.sample_rate
+
+    def begin(self, name, attributes=None):
+        """Empieza la traza de la petición en curso. Devuelve el token para finish()."""
+        return _current.set(Trace(name, attributes))
+
+    def finish(self, token, attributes=None):
+        """Termina la traza de la petición y la encola para exportarla."""
+        trace = _current.get()
+        _current.reset(token)
+        trace.end()
+        trace.spans[0][5].update(attributes or {})
+        self.exporter.log(trace)
+
+    def stats(self):
+        return {"sample_rate": self.sample_rate, **self.exporter.stats()}
+
+    def start(self):
+        self.exporter.start()
+
+    def close(self):
+        self.exporter.close()
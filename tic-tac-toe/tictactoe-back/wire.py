@@ -0,0 +1,60 @@
+"""
+Formato binario opcional de la API: MessagePack.
+
+JSON sigue siendo el formato por defecto. Un cliente que envía
+`Accept: application/msgpack` recibe las respuestas en MessagePack y
+puede enviar los cuerpos con `Content-Type: application/msgpack`.
+En ese formato el tablero de los tableros pequeños no va como lista
+de listas de cadenas sino como bytes, uno por casilla y por filas:
+0 libre, b"X" u b"O" (la misma codificación que `cells` en game.py).
+
+msgpack es una dependencia opcional (`uv sync --extra binary`); sin
+ella la API solo habla JSON y las peticiones en MessagePack reciben
+415 como cualquier otro tipo no soportado.
+"""
+
+from flask import make_response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK = "application/msgpack"
+# Otros nombres que usan los clientes para el mismo formato
+MSGPACK_TYPES = {MSGPACK, "application/x-msgpack", "application/vnd.msgpack"}
+
+
+def pack_board(board):
+    """Tablero (lista de filas de "", "X", "O") -> bytes, un byte por casilla."""
+    return bytes(ord(symbol) if symbol else 0 for row in board for symbol in row)
+
+
+def unpack_board(data, size):
+    """Inversa de pack_board (la usan los clientes y los tests)."""
+    return [
+        [chr(byte) if byte else "" for byte in data[row * size : (row + 1) * size]]
+        for row in range(size)
+    ]
+
+
+def _compact(data):
+    # Solo cambia el tablero; el resto de la respuesta se codifica tal cual
+    if isinstance(data, dict) and isinstance(data.get("board"), list):
+        return {**data, "board": pack_board(data["board"])}
+    return data
+
+
+def output_msgpack(data, code, headers=None):
+    """Representación de flask-restx para MessagePack (como output_json)."""
+    resp = make_response(msgpack.packb(_compact(data), use_bin_type=True), code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def decode_msgpack(body):
+    """Cuerpo MessagePack -> objeto. Lanza ValueError si no es válido."""
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except (msgpack.UnpackException, ValueError) as exc:
+        raise ValueError(str(exc)) from exc
@@ -14,9 +14,14 @@ async function safeFetch(url: string, options: RequestInit = {}) {
       },
       ...options,
     });
-    if (!res.ok) {
+    /* 202 = en el lobby esperando oponente: se trata como error para reintentar */
+    if (!res.ok || res.status === 202) {
       const text = await res.text();
-      throw new Error(`HTTP ${res.status}: ${text}`);
+      const error: any = new Error(`HTTP ${res.status}: ${text}`);
+      error.status = res.status;
+      error.body = text;
+      error.retryAfter = res.headers.get('Retry-After'); // segundos (429)
+      throw error;
     }
     return await res.json();
   } catch (err) {
@@ -73,11 +78,25 @@ export async function registerDevice(alias?: string): Promise<string> {
 }
 
 /**
- * Obtiene la lista de dispositivos conectados
+ * Obtiene una página de dispositivos conectados.
+ * Para la siguiente página se pasa el nextCursor devuelto (null = última página).
  */
-export async function getConnectedDevices(): Promise<string[]> {
-  const response = await safeFetch('/devices');
-  return response.connected_devices;
+export async function getConnectedDevices(
+  cursor?: string,
+  limit = 100
+): Promise<{ devices: string[]; nextCursor: string | null }> {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (cursor) params.set('cursor', cursor);
+  const response = await safeFetch(`/devices?${params}`);
+  return { devices: response.connected_devices, nextCursor: response.next_cursor };
+}
+
+/**
+ * Obtiene el número de dispositivos conectados
+ */
+export async function getConnectedCount(): Promise<number> {
+  const response = await safeFetch('/devices/count');
+  return response.connected;
 }
 
 /**
@@ -87,6 +106,7 @@ export async function getDeviceInfo(deviceId: string): Promise<{
   connected: boolean;
   wins: number;
   losses: number;
+  draws: number;
   ratio: number;
 }> {
   return await safeFetch(`/devices/${deviceId}/info`);
@@ -99,6 +119,7 @@ export async function resetDeviceStats(deviceId: string): Promise<{
   message: string;
   wins: number;
   losses: number;
+  draws: number;
 }> {
   return await safeFetch(`/devices/${deviceId}/stats/reset`, {
     method: 'POST',
@@ -122,7 +143,17 @@ export async function createMatch(size?: number, deviceId?: string): Promise<{
 }
 
 /**
- * Realiza un movimiento en la partida
+ * Casilla ocupada (tableros grandes y cambios de un movimiento)
+ */
+export interface Stone {
+  x: number;
+  y: number;
+  symbol: string;
+}
+
+/**
+ * Realiza un movimiento en la partida.
+ * Si falla la red se reintenta una vez con la misma Idempotency-Key.
  */
 export async function makeMove(
   matchId: string,
@@ -130,27 +161,60 @@ export async function makeMove(
   x: number,
   y: number
 ): Promise<{
-  board: string[][];
+  board: string[][] | null; // null en tableros de 15x15 y 19x19
+  changes: Stone[];
   next_turn: string | null;
   winner: string | null;
+  draw: boolean; // ya no queda ninguna línea ganable
 }> {
-  return await safeFetch(`/matches/${matchId}/moves`, {
+  /* Misma clave en el reintento: si el primer intento llegó, el servidor repite su respuesta */
+  const key = `${deviceId}-${Date.now()}-${Math.random().toString(36).slice(2)}`;
+  const options: RequestInit = {
     method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'Idempotency-Key': key },
     body: JSON.stringify({ device_id: deviceId, x, y }),
-  });
+  };
+  try {
+    return await safeFetch(`/matches/${matchId}/moves`, options);
+  } catch (err: any) {
+    if (err?.status !== undefined) throw err; // respuesta de error del servidor, no fallo de red
+    return await safeFetch(`/matches/${matchId}/moves`, options);
+  }
 }
 
 /**
- * Obtiene el estado actual de una partida
+ * Obtiene el estado actual de una partida.
+ * Con deviceId el servidor sugiere cuándo volver a sondear (retry_after_ms).
  */
-export async function getMatchState(matchId: string): Promise<{
-  board: string[][];
+export async function getMatchState(matchId: string, deviceId?: string): Promise<{
+  board: string[][] | null; // null en tableros de 15x15 y 19x19
+  stones: Stone[] | null; // casillas ocupadas en tableros de 15x15 y 19x19
   turn: string;
   winner: string | null;
+  draw: boolean; // ya no queda ninguna línea ganable
   size: number;
   players: { [deviceId: string]: string };
+  opponent_left?: boolean;
+  retry_after_ms?: number;
 }> {
-  return await safeFetch(`/matches/${matchId}`);
+  const query = deviceId ? `?device_id=${encodeURIComponent(deviceId)}` : '';
+  return await safeFetch(`/matches/${matchId}${query}`);
+}
+
+/**
+ * Extrae el intervalo de sondeo sugerido de un error 202/429 del servidor:
+ * retry_after_ms del cuerpo o, si no viene, la cabecera Retry-After (segundos)
+ */
+export function retryAfterMs(err: any, fallback: number): number {
+  try {
+    const hint = JSON.parse(err?.body ?? '{}').retry_after_ms;
+    if (typeof hint === 'number') return hint;
+  } catch {
+    /* cuerpo no JSON */
+  }
+  const seconds = Number(err?.retryAfter);
+  if (err?.retryAfter && Number.isFinite(seconds) && seconds >= 0) return seconds * 1000;
+  return fallback;
 }
 
 /**